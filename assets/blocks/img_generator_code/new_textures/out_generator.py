@@ -6,32 +6,32 @@ if __name__ == "__main__":
     with open("../names_list.json", "r") as f:
         data: dict = json.load(f)
 
-    new_structure = {}
     sides = ['top', 'bottom', 'side', 'front', 'back']
-    for index, key in enumerate(data.keys()):
+    # Every texture is only loaded once, even if it is used by many blocks or sides
+    textures = sorted({data[key][side] for key in data for side in sides if side in data[key]})
+    pixels = {}
+    for texture in textures:
+        with Image.open(f"../../all_blocks_textures/{texture}") as img:
+            pixels[texture] = np.asarray(img.convert("RGBA"))
+
+    # The textures of the same size are stacked and all done at once
+    colours = {}
+    by_shape = {}
+    for texture in textures:
+        by_shape.setdefault(pixels[texture].shape, []).append(texture)
+    for shape, names in by_shape.items():
+        colour_sets = all_colour_sets(np.stack([pixels[texture] for texture in names]))
+        for index, texture in enumerate(names):
+            colours[texture] = {name: colour_sets[name][index].tolist() for name in colour_sets}
+        print(f"Done: {len(names)} textures of size {shape[1]}x{shape[0]}")
+
+    new_structure = {}
+    for key in data.keys():
         new_structure[key] = {}
         for side in sides:
             if side in data[key]:
                 texture = data[key][side]
-                new_structure[key][side] = {'file': texture}
-                img = Image.open(f"../../all_blocks_textures/{texture}")
-                img = img.convert("RGBA")
-                linear_avg_col = linear_avg_rgb(img)
-                rms_avg_col = rms_rgb_color(img)
-                avg_hsl_col = average_hsl_colour(img)
-                avg_hsv_col = average_hsv_colour(img)
-                avg_lab_col = average_lab_colour(img)
-                dominant_col = dominant_colour(img)
-                new_structure[key][side]['color'] = {
-                    'Linear Average': linear_avg_col,
-                    'Root Mean Square Average': rms_avg_col,
-                    'HSL Average': avg_hsl_col,
-                    'HSV Average': avg_hsv_col,
-                    'LAB Average': avg_lab_col,
-                    'Dominant Color': dominant_col
-                }
-                img.close()
-        print(f"Done: {key}, Progress: {index}/{len(data.keys())}")
+                new_structure[key][side] = {'file': texture, 'color': colours[texture]}
 
     with open("../out_all_colours.json", "w") as f:
         json.dump(new_structure, f, indent=4)
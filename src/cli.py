@@ -9,6 +9,8 @@ from tqdm import tqdm
 # 复用现有逻辑
 from src.logic.image_logic.image_manager import manipulate_image
 from src.logic.vid_logic.vid_manager import vid_manager
+from src.logic.image_logic.dithering import DITHER_METHODS, DEFAULT_DITHER_METHOD
+from src.logic.image_logic import palette_bundle, resource_pack
 
 SUPPORTED_IMG_EXTS = {".png", ".jpg", ".jpeg", ".PNG", ".JPG", ".JPEG"}
 SUPPORTED_VIDEO_EXTS = {".mp4", ".mov", ".mkv", ".avi", ".webm", ".m4v"}
@@ -91,12 +93,19 @@ def build_image_details(args) -> dict:
         'blocklist': merged_blocklist,
         'mode': args.mode,
         'dither': args.dither,
+        'dither_method': args.dither_method,
+        'serpentine': args.serpentine,
         'alternate': args.alternate,
         'color_set': wrap_color(args.color_set),
         'color_compare': wrap_compare(args.color_compare),
         'side': args.side.lower(),
         'brightness': args.brightness,
-        'place_redstone_blocks': args.place_redstone_blocks
+        'place_redstone_blocks': args.place_redstone_blocks,
+        'lut_bits': args.lut_bits,
+        'block_dither': args.block_dither,
+        'block_dither_space': args.block_dither_space,
+        'match_backend': args.match_backend,
+        'stream_pixel_budget': args.stream_pixel_budget
     }
 
 def do_image(args):
@@ -208,32 +217,47 @@ def do_video(args):
         'quality': args.quality,
         'frame_rate': args.fps,
         'dither': args.dither,
+        'dither_method': args.dither_method,
+        'serpentine': args.serpentine,
         'alternate': args.alternate,
         'color_set': wrap_color(args.color_set),
         'color_compare': wrap_compare(args.color_compare),
         'side': args.side.lower(),
         'brightness': args.brightness,
-        'process_count': max(1, min(16, args.processes))
+        'process_count': max(1, min(16, args.processes)),
+        'lut_bits': args.lut_bits,
+        'block_dither': args.block_dither,
+        'block_dither_space': args.block_dither_space,
+        'match_backend': args.match_backend,
+        'frame_pipe': not args.no_pipe,
+        'delta': args.delta,
+        'skip_duplicates': args.skip_duplicates or bool(args.skip_threshold),
+        'skip_threshold': args.skip_threshold,
+        'decode_segments': args.segments,
+        'resume': args.resume,
+        'max_in_flight': max(0, args.max_in_flight),
+        'place_redstone_blocks': args.place_redstone_blocks
     }
 
-    # —— 决定输出路径：目录→自动命名；文件→强制 .mp4 ——
+    # —— 决定输出路径：目录→自动命名；文件→强制 .mp4（原理图类型为 .zip 动画包） ——
+    out_ext = ".zip" if args.kind.endswith('-schem') else ".mp4"
     out_arg = args.output
     in_dir = os.path.dirname(args.input) or "."
-    def _auto_name_mp4(dst_dir: str) -> str:
+    def _auto_name(dst_dir: str) -> str:
         os.makedirs(dst_dir, exist_ok=True)
-        return os.path.join(dst_dir, f"output{timestamp()}.mp4")
+        return os.path.join(dst_dir, f"output{timestamp()}{out_ext}")
 
     if not out_arg:
-        output = _auto_name_mp4(in_dir)            # 未指定 → 放到原视频目录
+        output = _auto_name(in_dir)                # 未指定 → 放到原视频目录
     else:
         out_arg = out_arg.rstrip()
         root, ext = os.path.splitext(out_arg)
         if os.path.isdir(out_arg) or out_arg.endswith(('/', '\\')) or ext == "":
-            output = _auto_name_mp4(out_arg)       # 目录或无扩展名 → 目录自动命名
+            output = _auto_name(out_arg)           # 目录或无扩展名 → 目录自动命名
         else:
-            if ext.lower() != ".mp4":              # 指定了文件名但不是 .mp4 → 改成 .mp4
-                print(f"[warn] 输出扩展名 {ext} 非 .mp4，已改为 .mp4")
-                output = root + ".mp4"
+            if ext.lower() != out_ext:             # 指定了文件名但扩展名不对 → 改掉
+                print(f"[warn] 输出扩展名 {ext} 非 {out_ext}，已改为 {out_ext}")
+                output = root + out_ext
             else:
                 output = out_arg
 
@@ -245,7 +269,8 @@ def do_video(args):
     state = {
         "frame_total": None,
         "extract_last": 0.0,
-        "process_done": 0
+        "process_done": 0,
+        "skipped": 0
     }
 
     def cli_progress(ev):
@@ -272,6 +297,10 @@ def do_video(args):
             if bars["process"]:
                 bars["process"].update(1)
                 state["process_done"] += 1
+        elif name == '-Frames_Skipped-':
+            state["skipped"] = int(payload)
+            if bars["process"]:
+                bars["process"].set_postfix(skipped=state["skipped"], refresh=False)
         # 单帧内 0~100 的细颗粒进度不额外画条，避免刷屏
 
     vid_manager(
@@ -292,6 +321,22 @@ def do_video(args):
                 bars[key].update(remain)
             bars[key].close()
 
+    if state["skipped"]:
+        print(f"[info] 跳过了 {state['skipped']} 个重复帧（直接复用上一帧）")
+    print(f"[ok] saved to: {output}")
+
+def do_palette(args):
+    if args.input and not os.path.exists(args.input):
+        print(f"[warn] 找不到资源包：{args.input}")
+        return
+    output = args.output or palette_bundle.bundle_path
+    processes = max(1, args.processes or os.cpu_count() or 1)
+    print(f"[info] 正在读取贴图并计算平均色（{processes} 个进程）：{args.input or '内置贴图'}")
+    compiled = resource_pack.compile_pack(args.input, processes, args.add_new, args.pack_only)
+    palette_bundle.write_bundle(output, compiled)
+    print(f"[info] {len(compiled.names)} 个方块，{len(compiled.texture_files)} 张贴图")
+    if os.path.abspath(output) != os.path.abspath(palette_bundle.bundle_path):
+        print(f"[info] 使用该色板：设置环境变量 {palette_bundle.PALETTE_ENV}={output}")
     print(f"[ok] saved to: {output}")
 
 # ========== 参数解析 ==========
@@ -306,6 +351,14 @@ def build_parser():
         sp.add_argument('--blocklist-file', help='从文本文件读取黑名单/白名单，每行一个，支持注释行(# 或 //)')
         sp.add_argument('--color-set', help='颜色聚合方式，如 "Linear Average"/"RMS Average"/"HSL"/"HSV"/"Lab"/"Dominant"（依据资源数据命名）')
         sp.add_argument('--color-compare', help='颜色差异算法，如 "Absolute Difference"/"Euclidean Difference"/"Weighted Euclidean"/"Redmean Difference"/"CIE76 DelE"')
+        sp.add_argument('--match-backend', default='brute', choices=['brute', 'kdtree'], help='最近方块搜索方式：brute=逐个比较；kdtree=空间索引（需 scipy，仅对 Euclidean/Weighted Euclidean/CIE76 生效，结果与 brute 相同）')
+        sp.add_argument('--lut-bits', type=int, choices=[5, 6, 7, 8], help='使用预计算的 RGB→方块查找表（每通道位数，8=精确；首次运行会生成并缓存到 assets/cache/lut）')
+        sp.add_argument('--block-dither', choices=list(DITHER_METHODS), help='任意方块模式的抖动：把颜色误差分给周围的方块（误差扩散按行处理；bayer-N 为有序抖动，视频中更稳定）；不指定则只取最接近的方块')
+        sp.add_argument('--block-dither-space', default='rgb', choices=['rgb', 'lab'], help='抖动误差在哪个颜色空间中计算（lab 时按 CIE76 匹配方块）')
+
+    def lamp_dither_args(sp):
+        sp.add_argument('--dither-method', default=DEFAULT_DITHER_METHOD, choices=list(DITHER_METHODS), help='Lamps 抖动算法：误差扩散（floyd-steinberg/atkinson/jarvis-judice-ninke/sierra）或有序抖动 bayer-N（固定图案，视频更稳定、更快）；--brightness 同样生效')
+        sp.add_argument('--serpentine', action='store_true', help='误差扩散时隔行反向扫描（蛇形），减少斜向纹理')
 
     # image
     pi = sub.add_parser('image', help='处理单张图片或目录（目录将批量处理）')
@@ -316,8 +369,10 @@ def build_parser():
     pi.add_argument('--crop', help='裁剪区域：x1,y1,x2,y2；x2/y2 可用 max')
     pi.add_argument('--brightness', type=int, default=127, help='Lamps 模式阈值（0~255）')
     pi.add_argument('--dither', action='store_true', help='Lamps 使用抖动')
+    lamp_dither_args(pi)
     pi.add_argument('--alternate', action='store_true', help='Lamps 使用 alternate 模式')
     pi.add_argument('--place-redstone-blocks', action='store_true', help='Lamps schematic 在灯下放置红石块')
+    pi.add_argument('--stream-pixel-budget', type=int, help='any-image 输出超过该像素数（宽*高）时按行带流式写入 png，降低内存占用（默认 64000000）')
     common_block_args(pi)
     pi.set_defaults(func=do_image)
 
@@ -328,14 +383,32 @@ def build_parser():
     pv.add_argument('-o','--output', help='输出文件路径（默认放到 ./mcIVASMAKER_output）')
     pv.add_argument('--scale', type=float, default=1.0, help='缩放倍数（1.0=原尺寸，0.5=一半，2.0=两倍）')
     pv.add_argument('--fps', type=int, default=12, help='抽帧帧率（与 GUI 滑条一致）')
-    pv.add_argument('--quality', action='store_true', help='使用 PNG 中间帧（更高质量更慢）；不指定则使用 JPG')
+    pv.add_argument('--quality', action='store_true', help='使用 PNG 中间帧（更高质量更慢）；不指定则使用 JPG（仅 --no-pipe 时有效）')
+    pv.add_argument('--no-pipe', action='store_true', help='不使用管道模式：逐帧导出到缓存文件夹再处理（旧流程）；默认 any-image/lamps-image 直接通过 ffmpeg 管道传递原始帧')
+    pv.add_argument('--resume', action='store_true', help='继续上次中断的转换（同一输入视频与相同设置）：只处理还没完成的帧；不指定则从头开始；原理图动画不支持')
+    pv.add_argument('--segments', type=int, default=0, help='缓存文件夹流程中同时解码的 ffmpeg 数量（每个按关键帧对齐的小段轮流解码；0=自动：每 2 分钟一个，最多 4 个；1=只用一个；原理图动画不支持）')
+    pv.add_argument('--max-in-flight', type=int, default=0, help='同时在处理中的最多帧数（解码后、编码前；缓存文件夹流程中也是磁盘上最多的帧数），内存/磁盘占用不随视频长度增长（0=自动：缓存文件夹 240 帧，管道模式按进程数）')
     pv.add_argument('--brightness', type=int, default=127, help='Lamps 模式阈值')
     pv.add_argument('--dither', action='store_true', help='Lamps 使用抖动')
+    lamp_dither_args(pv)
     pv.add_argument('--alternate', action='store_true', help='Lamps 使用 alternate 模式')
+    pv.add_argument('--place-redstone-blocks', action='store_true', help='Lamps schematic 在灯下放置红石块')
     pv.add_argument('--processes', type=int, default=2, help='并行处理进程数（1~16）')
+    pv.add_argument('--delta', action='store_true', help='增量渲染：每个进程连续处理几帧，只重新匹配/绘制与上一帧不同的方块（结果不变，仅管道模式）')
+    pv.add_argument('--skip-duplicates', action='store_true', help='跳过缩放后与上一帧完全相同的帧，直接重复上一帧的输出（仅管道模式）')
+    pv.add_argument('--skip-threshold', type=float, help='近似重复帧阈值：缩放后与上一次渲染帧的平均绝对差（0~255）不超过该值也跳过；指定后自动开启 --skip-duplicates')
     common_block_args(pv)
     pv.set_defaults(func=do_video)
 
+    # palette
+    pp = sub.add_parser('palette', help='从 Minecraft 资源包生成方块色板（平均色、贴图、方块状态打包为一个二进制文件，启动时内存映射加载）')
+    pp.add_argument('-i','--input', help='资源包文件夹或 zip（版本 jar 也可以）；资源包里没有的贴图用内置贴图；不指定则只用内置贴图')
+    pp.add_argument('-o','--output', help=f'输出文件（默认 {os.path.relpath(palette_bundle.bundle_path)}，转换时自动使用；其他路径需设置环境变量 {palette_bundle.PALETTE_ENV}）')
+    pp.add_argument('--processes', type=int, default=0, help='并行计算平均色的进程数（0=CPU 核数）')
+    pp.add_argument('--add-new', action='store_true', help='把 names_list.json 里没有的资源包贴图也加为新方块（按 _top/_side/_bottom/_front/_back 后缀分面；可能包含非完整方块，建议配合白名单使用）')
+    pp.add_argument('--pack-only', action='store_true', help='只保留至少有一张贴图来自资源包的方块')
+    pp.set_defaults(func=do_palette)
+
     return p
 
 def main(argv=None):
@@ -395,6 +468,8 @@ def main(argv=None):
                     quality = False
                     brightness = 127
                     dither = False
+                    dither_method = DEFAULT_DITHER_METHOD
+                    serpentine = False
                     alternate = False
                     processes = 2
                     side = 'top'
@@ -403,6 +478,18 @@ def main(argv=None):
                     blocklist_file = None
                     color_set = None
                     color_compare = None
+                    lut_bits = None
+                    match_backend = 'brute'
+                    block_dither = None
+                    block_dither_space = 'rgb'
+                    no_pipe = False
+                    delta = False
+                    skip_duplicates = False
+                    skip_threshold = None
+                    segments = 0
+                    resume = False
+                    max_in_flight = 0
+                    place_redstone_blocks = False
                 do_video(SimpleArgsV())
             else:
                 # —— 构造简单图片参数并调用 do_image ——
@@ -414,14 +501,21 @@ def main(argv=None):
                     crop = None
                     brightness = 127
                     dither = False
+                    dither_method = DEFAULT_DITHER_METHOD
+                    serpentine = False
                     alternate = False
                     place_redstone_blocks = False
+                    stream_pixel_budget = None
                     side = 'top'
                     mode = 'All'
                     blocklist = []
                     blocklist_file = None
                     color_set = None
                     color_compare = None
+                    lut_bits = None
+                    match_backend = 'brute'
+                    block_dither = None
+                    block_dither_space = 'rgb'
                 do_image(SimpleArgsI())
             return
 
@@ -3,168 +3,230 @@ import colorsys
 import math
 import numpy as np
 
+# Every function takes a texture (a PIL image, or a (H, W, 4) RGBA array) and gives back its colour as [r, g, b, a],
+# or takes a whole (N, H, W, 4) stack of textures of the same size and gives back a (N, 4) array of colours.
+# They used to go through every pixel with getpixel, now all the pixels of all the textures are done at once with numpy.
+# The maths is still done in the same order (the sums are running sums, over the columns of a texture one after
+# the other, like the loops did), so the colours come out exactly the same as before.
 
-# Everything is stored as rgb, just conversions are different
-def linear_avg_rgb(image: Image.Image) -> list:
-    avg_color = [0, 0, 0, 0]
-    counter = 0
-    for i in range(image.width):
-        for j in range(image.height):
-            pixel = image.getpixel((i, j))
-            for k in range(4):
-                avg_color[k] += pixel[k]
-            counter += 1
 
-    return [round(avg_color[i] / counter) for i in range(4)]
+# Everything is stored as rgb, just conversions are different
+def linear_avg_rgb(image) -> list | np.ndarray:
+    textures, single = _stack(image)
+    counter = textures.shape[1] * textures.shape[2]
+    totals = textures.sum(axis=(1, 2), dtype=np.int64)
+    return _colors(np.rint(totals / counter), single)
 
 
 # sqrt((R1^2+R2^2)/2),sqrt((G1^2+G2^2)/2),sqrt((B1^2+B2^2)/2)
-def rms_rgb_color(image: Image.Image) -> list:
-    average_red = 0.0
-    average_green = 0.0
-    average_blue = 0.0
-    average_alpha = 0.0
-    for x in range(image.width):
-        for y in range(image.height):
-            pixel = image.getpixel((x, y))
-            average_red += pixel[0] * pixel[0]
-            average_green += pixel[1] * pixel[1]
-            average_blue += pixel[2] * pixel[2]
-            average_alpha += pixel[3] * pixel[3]
-
-    average_red = average_red / (image.width * image.height)
-    average_green = average_green / (image.width * image.height)
-    average_blue = average_blue / (image.width * image.height)
-    average_alpha = average_alpha / (image.width * image.height)
-    return [round(average_red ** 0.5), round(average_green ** 0.5), round(average_blue ** 0.5),
-            round(average_alpha ** 0.5)]
-
-
-def average_hsl_colour(image: Image.Image) -> list:
-    average_hue_x = 0.0
-    average_hue_y = 0.0
-    average_sat = 0.0
-    average_lightness = 0.0
-    average_alpha = 0.0
-    max_count = float(image.width * image.height)
-    for x in range(image.width):
-        for y in range(image.height):
-            colour = image.getpixel((x, y))
-            # Hue is cyclic, so gotta do
-            # theta = [355,5,5,5,5];
-            # x = cosd(theta); % cosine in terms of degrees
-            # y = sind(theta); % sine with a degree argument
-            # meanangle = atan2(mean(y),mean(x))*180/pi
-            hsl = colorsys.rgb_to_hls(colour[0] / 255.0, colour[1] / 255.0, colour[2] / 255.0)
-            # h is given from 0 to 1, to make it radians, it must be from 0 to 2pi
-            average_hue_x += math.cos(hsl[0] * 2 * math.pi)
-            average_hue_y += math.sin(hsl[0] * 2 * math.pi)
-            average_sat += hsl[1] * 100
-            average_lightness += hsl[2] * 100
-            average_alpha += colour[3]
-
-    average_hue = math.atan2(average_hue_y / max_count, average_hue_x / max_count) * 180 / math.pi
-    average_sat /= max_count
-    average_lightness /= max_count
-    average_alpha /= max_count
-
-    # Back to rgb
-    rgb = colorsys.hls_to_rgb(average_hue / 360, average_sat / 100, average_lightness / 100)
-    return [round(rgb[0] * 255), round(rgb[1] * 255), round(rgb[2] * 255), round(average_alpha)]
-
-
-def average_hsv_colour(image: Image.Image) -> list:
-    average_hue_x = 0.0
-    average_hue_y = 0.0
-    average_sat = 0.0
-    average_value = 0.0
-    average_alpha = 0.0
-    max_count = float(image.width * image.height)
-    for x in range(image.width):
-        for y in range(image.height):
-            colour = image.getpixel((x, y))
-            # Hue is cyclic, so gotta do
-            # theta = [355,5,5,5,5];
-            # x = cosd(theta); % cosine in terms of degrees
-            # y = sind(theta); % sine with a degree argument
-            # meanangle = atan2(mean(y),mean(x))*180/pi
-            hsv = colorsys.rgb_to_hsv(colour[0] / 255.0, colour[1] / 255.0, colour[2] / 255.0)
-            # h is given from 0 to 1, to make it radians, it must be from 0 to 2pi
-            average_hue_x += math.cos(hsv[0] * 2 * math.pi)
-            average_hue_y += math.sin(hsv[0] * 2 * math.pi)
-            average_sat += hsv[1] * 100
-            average_value += hsv[2] * 100
-            average_alpha += colour[3]
-
-    average_hue = (math.atan2(average_hue_y / max_count, average_hue_x / max_count) * 180 / math.pi) % 360
-    average_sat /= max_count
-    average_value /= max_count
-    average_alpha /= max_count
-
-    # Back to rgb
-    rgb = colorsys.hsv_to_rgb(average_hue / 360, average_sat / 100, average_value / 100)
-    return [round(rgb[0] * 255), round(rgb[1] * 255), round(rgb[2] * 255), round(average_alpha)]
-
-
-def average_lab_colour(image: Image.Image) -> list:
-    rgb_image = image.convert("RGB")
-    # Convert to Lab colourspace
-    srgb_p = ImageCms.createProfile("sRGB")
-    lab_p = ImageCms.createProfile("LAB")
-
-    rgb2lab = ImageCms.buildTransformFromOpenProfiles(srgb_p, lab_p, "RGB", "LAB")
-    Lab = ImageCms.applyTransform(rgb_image, rgb2lab)
-
-    max_count = float(image.width * image.height)
-    average_l = 0.0
-    average_a = 0.0
-    average_b = 0.0
-    for x in range(image.width):
-        for y in range(image.height):
-            colour = Lab.getpixel((x, y))
-            average_l += colour[0]
-            average_a += colour[1]
-            average_b += colour[2]
-
-    average_l /= max_count
-    average_a /= max_count
-    average_b /= max_count
-
-    temp_img = Image.new("LAB", size=(image.width, image.height))
-    for x in range(image.width):
-        for y in range(image.height):
-            temp_img.putpixel((x, y), (round(average_l), round(average_a), round(average_b)))
-
-    lab2rgb = ImageCms.buildTransformFromOpenProfiles(lab_p, srgb_p, "LAB", "RGB")
-    back_rgb = ImageCms.applyTransform(temp_img, lab2rgb)
-    col = back_rgb.getpixel((0, 0))
-
+def rms_rgb_color(image) -> list | np.ndarray:
+    textures, single = _stack(image)
+    return _colors(_rms(textures, slice(0, 4)), single)
+
+
+def average_hsl_colour(image) -> list | np.ndarray:
+    textures, single = _stack(image)
+    rgb = _pixels_in_order(textures)[:, :, :3] / 255.0
+    hue, lightness, saturation = _rgb_to_hls(rgb[:, :, 0], rgb[:, :, 1], rgb[:, :, 2])
+    # (Named the other way around in the loop: the lightness went into average_sat, and back into the lightness)
+    average_hue, average_sat, average_lightness, average_alpha = _circular_averages(
+        textures, hue, lightness * 100, saturation * 100
+    )
+
+    colors = []
+    for index in range(textures.shape[0]):
+        # Back to rgb
+        rgb = colorsys.hls_to_rgb(average_hue[index] / 360, average_sat[index] / 100, average_lightness[index] / 100)
+        colors.append([round(rgb[0] * 255), round(rgb[1] * 255), round(rgb[2] * 255), round(average_alpha[index])])
+    return _colors(colors, single)
+
+
+def average_hsv_colour(image) -> list | np.ndarray:
+    textures, single = _stack(image)
+    rgb = _pixels_in_order(textures)[:, :, :3] / 255.0
+    hue, saturation, value = _rgb_to_hsv(rgb[:, :, 0], rgb[:, :, 1], rgb[:, :, 2])
+    average_hue, average_sat, average_value, average_alpha = _circular_averages(
+        textures, hue, saturation * 100, value * 100
+    )
+    average_hue %= 360
+
+    colors = []
+    for index in range(textures.shape[0]):
+        # Back to rgb
+        rgb = colorsys.hsv_to_rgb(average_hue[index] / 360, average_sat[index] / 100, average_value[index] / 100)
+        colors.append([round(rgb[0] * 255), round(rgb[1] * 255), round(rgb[2] * 255), round(average_alpha[index])])
+    return _colors(colors, single)
+
+
+def average_lab_colour(image) -> list | np.ndarray:
+    textures, single = _stack(image)
+    count, height, width = textures.shape[:3]
+    # Convert to Lab colourspace, all the textures in one (tall) image
+    rgb_image = Image.fromarray(np.ascontiguousarray(textures[:, :, :, :3]).reshape(count * height, width, 3))
+    srgb_to_lab, lab_to_srgb = _lab_transforms()
+    lab = np.asarray(ImageCms.applyTransform(rgb_image, srgb_to_lab)).reshape(count, height, width, -1)[..., :3]
+    # The raw a and b bytes are signed, the loop summed them as getpixel gives them (0 to 255, 128 being grey)
+    lab = lab ^ _LAB_AB_FLIP
+    averages = np.rint(lab.sum(axis=(1, 2), dtype=np.int64) / float(height * width))
+
+    # Back to rgb, one pixel per texture (the transform is done pixel by pixel,
+    # so it is the same as filling a whole image with the average colour)
+    average_image = Image.new("LAB", (count, 1))
+    average_image.frombytes((averages.astype(np.uint8) ^ _LAB_AB_FLIP).tobytes())
+    back_rgb = np.asarray(ImageCms.applyTransform(average_image, lab_to_srgb))[0, :, :3]
+
+    colors = np.empty((count, 4), dtype=np.int64)
+    colors[:, :3] = back_rgb
     # Get average average alpha
-    average_alpha = 0.0
-    for x in range(image.width):
-        for y in range(image.height):
-            pixel = image.getpixel((x, y))
-            average_alpha += pixel[3] * pixel[3]
-
-    average_alpha = average_alpha / max_count
-    return [col[0], col[1], col[2], round(average_alpha ** 0.5)]
+    colors[:, 3] = _rms(textures, slice(3, 4))[:, 0]
+    return _colors(colors, single)
 
 
 # https://stackoverflow.com/a/50900143
-def dominant_colour(image: Image.Image) -> list:
-    img_arr = np.asarray(image.convert('RGB'))
-    a2D = img_arr.reshape(-1, img_arr.shape[-1])
-    col_range = (256, 256, 256)  # generically : a2D.max(0)+1
-    a1D = np.ravel_multi_index(a2D.T, col_range)
-    rgb = list(np.unravel_index(np.bincount(a1D).argmax(), col_range))
-
+def dominant_colour(image) -> list | np.ndarray:
+    textures, single = _stack(image)
+    count = textures.shape[0]
+    # Every colour of every texture as one number: texture index, then rgb
+    rgb = textures[:, :, :, :3].reshape(count, -1, 3).astype(np.int64)
+    keys = (np.arange(count, dtype=np.int64)[:, None] << 24) | (rgb[:, :, 0] << 16) | (rgb[:, :, 1] << 8) | rgb[:, :, 2]
+    unique_keys, counts = np.unique(keys.reshape(-1), return_counts=True)
+
+    # The most common colour of every texture, the lowest one when there is a tie (like argmax of the bincount)
+    texture_of = unique_keys >> 24
+    starts = np.flatnonzero(np.r_[True, texture_of[1:] != texture_of[:-1]])
+    most = np.repeat(np.maximum.reduceat(counts, starts), np.diff(np.r_[starts, counts.size]))
+    candidates = np.flatnonzero(counts == most)
+    first = candidates[np.r_[True, texture_of[candidates][1:] != texture_of[candidates][:-1]]]
+    dominant = unique_keys[first]
+
+    colors = np.empty((count, 4), dtype=np.int64)
+    colors[:, 0] = (dominant >> 16) & 0xFF
+    colors[:, 1] = (dominant >> 8) & 0xFF
+    colors[:, 2] = dominant & 0xFF
     # Get average average alpha
-    average_alpha = 0.0
-    for x in range(image.width):
-        for y in range(image.height):
-            pixel = image.getpixel((x, y))
-            average_alpha += pixel[3] * pixel[3]
-
-    average_alpha = average_alpha / (image.width * image.height)
-
-    return [int(rgb[0]), int(rgb[1]), int(rgb[2]), round(average_alpha ** 0.5)]
+    colors[:, 3] = _rms(textures, slice(3, 4))[:, 0]
+    return _colors(colors, single)
+
+
+# Every colour set of out_all_colours.json, with the function that computes it
+COLOR_SETS = {
+    'Linear Average': linear_avg_rgb,
+    'Root Mean Square Average': rms_rgb_color,
+    'HSL Average': average_hsl_colour,
+    'HSV Average': average_hsv_colour,
+    'LAB Average': average_lab_colour,
+    'Dominant Color': dominant_colour
+}
+
+
+# All the colour sets of a (N, H, W, 4) stack of textures, as (N, 4) arrays
+def all_colour_sets(textures: np.ndarray) -> dict[str, np.ndarray]:
+    return {name: function(textures) for name, function in COLOR_SETS.items()}
+
+
+# The textures as a (N, H, W, 4) uint8 array, and whether it was a single texture
+def _stack(image) -> tuple[np.ndarray, bool]:
+    if isinstance(image, Image.Image):
+        image = np.asarray(image.convert("RGBA"))
+    textures = np.asarray(image, dtype=np.uint8)
+    if textures.ndim not in (3, 4) or textures.shape[-1] != 4:
+        raise ValueError(f"Expected (H, W, 4) or (N, H, W, 4) RGBA textures, got shape {textures.shape}")
+    if textures.ndim == 3:
+        return textures[None], True
+    return textures, False
+
+
+def _colors(colors, single: bool) -> list | np.ndarray:
+    colors = np.asarray(colors).astype(np.int64)
+    return [int(value) for value in colors[0]] if single else colors
+
+
+# (N, H * W, 4) pixels of the textures, in the order the loops went through them (column by column)
+def _pixels_in_order(textures: np.ndarray) -> np.ndarray:
+    return textures.transpose(0, 2, 1, 3).reshape(textures.shape[0], -1, 4)
+
+
+# Running sum of the (N, P) values of every texture, added one by one like in a loop
+def _running_sum(values: np.ndarray) -> np.ndarray:
+    return np.cumsum(values, axis=1)[:, -1]
+
+
+# Root mean square of some channels of every texture (rounded)
+def _rms(textures: np.ndarray, channels: slice) -> np.ndarray:
+    squares = textures[:, :, :, channels].astype(np.int64) ** 2
+    # The squares of 8 bit values add up exactly, so the order doesn't matter here
+    means = squares.sum(axis=(1, 2)) / float(textures.shape[1] * textures.shape[2])
+    return np.rint(np.power(means, 0.5))
+
+
+# Hue is cyclic, so gotta do
+# theta = [355,5,5,5,5];
+# x = cosd(theta); % cosine in terms of degrees
+# y = sind(theta); % sine with a degree argument
+# meanangle = atan2(mean(y),mean(x))*180/pi
+# Gives the average hue (in degrees), the two other averages, and the average alpha of every texture
+def _circular_averages(
+        textures: np.ndarray, hue: np.ndarray, first: np.ndarray, second: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    max_count = float(textures.shape[1] * textures.shape[2])
+    # h is given from 0 to 1, to make it radians, it must be from 0 to 2pi
+    hue_x = _running_sum(np.cos(hue * 2 * math.pi))
+    hue_y = _running_sum(np.sin(hue * 2 * math.pi))
+    average_hue = np.array([
+        math.atan2(y / max_count, x / max_count) * 180 / math.pi for x, y in zip(hue_x.tolist(), hue_y.tolist())
+    ])
+    alpha = textures[:, :, :, 3].sum(axis=(1, 2), dtype=np.int64)
+    return average_hue, _running_sum(first) / max_count, _running_sum(second) / max_count, alpha / max_count
+
+
+# colorsys.rgb_to_hls, for arrays
+def _rgb_to_hls(r: np.ndarray, g: np.ndarray, b: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    maxc = np.maximum(np.maximum(r, g), b)
+    minc = np.minimum(np.minimum(r, g), b)
+    sumc = maxc + minc
+    rangec = maxc - minc
+    lightness = sumc / 2.0
+    grey = minc == maxc
+    with np.errstate(divide='ignore', invalid='ignore'):
+        saturation = np.where(lightness <= 0.5, rangec / sumc, rangec / (2.0 - maxc - minc))
+        hue = _hue(r, g, b, maxc, rangec)
+    return np.where(grey, 0.0, hue), lightness, np.where(grey, 0.0, saturation)
+
+
+# colorsys.rgb_to_hsv, for arrays
+def _rgb_to_hsv(r: np.ndarray, g: np.ndarray, b: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    maxc = np.maximum(np.maximum(r, g), b)
+    minc = np.minimum(np.minimum(r, g), b)
+    rangec = maxc - minc
+    grey = minc == maxc
+    with np.errstate(divide='ignore', invalid='ignore'):
+        saturation = rangec / maxc
+        hue = _hue(r, g, b, maxc, rangec)
+    return np.where(grey, 0.0, hue), np.where(grey, 0.0, saturation), maxc
+
+
+# The hue part of colorsys.rgb_to_hls and colorsys.rgb_to_hsv (nan for the greys)
+def _hue(r: np.ndarray, g: np.ndarray, b: np.ndarray, maxc: np.ndarray, rangec: np.ndarray) -> np.ndarray:
+    rc = (maxc - r) / rangec
+    gc = (maxc - g) / rangec
+    bc = (maxc - b) / rangec
+    hue = np.where(r == maxc, bc - gc, np.where(g == maxc, 2.0 + rc - bc, 4.0 + gc - rc))
+    return np.mod(hue / 6.0, 1.0)
+
+
+_transforms = None
+# Flips the sign bit of a and b, between the raw Lab bytes and the values of getpixel / putpixel
+_LAB_AB_FLIP = np.array([0, 0x80, 0x80], dtype=np.uint8)
+
+
+# sRGB -> Lab and Lab -> sRGB, only built once
+def _lab_transforms():
+    global _transforms
+    if _transforms is None:
+        srgb_p = ImageCms.createProfile("sRGB")
+        lab_p = ImageCms.createProfile("LAB")
+        _transforms = (
+            ImageCms.buildTransformFromOpenProfiles(srgb_p, lab_p, "RGB", "LAB"),
+            ImageCms.buildTransformFromOpenProfiles(lab_p, srgb_p, "LAB", "RGB")
+        )
+    return _transforms
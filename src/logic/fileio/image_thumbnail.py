@@ -11,12 +11,15 @@ class DetailsType(TypedDict):
     manipulation: str
     brightness: int
     dither: bool
+    dither_method: str
     alternate: bool
     blocklist: list[str]
     mode: str
     side: str
     color_set: str
     color_compare: str
+    block_dither: str | None
+    block_dither_space: str
 
 
 # Loads the image for displaying in the preview
@@ -52,7 +55,7 @@ def load_image_for_preview(
     out_img = None
     if "Lamps" in details['manipulation']:
         for value in image_to_redstone_lamps.img_to_redstone_lamps(
-                img, details['brightness'], details['dither'], details['alternate']
+                img, details['brightness'], details['dither'], details['alternate'], details.get('dither_method')
         ):
             if isinstance(value, Image.Image):
                 out_img = value
@@ -70,7 +73,9 @@ def load_image_for_preview(
                     'blocked_list': details['blocklist'],
                     'mode': details['mode'],
                     'color_set': details['color_set'][0],
-                    'color_compare': details['color_compare'][0]
+                    'color_compare': details['color_compare'][0],
+                    'block_dither': details['block_dither'],
+                    'block_dither_space': details['block_dither_space']
                 }
         ):
             if isinstance(value, Image.Image):
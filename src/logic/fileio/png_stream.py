@@ -0,0 +1,95 @@
+import os
+import struct
+import uuid
+import zlib
+
+import numpy as np
+
+# A png writer that takes the image a few rows at a time, and compresses them straight into the file
+# Pillow needs the whole image in memory before saving, which is way too much for gigantic block images
+# (A 4000x3000 image at 16x is a 64000x48000 png, ~12GB as a numpy array)
+# The png is written to a temporary file next to the output, which only replaces the output once it is complete,
+# so a conversion that fails or is stopped half way never leaves a broken png behind
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# Png colour types for the supported modes
+COLOR_TYPES = {"RGB": (2, 3), "RGBA": (6, 4)}
+
+
+class StreamingPNGWriter:
+    def __init__(self, path: str, width: int, height: int, mode: str = "RGBA", compress_level: int = 6):
+        if mode not in COLOR_TYPES:
+            raise ValueError(f"Unsupported png mode: {mode}")
+        color_type, self.channels = COLOR_TYPES[mode]
+        self.width = width
+        self.height = height
+        self.rows_written = 0
+        self.compressor = zlib.compressobj(compress_level)
+        self.path = path
+        self.temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        self.file = open(self.temp_path, "wb")
+        self.file.write(PNG_SIGNATURE)
+        # 8 bits per channel, no interlacing
+        self._write_chunk(b'IHDR', struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # Also when the generator writing the png is not consumed to the end (GeneratorExit)
+            self.discard()
+
+    def _write_chunk(self, chunk_type: bytes, data: bytes):
+        self.file.write(struct.pack(">I", len(data)))
+        self.file.write(chunk_type)
+        self.file.write(data)
+        self.file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(chunk_type)) & 0xFFFFFFFF))
+
+    # rows is a (n, width, channels) uint8 array, the next n rows of the image
+    def write_rows(self, rows: np.ndarray):
+        rows = np.asarray(rows, dtype=np.uint8)
+        if rows.shape[1:] != (self.width, self.channels):
+            raise ValueError(f"Expected rows of shape (n, {self.width}, {self.channels}), got {rows.shape}")
+        if self.rows_written + rows.shape[0] > self.height:
+            raise ValueError("More rows written than the height of the png")
+
+        # Every scanline uses the "Sub" filter (difference with the pixel on the left),
+        # which compresses the repeating block textures a lot better than no filter at all
+        flat = rows.reshape(rows.shape[0], -1)
+        channels = self.channels
+        filtered = np.empty((flat.shape[0], flat.shape[1] + 1), dtype=np.uint8)
+        filtered[:, 0] = 1
+        filtered[:, 1:1 + channels] = flat[:, :channels]
+        np.subtract(flat[:, channels:], flat[:, :-channels], out=filtered[:, 1 + channels:])
+
+        data = self.compressor.compress(filtered.tobytes())
+        if data:
+            self._write_chunk(b'IDAT', data)
+        self.rows_written += rows.shape[0]
+
+    # Finishes the png and moves it to the output path
+    def close(self):
+        if self.file.closed:
+            return
+        try:
+            if self.rows_written != self.height:
+                raise ValueError(f"Only {self.rows_written} of the {self.height} rows of the png were written")
+            self._write_chunk(b'IDAT', self.compressor.flush())
+            self._write_chunk(b'IEND', b'')
+            self.file.close()
+            os.replace(self.temp_path, self.path)
+        except BaseException:
+            self.discard()
+            raise
+
+    # Throws away the unfinished png, the output path is left untouched
+    def discard(self):
+        self.file.close()
+        try:
+            os.remove(self.temp_path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,351 @@
+import logging
+import numpy as np
+from typing import NamedTuple, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Scipy is optional, it is only needed for the kd-tree backend
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+# Vectorized versions of the colour difference functions in img_to_blocks.py
+# Instead of comparing one pixel with one block, these compare a whole batch of pixels
+# with the whole palette at once, and give back the index of the closest block for each pixel.
+# The maths is kept in the exact same order as the scalar functions, so the selected blocks are identical.
+
+
+class BlockPalette(NamedTuple):
+    # Names of the blocks (keys of out_all_colours.json) that can be used
+    names: list
+    # (N, 4) matrix of the average colours of those blocks, for the selected side and color set
+    colors: np.ndarray
+    # Index of every palette entry, in the block list it was compiled from
+    block_indices: np.ndarray
+
+
+# How many pixel/block differences are computed at a time, to keep memory use in check
+MAX_BATCH_ELEMENTS = 2 ** 22
+
+# "brute" compares every colour with every block
+# "kdtree" looks up a few nearest candidates in a spatial index of the palette first
+# (only for Euclidean, Weighted Euclidean and CIE76, the other metrics always use brute force)
+MATCH_BACKENDS = ("brute", "kdtree")
+
+
+# Filtering out the blocks, depending on how the user configured the options
+def filter_blocks(blocks_data: list, mode: str, blocked_list: list) -> list:
+    if mode == "Whitelist":
+        return [selected_block for selected_block in blocks_data if selected_block[0] in blocked_list]
+    elif mode == "Blacklist":
+        return [selected_block for selected_block in blocks_data if selected_block[0] not in blocked_list]
+    return blocks_data
+
+
+# Compiles the block list into a palette matrix
+# side can be a tuple of sides, in which case the first side a block has is used
+def compile_palette(blocks_list: list, side: str | Sequence[str], color_set: str) -> BlockPalette:
+    sides = (side,) if isinstance(side, str) else tuple(side)
+    names = []
+    colors = []
+    block_indices = []
+    for index, block_val in enumerate(blocks_list):
+        chosen_side = next((s for s in sides if s in block_val[1]), None)
+        if chosen_side is None:
+            continue
+        color = block_val[1][chosen_side]['color'].get(color_set)
+        if color is None:
+            continue
+        names.append(block_val[0])
+        colors.append(color)
+        block_indices.append(index)
+
+    return BlockPalette(
+        names,
+        np.array(colors, dtype=np.int64).reshape(-1, 4),
+        np.array(block_indices, dtype=np.intp)
+    )
+
+
+# Returns the index (into the palette) of the closest block, for every pixel
+# pixels can be of any shape, as long as the last axis is RGBA
+# Only the unique colours are matched, and the results are scattered back to every pixel
+def match_pixels(
+        pixels: np.ndarray, palette: BlockPalette, color_compare: str, backend: str = "brute"
+) -> np.ndarray:
+    pixels = np.asarray(pixels)
+    colors, inverse = unique_colors(pixels)
+    return match_colors(colors, palette, color_compare, backend)[inverse].reshape(pixels.shape[:-1])
+
+
+# Packs every RGBA pixel into a single uint32, and returns the (U, 4) unique colours,
+# plus the index of the unique colour of every pixel
+def unique_colors(pixels: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    flat = np.ascontiguousarray(np.asarray(pixels, dtype=np.uint8).reshape(-1, 4))
+    packed = flat.view(np.uint32).reshape(-1)
+    unique_packed, inverse = np.unique(packed, return_inverse=True)
+    colors = unique_packed.view(np.uint8).reshape(-1, 4)
+    return colors, inverse.reshape(-1)
+
+
+# Returns the index (into the palette) of the closest block, for a (M, 4) array of colours
+def match_colors(
+        colors: np.ndarray, palette: BlockPalette, color_compare: str, backend: str = "brute"
+) -> np.ndarray:
+    flat = np.asarray(colors).reshape(-1, 4).astype(np.int64)
+    if flat.shape[0] == 0 or len(palette.names) == 0:
+        return np.zeros(flat.shape[0], dtype=np.intp)
+
+    if backend == "kdtree":
+        index = get_palette_index(palette, color_compare)
+        if index is not None:
+            return index.query(flat)
+    elif backend != "brute":
+        raise ValueError(f"Unknown match backend: {backend}")
+
+    distance_function = color_compare_to_array_function(color_compare)
+    palette_colors = palette.colors
+    if distance_function is cie76_del_e_array_difference:
+        palette_colors = _with_lab(palette_colors)
+        flat = _with_lab(flat)
+    return _brute_force(flat, palette_colors, distance_function)
+
+
+def _brute_force(flat: np.ndarray, palette_colors: np.ndarray, distance_function: callable) -> np.ndarray:
+    out = np.zeros(flat.shape[0], dtype=np.intp)
+    batch = max(1, MAX_BATCH_ELEMENTS // palette_colors.shape[0])
+    for start in range(0, flat.shape[0], batch):
+        differences = distance_function(flat[start:start + batch], palette_colors)
+        # argmin returns the first lowest value, same as list.index(min(list))
+        out[start:start + batch] = np.argmin(differences, axis=1)
+    return out
+
+
+class KDTreePaletteIndex:
+    # A kd-tree over the palette colours, built once per palette and metric
+    # The tree only gives a few candidate blocks for each colour. The exact difference is then
+    # computed for those candidates, and any colour where the candidates can not be proven to contain
+    # the closest block (or the first one of equally close blocks) is done with brute force instead.
+    # So the results are always identical to the brute force backend.
+
+    # Number of candidates asked from every tree
+    candidates = 8
+
+    def __init__(self, palette: BlockPalette, color_compare: str):
+        self.distance_function = color_compare_to_array_function(color_compare)
+        self.palette_colors = palette.colors
+        if self.distance_function is cie76_del_e_array_difference:
+            self.palette_colors = _with_lab(palette.colors)
+        self.weights = self._tree_weights()
+        self.trees = [cKDTree(self.palette_colors * weights) for weights in self.weights]
+        self.k = min(self.candidates, self.palette_colors.shape[0])
+
+    # Euclidean and CIE76 are plain euclidean distances. Weighted Euclidean uses one of two sets of weights,
+    # depending on the red of both colours, so one tree is built for each set, and both are searched
+    def _tree_weights(self) -> list[np.ndarray]:
+        if self.distance_function is weighted_euclidean_array_difference:
+            return [np.sqrt(np.array([2.0, 4.0, 3.0, 1.0])), np.sqrt(np.array([3.0, 4.0, 2.0, 1.0]))]
+        return [np.ones(4)]
+
+    def query(self, flat: np.ndarray) -> np.ndarray:
+        if self.distance_function is cie76_del_e_array_difference:
+            flat = _with_lab(flat)
+        out = np.zeros(flat.shape[0], dtype=np.intp)
+        batch = max(1, MAX_BATCH_ELEMENTS // (self.k * len(self.trees)))
+        for start in range(0, flat.shape[0], batch):
+            out[start:start + batch] = self._query_batch(flat[start:start + batch])
+        return out
+
+    def _query_batch(self, flat: np.ndarray) -> np.ndarray:
+        candidate_list = []
+        # Every block that is not a candidate is at least this far away
+        lower_bound = np.full(flat.shape[0], np.inf)
+        for tree, weights in zip(self.trees, self.weights):
+            distances, indices = tree.query(flat * weights, k=self.k, workers=-1)
+            distances = distances.reshape(flat.shape[0], -1)
+            candidate_list.append(indices.reshape(flat.shape[0], -1))
+            if self.k < self.palette_colors.shape[0]:
+                lower_bound = np.minimum(lower_bound, distances[:, -1] ** 2)
+        candidates = np.concatenate(candidate_list, axis=1)
+
+        differences = self.distance_function(flat, self.palette_colors[candidates])
+        best_difference = differences.min(axis=1)
+        # Out of the equally close candidates, the one with the lowest index wins, like argmin
+        ties = np.where(differences == best_difference[:, None], candidates, np.iinfo(np.intp).max)
+        out = ties.min(axis=1)
+
+        # The tree distances are floats, so a little margin is kept
+        unproven = ~(lower_bound * (1 - 1e-9) > best_difference)
+        if unproven.any():
+            out[unproven] = _brute_force(flat[unproven], self.palette_colors, self.distance_function)
+        return out
+
+
+# The kd-tree indices already built, for every palette and metric
+_palette_indices = {}
+_scipy_warning_shown = False
+
+
+# Returns the kd-tree index for the palette, or None if the metric (or the missing scipy) does not allow one
+def get_palette_index(palette: BlockPalette, color_compare: str) -> KDTreePaletteIndex | None:
+    if color_compare not in ("Euclidean Difference", "Weighted Euclidean", "CIE76 DelE"):
+        return None
+    global _scipy_warning_shown
+    if cKDTree is None:
+        if not _scipy_warning_shown:
+            logger.warning("scipy is not installed, the kd-tree backend falls back to brute force")
+            _scipy_warning_shown = True
+        return None
+
+    key = (palette.colors.tobytes(), color_compare)
+    if key not in _palette_indices:
+        if len(_palette_indices) >= 16:
+            _palette_indices.clear()
+        _palette_indices[key] = KDTreePaletteIndex(palette, color_compare)
+    return _palette_indices[key]
+
+
+# Same as img_to_blocks.color_compare_to_function, but for the array functions
+def color_compare_to_array_function(color_compare: str) -> callable:
+    func = abs_value_array_difference
+    if color_compare == "Euclidean Difference":
+        func = euclidean_squared_array_difference
+    elif color_compare == "Weighted Euclidean":
+        func = weighted_euclidean_array_difference
+    elif color_compare == "Redmean Difference":
+        func = redmean_array_difference
+    elif color_compare == "CIE76 DelE":
+        func = cie76_del_e_array_difference
+    return func
+
+
+# All the functions below take (M, 4) pixels and (N, 4) palette colours, and return a (M, N) difference matrix
+# The palette colours can also be (M, N, 4), when every pixel has its own set of blocks to compare with
+# The channels are done one at a time, which is a lot faster than making a (M, N, 4) array and summing it
+# Every integer difference fits in int32, so that is used to halve the memory traffic
+def _channel(y: np.ndarray, channel: int) -> np.ndarray:
+    return y[None, :, channel] if y.ndim == 2 else y[:, :, channel]
+
+
+def _channel_differences(x: np.ndarray, y: np.ndarray, dtype=np.int32) -> list[np.ndarray]:
+    x = x.astype(dtype, copy=False)
+    y = y.astype(dtype, copy=False)
+    return [x[:, None, channel] - _channel(y, channel) for channel in range(4)]
+
+
+def abs_value_array_difference(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    del_r, del_g, del_b, del_a = _channel_differences(x, y)
+    return np.abs(del_r) + np.abs(del_g) + np.abs(del_b) + np.abs(del_a)
+
+
+def euclidean_squared_array_difference(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    del_r, del_g, del_b, del_a = _channel_differences(x, y)
+    return del_r * del_r + del_g * del_g + del_b * del_b + del_a * del_a
+
+
+def weighted_euclidean_array_difference(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    del_r, del_g, del_b, del_a = _channel_differences(x, y)
+    del_r *= del_r
+    del_b *= del_b
+    rest = 4 * (del_g * del_g) + del_a * del_a
+    # r_bar < 128 is the same as (r1 + r2) < 256, but stays in integers
+    low_red = (x[:, None, 0] + _channel(y, 0)) < 256
+    return np.where(low_red, 2 * del_r + 3 * del_b, 3 * del_r + 2 * del_b) + rest
+
+
+def redmean_array_difference(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    del_r, del_g, del_b, del_a = _channel_differences(x, y, np.float64)
+    r_bar = (x[:, None, 0] + _channel(y, 0)) / 2.0
+    return (((2 + r_bar / 256) * (del_r * del_r))
+            + (4 * (del_g * del_g))
+            + ((2 + (255 - r_bar) / 256) * (del_b * del_b))
+            + del_a * del_a)
+
+
+# Expects the colours to already be in the (L, a, b, alpha) form given by _with_lab
+def cie76_del_e_array_difference(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    del_l, del_a, del_b, del_alpha = _channel_differences(x, y, np.float64)
+    total_diff = del_l * del_l + del_a * del_a + del_b * del_b
+    return total_diff + del_alpha * del_alpha
+
+
+# sRGB -> linear lookup, computed with python floats so that it matches rgb2lab exactly
+def _srgb_to_linear_table() -> np.ndarray:
+    table = []
+    for value in range(256):
+        value = float(value) / 255
+        if value > 0.04045:
+            value = ((value + 0.055) / 1.055) ** 2.4
+        else:
+            value = value / 12.92
+        table.append(value * 100)
+    return np.array(table, dtype=np.float64)
+
+
+SRGB_TO_LINEAR = _srgb_to_linear_table()
+
+
+# round(x, 4) like python does it. np.round can disagree with python when x is very close to a half,
+# so those values are flagged, and the caller recomputes them with python
+def _round_4(values: np.ndarray, flagged: np.ndarray) -> np.ndarray:
+    scaled = values * 10000.0
+    fraction = scaled - np.floor(scaled)
+    flagged |= np.abs(fraction - 0.5) < 1e-6
+    return np.rint(scaled) / 10000.0
+
+
+# Vectorized img_to_blocks.rgb2lab, for a (M, 3) array of colours
+def rgb2lab_array(colors: np.ndarray) -> np.ndarray:
+    colors = np.asarray(colors, dtype=np.intp)
+    flagged = np.zeros(colors.shape[0], dtype=bool)
+    red = SRGB_TO_LINEAR[colors[:, 0]]
+    green = SRGB_TO_LINEAR[colors[:, 1]]
+    blue = SRGB_TO_LINEAR[colors[:, 2]]
+
+    xyz_x = _round_4(red * 0.4124 + green * 0.3576 + blue * 0.1805, flagged) / 95.047
+    xyz_y = _round_4(red * 0.2126 + green * 0.7152 + blue * 0.0722, flagged) / 100.0
+    xyz_z = _round_4(red * 0.0193 + green * 0.1192 + blue * 0.9505, flagged) / 108.883
+
+    def pivot(value: np.ndarray) -> np.ndarray:
+        return np.where(
+            value > 0.008856,
+            np.power(np.maximum(value, 0), 0.3333333333333333),
+            (7.787 * value) + (16 / 116)
+        )
+
+    xyz_x, xyz_y, xyz_z = pivot(xyz_x), pivot(xyz_y), pivot(xyz_z)
+
+    lab = np.empty((colors.shape[0], 3), dtype=np.float64)
+    lab[:, 0] = _round_4((116 * xyz_y) - 16, flagged)
+    lab[:, 1] = _round_4(500 * (xyz_x - xyz_y), flagged)
+    lab[:, 2] = _round_4(200 * (xyz_y - xyz_z), flagged)
+
+    # The few colours sitting on a rounding edge are done the slow (but exact) way
+    if flagged.any():
+        from src.logic.image_logic.img_to_blocks import rgb2lab
+        for index in np.flatnonzero(flagged):
+            lab[index] = rgb2lab(colors[index].tolist())
+    return lab
+
+
+# (M, 4) RGBA -> (M, 4) Lab + alpha
+def _with_lab(colors: np.ndarray) -> np.ndarray:
+    out = np.empty(colors.shape, dtype=np.float64)
+    out[:, :3] = rgb2lab_array(colors[:, :3])
+    out[:, 3] = colors[:, 3]
+    return out
+
+
+# (M, 4) RGBA -> (M, 4) Lab + alpha, for colours that are worked on in Lab (like the any block dithering)
+def rgba_to_lab(colors: np.ndarray) -> np.ndarray:
+    return _with_lab(np.asarray(colors).reshape(-1, 4))
+
+
+# The closest block (CIE76 difference) for every colour of a (M, 4) array of Lab + alpha colours
+# The colours don't have to be the Lab of an rgb colour, lab_palette is rgba_to_lab(palette.colors)
+def match_lab_colors(lab_colors: np.ndarray, lab_palette: np.ndarray) -> np.ndarray:
+    flat = np.asarray(lab_colors, dtype=np.float64).reshape(-1, 4)
+    if flat.shape[0] == 0 or lab_palette.shape[0] == 0:
+        return np.zeros(flat.shape[0], dtype=np.intp)
+    return _brute_force(flat, lab_palette, cie76_del_e_array_difference)
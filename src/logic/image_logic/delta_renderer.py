@@ -0,0 +1,89 @@
+import numpy as np
+from PIL import Image
+
+from src.logic.image_logic import image_to_redstone_lamps, img_to_blocks, tile_atlas
+from src.logic.image_logic.image_manager import make_block_details
+
+# Renders a sequence of (video) frames, reusing the previous frame's work
+# Consecutive frames are mostly identical once they are shrunk down to one pixel per block, so:
+#   - any block: only the pixels that changed since the previous frame are matched to blocks again
+#   - both modes: only the tiles whose block changed are drawn again, over the previous output
+# The frames come out exactly the same as when they are rendered on their own.
+
+
+class DeltaRenderer:
+    def __init__(self, manipulation: str, details: dict):
+        manipulation = manipulation.replace("Video", "Image")
+        if manipulation not in ("Image To Any Block Image", "Image To Redstone Lamps Image"):
+            raise ValueError(f"{manipulation} does not render to an image")
+        self.lamps = manipulation == "Image To Redstone Lamps Image"
+        self.details = details
+
+        self.palette = None
+        if self.lamps:
+            # The lamps are rgb, with an opaque alpha they come out as rgba like the block frames
+            lamps_atlas = image_to_redstone_lamps.lamps_atlas
+            alpha = np.full(lamps_atlas.shape[:-1] + (1,), 255, dtype=np.uint8)
+            self.atlas = np.concatenate([lamps_atlas, alpha], axis=-1)
+        else:
+            self.block_details = make_block_details(details)
+            prepared = img_to_blocks.prepare_palette(self.block_details)
+            if prepared is not None:
+                self.palette, self.atlas = prepared
+            else:
+                # No blocks to use, every frame is empty
+                self.atlas = tile_atlas.build_atlas([np.zeros((16, 16, 4), dtype=np.uint8)])
+
+        self.previous_pixels: np.ndarray | None = None
+        self.previous_indices: np.ndarray | None = None
+        self.out: np.ndarray | None = None
+
+    # Index of the tile of every pixel of the (already scaled) frame
+    # changed is where the pixels differ from the previous frame, None for a first frame
+    def _tile_indices(self, img: Image.Image, changed: np.ndarray | None) -> np.ndarray:
+        if self.lamps:
+            # Error diffusion spreads changes around, so the lamps are always decided for the whole frame
+            # (It's cheap next to drawing the tiles. With ordered dithering, only the changed pixels can change lamps)
+            return image_to_redstone_lamps.lamps_lit_mask(
+                img, self.details['brightness'], self.details['dither'], self.details['alternate'],
+                self.details.get('dither_method'), self.details.get('serpentine', False)
+            ).astype(np.intp)
+
+        np_image = np.asarray(img.convert("RGBA"))
+        if self.palette is None:
+            return np.zeros(np_image.shape[:2], dtype=np.intp)
+        blank = len(self.palette.names)
+
+        # The dithering needs the whole frame, like the lamps
+        if changed is None or self.block_details.get('block_dither'):
+            indices = img_to_blocks.match_details(np_image, self.palette, self.block_details)
+            return np.where(np_image[:, :, 3] > 10, indices, blank)
+
+        indices = self.previous_indices.copy()
+        if changed.any():
+            changed_pixels = np_image[changed]
+            matched = img_to_blocks.match_details(changed_pixels, self.palette, self.block_details)
+            indices[changed] = np.where(changed_pixels[:, 3] > 10, matched, blank)
+        return indices
+
+    # Renders the next frame (already scaled to one pixel per block)
+    # The returned array is reused by the next call, copy it to keep it
+    def render(self, img: Image.Image) -> np.ndarray:
+        pixels = np.asarray(img.convert("RGBA"))
+        out_shape = (pixels.shape[0] * 16, pixels.shape[1] * 16, 4)
+
+        if self.out is None or self.out.shape != out_shape:
+            # First frame (or the size changed), everything is drawn
+            indices = self._tile_indices(img, None)
+            self.out = np.zeros(out_shape, dtype=np.uint8)
+            for _ in tile_atlas.composite_columns(self.atlas, indices, self.out):
+                pass
+        else:
+            changed = np.any(pixels != self.previous_pixels, axis=2)
+            indices = self._tile_indices(img, changed)
+            ys, xs = np.nonzero(indices != self.previous_indices)
+            tile_atlas.composite_tiles(self.atlas, indices, self.out, ys, xs)
+
+        self.previous_pixels = pixels
+        self.previous_indices = indices
+        return self.out
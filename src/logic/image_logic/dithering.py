@@ -0,0 +1,135 @@
+import numpy as np
+from PIL import Image
+
+# Black and white dithering of greyscale images, for the redstone lamps (lit or unlit)
+# Two kinds of methods:
+#   error diffusion  every pixel is set to black or white, and the error is spread over the pixels after it.
+#                    Each row depends on the one before, so the rows are done one at a time: only the error
+#                    carried along the row is a python loop, the error spread to the rows below is added with numpy
+#   ordered (bayer)  every pixel is compared with a tiled threshold matrix, all at once. The pattern is fixed to the
+#                    image, so a pixel that stays the same in a video stays the same lamp (the delta frames are smaller)
+#
+# The brightness works like in the other lamp modes: a pixel of exactly that brightness is half way between
+# black and white, darker pixels get fewer lit lamps and brighter ones more
+# At the default brightness with floyd-steinberg, the image goes straight through the dithering of Pillow,
+# so the lamps are exactly the ones of img.convert('1') (the only dithering there was before)
+
+# (rows below, columns to the right, weight) of every pixel the error goes to, and the sum of the weights
+# The columns are mirrored on the rows scanned right to left (serpentine)
+ERROR_DIFFUSION_KERNELS = {
+    'floyd-steinberg': (16, [(0, 1, 7), (1, -1, 3), (1, 0, 5), (1, 1, 1)]),
+    # Only spreads 6/8 of the error, so the highlights and shadows are kept clean
+    'atkinson': (8, [(0, 1, 1), (0, 2, 1), (1, -1, 1), (1, 0, 1), (1, 1, 1), (2, 0, 1)]),
+    'jarvis-judice-ninke': (48, [
+        (0, 1, 7), (0, 2, 5),
+        (1, -2, 3), (1, -1, 5), (1, 0, 7), (1, 1, 5), (1, 2, 3),
+        (2, -2, 1), (2, -1, 3), (2, 0, 5), (2, 1, 3), (2, 2, 1)
+    ]),
+    'sierra': (32, [
+        (0, 1, 5), (0, 2, 3),
+        (1, -2, 2), (1, -1, 4), (1, 0, 5), (1, 1, 4), (1, 2, 2),
+        (2, -1, 2), (2, 0, 3), (2, 1, 2)
+    ]),
+}
+
+# Size of the bayer matrix of every ordered method
+ORDERED_SIZES = {'bayer-2': 2, 'bayer-4': 4, 'bayer-8': 8}
+
+DITHER_METHODS = tuple(ERROR_DIFFUSION_KERNELS) + tuple(ORDERED_SIZES)
+# Same as the dithering of Pillow, which was the only one before
+DEFAULT_DITHER_METHOD = 'floyd-steinberg'
+# The brightness the tone curve leaves every value as it is at (the default of the cli and the gui)
+DEFAULT_BRIGHTNESS = 127
+
+
+# Same as dither_mask, from the image itself (of any mode)
+def dither_image(
+        img: Image.Image, brightness: int, method: str | None = None, serpentine: bool = False
+) -> np.ndarray:
+    method = method or DEFAULT_DITHER_METHOD
+    if method == 'floyd-steinberg' and not serpentine and brightness == DEFAULT_BRIGHTNESS:
+        # Not through greyscale first, Pillow dithers the rgb image a bit differently
+        return np.asarray(img.convert('1'), dtype=bool)
+    return dither_mask(np.asarray(img.convert('L')), brightness, method, serpentine)
+
+
+# True for the white pixels of the (H, W) greyscale image
+# serpentine only changes the error diffusion methods: every other row is scanned right to left
+def dither_mask(
+        gray: np.ndarray, brightness: int, method: str | None = None, serpentine: bool = False
+) -> np.ndarray:
+    method = method or DEFAULT_DITHER_METHOD
+    values = tone_curve(gray, brightness)
+    if method in ORDERED_SIZES:
+        return ordered_dither(values, ORDERED_SIZES[method])
+    if method not in ERROR_DIFFUSION_KERNELS:
+        raise ValueError(f"Unknown dithering method: {method}")
+    if method == 'floyd-steinberg' and not serpentine:
+        # Pillow does exactly this one in C
+        return np.asarray(Image.fromarray(np.rint(values).astype(np.uint8)).convert('1').convert('L')) == 255
+    return error_diffusion(values, method, serpentine)
+
+
+# Moves the brightness to the middle grey (DEFAULT_BRIGHTNESS), stretching the darker and brighter values to keep
+# the full range. Nothing moves at DEFAULT_BRIGHTNESS
+def tone_curve(gray: np.ndarray, brightness: int) -> np.ndarray:
+    gray = np.asarray(gray, dtype=np.float64)
+    brightness = min(254, max(1, brightness))
+    return np.where(
+        gray < brightness,
+        gray * (DEFAULT_BRIGHTNESS / brightness),
+        DEFAULT_BRIGHTNESS + (gray - brightness) * ((255 - DEFAULT_BRIGHTNESS) / (255 - brightness))
+    )
+
+
+def error_diffusion(values: np.ndarray, method: str, serpentine: bool = False) -> np.ndarray:
+    divisor, taps = ERROR_DIFFUSION_KERNELS[method]
+    height, width = values.shape
+    along_row = [(dx, weight / divisor) for dy, dx, weight in taps if dy == 0]
+    below = [(dy, dx, weight / divisor) for dy, dx, weight in taps if dy > 0]
+    # The rows get padded with this many columns on both sides, the error that goes past the edges is lost there
+    reach = max(abs(dx) for _, dx, _ in taps)
+
+    # Error already spread into the current row and the ones below it
+    pending = np.zeros((max(dy for dy, _, _ in taps) + 1, width + 2 * reach))
+    lit = np.empty((height, width), dtype=bool)
+    for y in range(height):
+        direction = -1 if serpentine and y % 2 == 1 else 1
+        line = [0.0] * reach + (values[y] + pending[0, reach:reach + width]).tolist() + [0.0] * reach
+        row_lit = [False] * width
+        errors = [0.0] * width
+        for x in (range(width) if direction == 1 else range(width - 1, -1, -1)):
+            i = x + reach
+            # Clipped like in Pillow, so the error can't pile up in big flat areas
+            value = min(255.0, max(0.0, line[i]))
+            if value >= 128:
+                row_lit[x] = True
+                value -= 255
+            errors[x] = value
+            for dx, weight in along_row:
+                line[i + dx * direction] += value * weight
+        lit[y] = row_lit
+
+        row_errors = np.array(errors)
+        for dy, dx, weight in below:
+            start = reach + dx * direction
+            pending[dy, start:start + width] += row_errors * weight
+        pending = np.roll(pending, -1, axis=0)
+        pending[-1] = 0
+    return lit
+
+
+def ordered_dither(values: np.ndarray, size: int) -> np.ndarray:
+    matrix = bayer_matrix(size)
+    # Thresholds in the middle of every step, from 0 to 255
+    thresholds = (matrix + 0.5) * (255 / matrix.size)
+    height, width = values.shape
+    return values > thresholds[np.arange(height)[:, None] % size, np.arange(width)[None, :] % size]
+
+
+# The (size, size) bayer matrix, with every value from 0 to size² - 1 (size is a power of 2)
+def bayer_matrix(size: int) -> np.ndarray:
+    matrix = np.zeros((1, 1), dtype=np.int64)
+    while matrix.shape[0] < size:
+        matrix = np.block([[4 * matrix, 4 * matrix + 2], [4 * matrix + 3, 4 * matrix + 1]])
+    return matrix
@@ -1,64 +1,163 @@
-# THIS IS A PICKLE GENERATOR
-# SHOULD ONLY BE USED IF YOU KNOW WHAT YOU ARE DOING
-# THIS IS NOT PART OF THE PROGRAM YET
-
-
+# Precomputes the closest block for every possible rgb colour, so that matching an image
+# becomes a single lookup per pixel (Very useful for videos, where thousands of frames use the same settings)
+#
+# The lookup table (LUT) is a flat uint16 array of palette indices, one per cell of a
+# (2^bits)^3 rgb cube. With 8 bits it covers every rgb colour exactly (32MB),
+# with fewer bits every channel is quantized, and the centre of the cell is used to pick the block.
+# Built tables are stored in assets/cache/lut, and are memory-mapped when loaded again.
+# The folder is kept under LUT_CACHE_MAX_BYTES: the tables that were not used for the longest time are removed first.
+
+import hashlib
 import json
-import math
-import pickle
-
-from typing import Tuple, List
-
-from PIL import Image
-
-# TODO: Allow Pickle file, to speed up the image conversion
-# ERROR: DOES NOT WORK
-path = "../../../assets/blocks/all_blocks_textures/"
-with open("../../../assets/blocks/img_generator_code/out.json", "r") as f:
-    blocks_data: List = list(json.load(f).items())
-
-blocks_img = {}
-for block in blocks_data:
-    for block_side in block[1].keys():
-        if block_side == "extra":
+import os
+import time
+import uuid
+
+import numpy as np
+
+from src.logic.image_logic import block_matcher, palette_bundle
+from src.path_manager.pather import resource_path
+
+lut_cache_folder = os.path.normpath(resource_path("./assets/cache/lut/"))
+
+LUT_BITS_CHOICES = (5, 6, 7, 8)
+
+# How many colours of the cube are matched at a time while building
+BUILD_BATCH = 2 ** 16
+
+# 16 tables of 8 bits (32MB each)
+LUT_CACHE_MAX_BYTES = 16 * 2 ** 25
+# Temporary files older than this are from builds that were interrupted
+STALE_TEMP_SECONDS = 24 * 60 * 60
+
+
+# The key changes whenever anything that could change the selected blocks changes
+def lut_key(side, color_set: str, color_compare: str, mode: str, blocked_list: list, bits: int) -> str:
+    sides = side if isinstance(side, str) else ",".join(side)
+    listed = sorted(blocked_list) if mode in ("Whitelist", "Blacklist") else []
+    data = json.dumps([palette_bundle.load_bundle().content_hash, sides, color_set, color_compare, mode, listed, bits])
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()[:32]
+
+
+# The representative colour of every cell of the cube, for the cells [start, stop)
+def _cube_colors(start: int, stop: int, bits: int) -> np.ndarray:
+    cells = np.arange(start, stop, dtype=np.int64)
+    step = 1 << (8 - bits)
+    mask = (1 << bits) - 1
+    colors = np.empty((cells.shape[0], 4), dtype=np.int64)
+    colors[:, 0] = ((cells >> (2 * bits)) & mask) * step + step // 2
+    colors[:, 1] = ((cells >> bits) & mask) * step + step // 2
+    colors[:, 2] = (cells & mask) * step + step // 2
+    colors[:, 3] = 255
+    return colors
+
+
+def build_lut(
+        palette: block_matcher.BlockPalette,
+        color_compare: str,
+        bits: int,
+        out: np.ndarray | None = None,
+        backend: str = "brute"
+):
+    if bits not in LUT_BITS_CHOICES:
+        raise ValueError(f"LUT bits must be one of {LUT_BITS_CHOICES}, got {bits}")
+    if len(palette.names) > np.iinfo(np.uint16).max:
+        raise ValueError(f"Too many blocks for a uint16 LUT: {len(palette.names)}")
+
+    size = 1 << (3 * bits)
+    if out is None:
+        out = np.empty(size, dtype=np.uint16)
+    for start in range(0, size, BUILD_BATCH):
+        stop = min(size, start + BUILD_BATCH)
+        out[start:stop] = block_matcher.match_colors(
+            _cube_colors(start, stop, bits), palette, color_compare, backend
+        )
+    return out
+
+
+# Loads the LUT from the cache folder (memory-mapped), or builds and stores it if it does not exist yet
+def load_or_build_lut(
+        palette: block_matcher.BlockPalette, key: str, color_compare: str, bits: int, backend: str = "brute"
+) -> np.ndarray:
+    lut_path = os.path.join(lut_cache_folder, f"{key}_{bits}.npy")
+    if os.path.exists(lut_path):
+        try:
+            lut = np.load(lut_path, mmap_mode="r")
+            if lut.shape == (1 << (3 * bits),) and lut.dtype == np.uint16:
+                # Marks it as used, for trim_lut_cache
+                os.utime(lut_path)
+                return lut
+        except (OSError, ValueError):
             pass
-        else:
-            img = Image.open(path + block[1][block_side]['file'])
-            blocks_img[block[0] + block_side] = img
-
-new_block_list = blocks_data
-
-
-def value_difference(x: Tuple, y: List) -> float:
-    total_diff = 0
-    for val1, val2 in zip(x, y):
-        total_diff += abs(val1 - val2)
-
-    return total_diff
-
-
-side = 'bottom'
-
-
-def pix_to_block_name(pix):
-    all_differences = [
-        (value_difference(pix, block_val[1][side]['color']) if (
-                side in block_val[1]
-        ) else math.inf)
-        for block_val in new_block_list
-    ]
-    block_index = all_differences.index(min(all_differences))
-    return new_block_list[block_index][0]
-
-
-if __name__ == "__main__":
-    data = {}
-
-    for r in range(0, 256):
-        for g in range(0, 256):
-            for b in range(0, 256):
-                data[(r, g, b)] = pix_to_block_name([r, g, b, 255])
-        print(r)
 
-    with open('rgb_bottom.pickle', 'wb') as f:
-        pickle.dump(data, f)
+    os.makedirs(lut_cache_folder, exist_ok=True)
+    # Written to a temporary file first, so a half written table is never loaded by another process
+    temp_path = os.path.join(lut_cache_folder, f"{key}_{bits}.{uuid.uuid4().hex}.tmp.npy")
+    lut = np.lib.format.open_memmap(temp_path, mode="w+", dtype=np.uint16, shape=(1 << (3 * bits),))
+    build_lut(palette, color_compare, bits, out=lut, backend=backend)
+    lut.flush()
+    del lut
+    os.replace(temp_path, lut_path)
+    trim_lut_cache(keep=lut_path)
+    return np.load(lut_path, mmap_mode="r")
+
+
+# Removes the least recently used tables until the folder is under max_bytes (never the one to keep)
+def trim_lut_cache(max_bytes: int = LUT_CACHE_MAX_BYTES, keep: str | None = None):
+    if not os.path.isdir(lut_cache_folder):
+        return
+    now = time.time()
+    tables = []
+    for entry in os.scandir(lut_cache_folder):
+        if not entry.is_file():
+            continue
+        stat = entry.stat()
+        if entry.name.endswith(".tmp.npy"):
+            if now - stat.st_mtime > STALE_TEMP_SECONDS:
+                _remove(entry.path)
+        elif entry.name.endswith(".npy"):
+            tables.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in tables)
+    for _, size, table_path in sorted(tables):
+        if total <= max_bytes:
+            break
+        if keep is not None and os.path.normcase(table_path) == os.path.normcase(keep):
+            continue
+        if _remove(table_path):
+            total -= size
+
+
+def _remove(file_path: str) -> bool:
+    try:
+        os.remove(file_path)
+        return True
+    except OSError:
+        # Still memory-mapped by another process (Windows)
+        return False
+
+
+# Same as block_matcher.match_pixels, but fully opaque pixels are looked up in the LUT
+# The alpha channel is part of the colour comparison, so the rest still go through the matcher
+def match_pixels_lut(
+        pixels: np.ndarray,
+        palette: block_matcher.BlockPalette,
+        color_compare: str,
+        lut: np.ndarray,
+        bits: int,
+        backend: str = "brute"
+) -> np.ndarray:
+    pixels = np.asarray(pixels)
+    flat = pixels.reshape(-1, 4)
+    shift = 8 - bits
+    cells = (
+        ((flat[:, 0].astype(np.intp) >> shift) << (2 * bits))
+        | ((flat[:, 1].astype(np.intp) >> shift) << bits)
+        | (flat[:, 2].astype(np.intp) >> shift)
+    )
+    out = lut[cells].astype(np.intp)
+
+    translucent = flat[:, 3] != 255
+    if translucent.any():
+        out[translucent] = block_matcher.match_pixels(flat[translucent], palette, color_compare, backend)
+    return out.reshape(pixels.shape[:-1])
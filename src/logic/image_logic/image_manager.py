@@ -1,19 +1,23 @@
-import math
 import os
 import mcschematic
 import logging
 from typing import Union
 
+import numpy as np
 from PIL import Image, ImageFile
 
 # 现有逻辑复用的两个模块
 from src.logic.image_logic import image_to_redstone_lamps, img_to_blocks as img_to_block_img
-from src.logic.image_logic.block_parser import block_parser
+from src.logic.image_logic import block_matcher, palette_dithering, schem_writer
 
 logger = logging.getLogger(__name__)
+
+# 方块图片输出超过这个像素数（宽*高）时，改为流式写入 png
+STREAM_PIXEL_BUDGET = 64_000_000
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 try:
-    from mcstructure import Block, Structure
+    # 用项目自带的 mcstructure（PyPI 上的版本没有 set_blocks_from_array），它只依赖 pynbt
+    from src.logic.image_logic.mcstructure import Block, Structure
 except Exception:
     Block = None
     Structure = None
@@ -50,6 +54,27 @@ def _normalize_scale_to_tile(step: Union[str, float, int]) -> int:
     return tile
 
 
+# Shrinks the image so that every pixel becomes one block (tile)
+def scale_to_tiles(img: Image.Image, scale: Union[str, float, int]) -> Image.Image:
+    # Scale to numeric tile step (integer >= 1)
+    scale: int = _normalize_scale_to_tile(scale)
+
+    # Getting the img to a multiple of 16 so textures match up
+    if img.width % scale != 0:
+        new_width = img.width + (scale - (img.width % scale))
+    else:
+        new_width = img.width
+
+    if img.height % scale != 0:
+        new_height = img.height + (scale - (img.height % scale))
+    else:
+        new_height = img.height
+
+    img = img.crop((0, 0, new_width, new_height))
+    img.thumbnail((img.width // scale, img.height // scale))
+    return img
+
+
 # Convert an image, to what the user specified
 def manipulate_image(
         filepath: str, output: str, manipulation: str, crop: list | None, scale: Union[str, float, int], details: dict
@@ -71,22 +96,7 @@ def manipulate_image(
         # Cropping the image
         img = img.crop((crop[0], crop[1], crop[2], crop[3]))
 
-    # Scale to numeric tile step (integer >= 1)
-    scale: int = _normalize_scale_to_tile(scale)
-
-    # Getting the img to a multiple of 16 so textures match up
-    if img.width % scale != 0:
-        new_width = img.width + (scale - (img.width % scale))
-    else:
-        new_width = img.width
-
-    if img.height % scale != 0:
-        new_height = img.height + (scale - (img.height % scale))
-    else:
-        new_height = img.height
-
-    img = img.crop((0, 0, new_width, new_height))
-    img.thumbnail((img.width // scale, img.height // scale))
+    img = scale_to_tiles(img, scale)
     yield img.width
 
     if manipulation == "Image To Any Block Image":
@@ -124,11 +134,58 @@ def manipulate_image(
     return
 
 
+# 视频管道用：把一帧直接渲染到内存里（不读写文件）
+# 先 yield 方块宽度，之后是进度（列号），最后 yield 渲染好的 RGBA Image
+def render_frame(img: Image.Image, manipulation: str, scale: Union[str, float, int], details: dict):
+    img = scale_to_tiles(img, scale)
+    yield img.width
+    yield from render_tiles(img, manipulation, details)
+
+
+# 同 render_frame，但图片已经按 scale 缩好（每个像素一个方块）
+def render_tiles(img: Image.Image, manipulation: str, details: dict):
+    manipulation = manipulation.replace("Video", "Image")
+    if manipulation == "Image To Any Block Image":
+        frames = img_to_block_img.img_to_blocks(img.convert("RGBA"), make_block_details(details))
+    elif manipulation == "Image To Redstone Lamps Image":
+        frames = image_to_redstone_lamps.img_to_redstone_lamps(
+            img.convert("RGB"), details['brightness'], details['dither'], details['alternate'],
+            details.get('dither_method'), details.get('serpentine', False)
+        )
+    else:
+        raise ValueError(f"{manipulation} does not render to an image")
+
+    for value in frames:
+        if isinstance(value, Image.Image):
+            yield value.convert("RGBA")
+        else:
+            yield value
+
+
+# 视频导出原理图用：把一帧（已按 scale 缩好）转成方块索引数组，不写文件
+def render_schematic(img: Image.Image, manipulation: str, details: dict) -> schem_writer.IndexedSchematic:
+    manipulation = manipulation.replace("Video", "Image")
+    if manipulation == "Image To Any Block Schematic":
+        for value in img_to_block_img.img_to_blocks_schem(img.convert("RGBA"), make_block_details(details)):
+            if isinstance(value, schem_writer.IndexedSchematic):
+                return value
+        raise ValueError("No blocks left to build the schematic with")
+    elif manipulation == "Image To Redstone Lamps Schematic":
+        lit_mask = image_to_redstone_lamps.lamps_lit_mask(
+            img.convert("RGB"), details['brightness'], details['dither'], details['alternate'],
+            details.get('dither_method'), details.get('serpentine', False)
+        )
+        return image_to_redstone_lamps.lamps_schematic(lit_mask, details.get('place_redstone_blocks', False))
+    raise ValueError(f"{manipulation} does not render to a schematic")
+
+
 def img_to_lamps(img: Image.Image, output: str, details: dict):
     brightness = details['brightness']
     dither = details['dither']
     alternate = details['alternate']
-    for value in image_to_redstone_lamps.img_to_redstone_lamps(img, brightness, dither, alternate):
+    for value in image_to_redstone_lamps.img_to_redstone_lamps(
+            img, brightness, dither, alternate, details.get('dither_method'), details.get('serpentine', False)
+    ):
         if isinstance(value, Image.Image):
             img = value
         else:
@@ -146,12 +203,13 @@ def img_to_lamps_schem(img: Image.Image, output: str, details: dict):
     alternate = details['alternate']
     place_redstone_blocks = details['place_redstone_blocks']
 
-    schem: mcschematic.MCSchematic = ...
+    schem: schem_writer.IndexedSchematic = ...
     for value in image_to_redstone_lamps.img_to_redstone_lamps_schem(
-            img, brightness, place_redstone_blocks, dither, alternate
+            img, brightness, place_redstone_blocks, dither, alternate,
+            details.get('dither_method'), details.get('serpentine', False)
     ):
-        if isinstance(value, mcschematic.MCSchematic):
-            schem: mcschematic.MCSchematic = value
+        if isinstance(value, schem_writer.IndexedSchematic):
+            schem = value
         else:
             yield value
     yield "Done Processing!"
@@ -162,24 +220,42 @@ def img_to_lamps_schem(img: Image.Image, output: str, details: dict):
     return
 
 
+# GUI/CLI 的 details -> img_to_blocks 模块需要的 DetailsDict
+def make_block_details(details: dict) -> dict:
+    return {
+        'side': details['side'],
+        'blocked_list': details['blocklist'],
+        'mode': details['mode'],
+        'color_set': details['color_set'][0],
+        'color_compare': details['color_compare'][0],
+        'lut_bits': details.get('lut_bits'),
+        'match_backend': details.get('match_backend'),
+        'block_dither': details.get('block_dither'),
+        'block_dither_space': details.get('block_dither_space') or "rgb"
+    }
+
+
 def img_to_blocks(img: Image.Image, output: str, details: dict):
-    for value in img_to_block_img.img_to_blocks(
-            img,
-            {
-                'side': details['side'],
-                'blocked_list': details['blocklist'],
-                'mode': details['mode'],
-                'color_set': details['color_set'][0],
-                'color_compare': details['color_compare'][0]
-            }
-    ):
+    block_details = make_block_details(details)
+    ext = os.path.splitext(output)[1].lower()
+
+    # 输出画布超过像素预算时，按行带流式写入 png，避免整张画布常驻内存
+    budget = details.get('stream_pixel_budget') or STREAM_PIXEL_BUDGET
+    if ext == '.png' and (img.width * 16) * (img.height * 16) > budget:
+        logger.info(f"Output is over {budget} pixels, streaming it into the png")
+        for value in img_to_block_img.img_to_blocks_png_stream(img, block_details, output):
+            yield value
+        yield "Done Processing!"
+        yield "Done!"
+        return
+
+    for value in img_to_block_img.img_to_blocks(img, block_details):
         if isinstance(value, Image.Image):
             img = value
         else:
             yield value
     yield "Done Processing!"
     # --- JPEG 容错：退化为 RGB ---
-    ext = os.path.splitext(output)[1].lower()
     if ext in ('.jpg', '.jpeg') and img.mode == 'RGBA':
         img = img.convert('RGB')
     img.save(output)
@@ -189,19 +265,10 @@ def img_to_blocks(img: Image.Image, output: str, details: dict):
 
 
 def img_to_blocks_schem(img: Image.Image, output: str, details: dict):
-    schem: mcschematic.MCSchematic = ...
-    for value in img_to_block_img.img_to_blocks_schem(
-            img,
-            {
-                'side': details['side'],
-                'blocked_list': details['blocklist'],
-                'mode': details['mode'],
-                'color_set': details['color_set'][0],
-                'color_compare': details['color_compare'][0]
-            }
-    ):
-        if isinstance(value, mcschematic.MCSchematic):
-            schem: mcschematic.MCSchematic = value
+    schem: schem_writer.IndexedSchematic = ...
+    for value in img_to_block_img.img_to_blocks_schem(img, make_block_details(details)):
+        if isinstance(value, schem_writer.IndexedSchematic):
+            schem = value
         else:
             yield value
     yield "Done Processing!"
@@ -275,7 +342,7 @@ def img_to_blocks_mcs(image: Image.Image, output: str, details: dict):
     即落在 x–z 平面，Y 固定为 1
     """
     if Block is None or Structure is None:
-        yield "ERROR: mcstructure 库未安装，请先 `pip install mcstructure`"
+        yield "ERROR: 无法加载 mcstructure（缺少 pynbt），请先 `pip install pynbt`"
         return
 
     # —— 参数与默认值 —— 
@@ -286,47 +353,40 @@ def img_to_blocks_mcs(image: Image.Image, output: str, details: dict):
     _raw_cc = details.get('color_compare')
     color_compare = _raw_cc[0] if isinstance(_raw_cc, (list, tuple)) and _raw_cc else (_raw_cc or 'Absolute Difference')
 
-    # —— 色板/色差函数 —— 
+    # —— 色板 —— 
     all_blocks_data = getattr(img_to_block_img, 'blocks_data', None)
     if all_blocks_data is None:
         yield "ERROR: 未能加载 blocks_data（请确认 img_to_blocks 模块内已初始化 blocks_data）"
         return
-    dist_fn = getattr(img_to_block_img, 'color_compare_to_function', None)
-    if dist_fn is None:
-        yield "ERROR: 未找到 color_compare_to_function"
-        return
-    distance_function = dist_fn(color_compare)
 
     # 过滤清单
-    if mode == "Whitelist":
-        new_blocks_list = [b for b in all_blocks_data if b[0] in blocked_list]
-    elif mode == "Blacklist":
-        new_blocks_list = [b for b in all_blocks_data if b[0] not in blocked_list]
-    else:
-        new_blocks_list = all_blocks_data
+    new_blocks_list = block_matcher.filter_blocks(all_blocks_data, mode, blocked_list)
     if not new_blocks_list:
         yield "ERROR"
         return
 
-    # 像素 -> 方块（挑选最接近颜色的方块）
-    def pix_to_block(pix):
-        best_idx, best_diff = -1, math.inf
-        # 为兼容旧资源，按常见顺序找可用面
-        side_order = ('top','north','south','east','west','bottom')
-        for idx, block_val in enumerate(new_blocks_list):
-            chosen_side = next((s for s in side_order if s in block_val[1]), None)
-            if not chosen_side:
-                continue
-            col = block_val[1][chosen_side]['color'].get(color_set)
-            if col is None:
-                continue
-            diff = distance_function(pix, col)
-            if diff < best_diff:
-                best_diff = diff
-                best_idx = idx
-        if best_idx < 0:
-            return "minecraft:air"
-        return block_parser(new_blocks_list[best_idx][0])
+    # 为兼容旧资源，按常见顺序找可用面
+    side_order = ('top', 'north', 'south', 'east', 'west', 'bottom')
+    palette = block_matcher.compile_palette(new_blocks_list, side_order, color_set)
+
+    # 像素 -> 方块：只对去重后的颜色做一次批量匹配，再按索引散回每个像素
+    np_image = np.asarray(image.convert("RGBA"))
+    def match(rgba: np.ndarray) -> np.ndarray:
+        return img_to_block_img.match_image(
+            rgba, palette, side_order, color_set, color_compare, mode, blocked_list,
+            details.get('lut_bits'), details.get('match_backend') or "brute"
+        )
+
+    if details.get('block_dither'):
+        block_indices = palette_dithering.dither_match(
+            np_image, palette, details['block_dither'], details.get('block_dither_space') or "rgb", match
+        )
+    else:
+        block_indices = match(np_image)
+    palette_blocks = []
+    for block_name in palette.names:
+        name, states = _parse_block_for_mcs(img_to_block_img.bundle.block_state(block_name))
+        palette_blocks.append(None if (name == "minecraft:air" and not states) else Block(name, **states))
 
     W, H = image.width, image.height
 
@@ -334,22 +394,16 @@ def img_to_blocks_mcs(image: Image.Image, output: str, details: dict):
     y_level = 1
     struct = Structure((W, y_level + 1, H), Block("minecraft:air"))
 
-    # 写入：像素 (x,y) -> (x, 1, y)
-    for x in range(W):
-        for y in range(H):
-            pix = image.getpixel((x, y))
-            if isinstance(pix, (tuple, list)) and len(pix) >= 4 and pix[3] <= 10:
-                continue
-            blk_val = pix_to_block(pix)
-            name, states = _parse_block_for_mcs(blk_val)
-            if name == "minecraft:air" and not states:
-                continue
-            pos = (x, y_level, y)  # x,z 由像素 x,y 组成，y 固定为 1
-            try:
-                struct.set_block(pos, Block(name, **states))
-            except Exception:
-                pass
-        yield x
+    # 写入：像素 (x,y) -> (x, 1, y)，一次性按索引数组整面写入
+    # 透明像素和空气保持原样（-1 表示不写）
+    if palette.names:
+        place_ids = np.asarray(block_indices, dtype=np.intp).copy()
+        is_air = np.array([blk is None for blk in palette_blocks], dtype=bool)
+        place_ids[(np_image[..., 3] <= 10) | is_air[place_ids]] = -1
+    else:
+        place_ids = np.full(np_image.shape[:2], -1, dtype=np.intp)
+    struct.set_blocks_from_array((0, y_level, 0), place_ids.T, palette_blocks)
+    yield from range(W)
 
     # 写出 .mcstructure
     head, tail = os.path.split(output)
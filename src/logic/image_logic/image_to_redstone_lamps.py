@@ -1,6 +1,6 @@
 from PIL import Image, ImageFile
-import mcschematic
 import numpy as np
+from src.logic.image_logic import dithering, schem_writer, tile_atlas
 from src.path_manager.pather import resource_path
 
 ImageFile.LOAD_TRUNCATED_IMAGES = True
@@ -13,113 +13,73 @@ lit_lamp_np = np.array(lit_lamp.convert("RGB"))
 unlit_lamp = Image.open(resource_path("./assets/blocks/redstone_lamp.png"))
 # noinspection PyTypeChecker
 unlit_lamp_np = np.array(unlit_lamp.convert("RGB"))
+lamps_atlas = tile_atlas.build_atlas([unlit_lamp_np, lit_lamp_np])
+
+# Block states of the lamp schematics
+LAMP_BLOCKS = ["minecraft:redstone_lamp", "minecraft:redstone_lamp[lit=true]", "minecraft:air", "minecraft:redstone_block"]
 
 
 def img_to_redstone_lamps(
         img: Image.Image,
         brightness: int,
         dither: bool = False,
-        alternate_mode: bool = False
+        alternate_mode: bool = False,
+        dither_method: str | None = None,
+        serpentine: bool = False
 ):
-    bw = [[]]
-    if dither:
-        bw = img.convert('1')
-    if alternate_mode and not dither:
-        gray = img.convert('L')
-        # Let numpy do the heavy lifting for converting pixels to pure black or white
-        bw = np.asarray(gray).copy()
-
-        bw[bw < brightness] = 0  # Black
-        bw[bw >= brightness] = 255  # White
+    lit_mask = lamps_lit_mask(img, brightness, dither, alternate_mode, dither_method, serpentine)
 
     # Storing the new pixels in a numpy array, as it is a bit faster than Pil
     np_arr_test = np.zeros(shape=(img.height * 16, img.width * 16, 3), dtype=np.uint8)
-    for x in range(0, img.width):
-        for y in range(0, img.height):
-            pos = [y * 16, x * 16]
-            if dither:
-                pixel = bw.getpixel((x, y))
-                if pixel == 255:
-                    np_arr_test[pos[0]:pos[0] + 16, pos[1]:pos[1] + 16] = lit_lamp_np
-                else:
-                    np_arr_test[pos[0]:pos[0] + 16, pos[1]:pos[1] + 16] = unlit_lamp_np
-            else:
-                # Getting the average brightness. If its over threshold, we use the lit redstone lamp
-                if alternate_mode:
-                    pixel = bw[y][x]
-                    if pixel == 255:
-                        np_arr_test[pos[0]:pos[0] + 16, pos[1]:pos[1] + 16] = lit_lamp_np
-                    else:
-                        np_arr_test[pos[0]:pos[0] + 16, pos[1]:pos[1] + 16] = unlit_lamp_np
-                else:
-                    pixel = img.getpixel((x, y))
-                    avg_brightness = (pixel[0] + pixel[1] + pixel[2]) / 3
-                    # Use lit redstone lap
-                    if avg_brightness >= brightness:
-                        np_arr_test[pos[0]:pos[0] + 16, pos[1]:pos[1] + 16] = lit_lamp_np
-                    # Use unlit redstone lamp
-                    else:
-                        np_arr_test[pos[0]:pos[0] + 16, pos[1]:pos[1] + 16] = unlit_lamp_np
+    # Index 0 is the unlit lamp, 1 the lit one
+    for x in tile_atlas.composite_columns(lamps_atlas, lit_mask.astype(np.intp), np_arr_test):
         yield x
     yield Image.fromarray(np_arr_test)
     return
 
 
-def img_to_redstone_lamps_schem(
-        img: Image.Image, brightness: int, place_redstone_blocks: bool,
-        dither: bool = False, alternate_mode: bool = False
-):
-    schem = mcschematic.MCSchematic()
-    bw = [[]]
+# Decides which lamps are lit (True) for every pixel, in any of the three modes
+# The dithering uses one of dithering.DITHER_METHODS (see dithering.dither_image)
+def lamps_lit_mask(
+        img: Image.Image, brightness: int, dither: bool = False, alternate_mode: bool = False,
+        dither_method: str | None = None, serpentine: bool = False
+) -> np.ndarray:
     if dither:
-        bw = img.convert('1')
-    if alternate_mode and not dither:
-        gray = img.convert('L')
+        return dithering.dither_image(img, brightness, dither_method, serpentine)
+    if alternate_mode:
         # Let numpy do the heavy lifting for converting pixels to pure black or white
-        bw = np.asarray(gray).copy()
+        return np.asarray(img.convert('L')) >= brightness
+    # Getting the average brightness. If its over threshold, we use the lit redstone lamp
+    rgb = np.asarray(img.convert('RGB')).astype(np.int32)
+    avg_brightness = (rgb[:, :, 0] + rgb[:, :, 1] + rgb[:, :, 2]) / 3
+    return avg_brightness >= brightness
 
-        bw[bw < brightness] = 0  # Black
-        bw[bw >= brightness] = 255  # White
 
+def img_to_redstone_lamps_schem(
+        img: Image.Image, brightness: int, place_redstone_blocks: bool,
+        dither: bool = False, alternate_mode: bool = False,
+        dither_method: str | None = None, serpentine: bool = False
+):
+    lit_mask = lamps_lit_mask(img, brightness, dither, alternate_mode, dither_method, serpentine)
+    # A single picture only gets the layer of redstone blocks when at least one lamp is lit
+    schem = lamps_schematic(lit_mask, place_redstone_blocks and bool(lit_mask.any()))
+    # The blocks are all placed at once, the columns are only yielded for the progress bars
     for x in range(0, img.width):
-        for y in range(0, img.height):
-            if dither:
-                pixel = bw.getpixel((x, y))
-                if pixel == 255:
-                    if place_redstone_blocks:
-                        schem.setBlock((-x, 0, -y), "minecraft:redstone_lamp")
-                        schem.setBlock((-x, -1, -y), "minecraft:redstone_block")
-                    else:
-                        schem.setBlock((-x, 0, -y), "minecraft:redstone_lamp[lit=true]")
-                else:
-                    schem.setBlock((-x, 0, -y), "minecraft:redstone_lamp")
-            else:
-                if alternate_mode:
-                    pixel = bw[y][x]
-                    if pixel == 255:
-                        if place_redstone_blocks:
-                            schem.setBlock((-x, 0, -y), "minecraft:redstone_lamp")
-                            schem.setBlock((-x, -1, -y), "minecraft:redstone_block")
-                        else:
-                            schem.setBlock((-x, 0, -y), "minecraft:redstone_lamp[lit=true]")
-                    else:
-                        schem.setBlock((-x, 0, -y), "minecraft:redstone_lamp")
-                else:
-                    pixel = img.getpixel((x, y))
-                    avg_brightness = (pixel[0] + pixel[1] + pixel[2]) / 3
-
-                    # Use lit redstone lap
-                    if avg_brightness >= brightness:
-                        # new_img.paste(lit_lamp, (x * 16, y * 16))
-                        if place_redstone_blocks:
-                            schem.setBlock((-x, 0, -y), "minecraft:redstone_lamp")
-                            schem.setBlock((-x, -1, -y), "minecraft:redstone_block")
-                        else:
-                            schem.setBlock((-x, 0, -y), "minecraft:redstone_lamp[lit=true]")
-                    # Use unlit redstone lamp
-                    else:
-                        schem.setBlock((-x, 0, -y), "minecraft:redstone_lamp")
         yield x
 
     yield schem
     return
+
+
+# The blocks of the lamps of a lit mask, laid flat like in img_to_redstone_lamps_schem (lamp of pixel (x, y) at (-x, 0, -y))
+# With place_redstone_blocks, the lit lamps are unlit lamps over a redstone block (at (-x, -1, -y)),
+# and the layer of redstone blocks is always there, even when no lamp is lit (so every frame of a video has the same size)
+def lamps_schematic(lit_mask: np.ndarray, place_redstone_blocks: bool) -> schem_writer.IndexedSchematic:
+    if not place_redstone_blocks:
+        return schem_writer.IndexedSchematic.from_image(lit_mask.astype(np.intp), LAMP_BLOCKS, vertical=False)
+    height, width = lit_mask.shape
+    block_ids = np.empty((2, height, width), dtype=np.intp)
+    # Both axes go towards negative coordinates, so the mask is flipped in both directions
+    block_ids[0] = np.where(lit_mask[::-1, ::-1], 3, 2)
+    block_ids[1] = 0
+    return schem_writer.IndexedSchematic(block_ids, LAMP_BLOCKS, (-(width - 1), -1, -(height - 1)))
@@ -1,16 +1,12 @@
-import math
-import mcschematic
-import json
-import functools
 import numpy as np
-from src.logic.image_logic.block_parser import block_parser
+from src.logic.image_logic import block_matcher, every_pixel_generator, palette_bundle, palette_dithering
+from src.logic.image_logic import schem_writer, tile_atlas
+from src.logic.fileio import png_stream
 from PIL import Image, ImageFile
-from src.path_manager.pather import resource_path
-import os
 from typing import TypedDict
 
 
-class DetailsDict(TypedDict):
+class _RequiredDetailsDict(TypedDict):
     side: str
     blocked_list: list
     mode: str
@@ -18,132 +14,230 @@ class DetailsDict(TypedDict):
     color_compare: str
 
 
+class DetailsDict(_RequiredDetailsDict, total=False):
+    # Bits per channel of the precomputed rgb lookup table, None to compare every colour directly
+    lut_bits: int | None
+    # "brute" or "kdtree", see block_matcher.MATCH_BACKENDS
+    match_backend: str
+    # One of dithering.DITHER_METHODS, None to just use the closest block (see palette_dithering)
+    block_dither: str | None
+    # "rgb" or "lab", see palette_dithering.BLOCK_DITHER_SPACES
+    block_dither_space: str
+
+
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
 # TODO: ALTERNATE, A BIT DIFFERENT RENDERER
-# TODO: INTERBLOCK PIXEL ACCOUNTER
 
 
-# Loading the pre-generated blocks color
-path = resource_path("./assets/blocks/all_blocks_textures/")
-with open(resource_path("./assets/blocks/img_generator_code/out_all_colours.json"), "r") as f:
-    blocks_data: list = list(json.load(f).items())
+# Loading the pre-generated blocks color, textures and block states (memory-mapped, see palette_bundle)
+bundle = palette_bundle.load_bundle()
+blocks_data: list = bundle.blocks_data()
 
-# Storing all the images in memory (as numpy arrays)
+# All the block textures (as numpy arrays), keyed by block name + side
+# They are only loaded the first time they are needed (see block_textures), because the video workers
+# get them from shared memory instead of every process loading its own copy
 blocks_img_np = {}
-for block in blocks_data:
-    for block_side in block[1].keys():
-        if block_side == "extra":
-            pass
-        else:
-            img = Image.open(os.path.join(path, block[1][block_side]['file'])).convert("RGBA")
-            # noinspection PyTypeChecker
-            blocks_img_np[block[0] + block_side] = np.array(img)
+
+
+# Every texture in one (N, 16, 16, 4) array (copied out of the bundle), with the name + side of each one
+def load_block_textures() -> tuple[list[str], np.ndarray]:
+    return bundle.block_textures()
+
+
+# Uses already loaded textures (like the ones in shared memory), textures[i] being the texture of keys[i]
+def set_block_textures(keys: list[str], textures: np.ndarray):
+    blocks_img_np.clear()
+    blocks_img_np.update(zip(keys, textures))
+    loaded_atlases.clear()
+
+
+def block_textures() -> dict:
+    if not blocks_img_np:
+        set_block_textures(*load_block_textures())
+    return blocks_img_np
+
+
+# The atlases already built by this process, keyed by side and block names
+# (Videos use the same palette for every frame)
+loaded_atlases = {}
+
+
+# All the textures of the palette in one array, with an empty tile at the end for the (nearly) transparent pixels
+def palette_atlas(palette: block_matcher.BlockPalette, side: str) -> np.ndarray:
+    key = (side, tuple(palette.names))
+    if key not in loaded_atlases:
+        if len(loaded_atlases) >= 16:
+            loaded_atlases.clear()
+        textures = block_textures()
+        loaded_atlases[key] = tile_atlas.build_atlas([textures[name + side] for name in palette.names], add_blank=True)
+    return loaded_atlases[key]
 
 
 def img_to_blocks(image: Image.Image, details: DetailsDict):
-    side: str = details['side']
-    blocked_list: list = details['blocked_list']
-    mode: str = details['mode']
-    color_set: str = details['color_set']
-    color_compare: str = details['color_compare']
     # Storing the pixels data in numpy array as it is faster
     np_new_image = np.zeros(shape=(image.height * 16, image.width * 16, 4), dtype=np.uint8)
 
-    # Filtering out the blocks, depending on how the user configured the options
-    new_blocks_list = []
-    if mode == "Whitelist":
-        new_blocks_list = [selected_block for selected_block in blocks_data if selected_block[0] in blocked_list]
-    elif mode == "Blacklist":
-        new_blocks_list = [selected_block for selected_block in blocks_data if selected_block[0] not in blocked_list]
-    else:
-        new_blocks_list = blocks_data
-
-    # If list is empty, we return
-    if not new_blocks_list:
+    prepared = blocks_atlas_and_indices(image, details)
+    # If there are no blocks to use, we return
+    if prepared is None:
         yield Image.fromarray(np_new_image)
         return
+    atlas, block_indices = prepared
 
-    # This function is cached, to increase speed
-    @functools.lru_cache(maxsize=100000)
-    def pix_to_block(pix, distance_function: callable, avg_color_set: str):
-        # The below statement becomes a list, with all the differences between the current pixel, and all the blocks
-        all_differences = [
-            (
-                (
-                    distance_function(pix, block_val[1][side]['color'][avg_color_set])
-                ) if (side in block_val[1]) else math.inf
-            ) for block_val in new_blocks_list
-        ]
-        # Getting the lowest different block
-        block_index = all_differences.index(min(all_differences))
-        block_img = blocks_img_np[new_blocks_list[block_index][0] + side]
-        return block_img
-
-    for x in range(0, image.width):
-        for y in range(0, image.height):
-            pos = (y * 16, x * 16)
-            pixel = image.getpixel((x, y))
-            if pixel[3] > 10:
-                block_texture = pix_to_block(pixel, color_compare_to_function(color_compare), color_set)
-                # Using numpy arrays because they are just faster
-                np_new_image[pos[0]:pos[0] + 16, pos[1]:pos[1] + 16] = block_texture
+    # Using numpy arrays because they are just faster
+    for x in tile_atlas.composite_columns(atlas, block_indices, np_new_image):
         yield x
 
     yield Image.fromarray(np_new_image)
     return
 
 
+# Same as img_to_blocks, but the output is written straight into a png file, one band of block rows at a time
+# So only a few rows of the (gigantic) output are ever in memory
+# The progress is still yielded in columns (0 to width - 1), so the progress bars work the same
+def img_to_blocks_png_stream(image: Image.Image, details: DetailsDict, output: str):
+    prepared = blocks_atlas_and_indices(image, details)
+    if prepared is None:
+        atlas = np.zeros((1, 16, 16, 4), dtype=np.uint8)
+        block_indices = np.zeros((image.height, image.width), dtype=np.intp)
+    else:
+        atlas, block_indices = prepared
+
+    band = max(1, tile_atlas.BAND_TILES // max(1, image.width))
+    last_x = -1
+    with png_stream.StreamingPNGWriter(output, image.width * 16, image.height * 16, "RGBA") as writer:
+        for y_start in range(0, image.height, band):
+            y_stop = min(image.height, y_start + band)
+            writer.write_rows(tile_atlas.composite_rows(atlas, block_indices, y_start, y_stop))
+            for x in range(last_x + 1, y_stop * image.width // image.height):
+                yield x
+                last_x = x
+    return
+
+
+# Filters the blocks, matches every pixel and builds the texture atlas
+# Returns the atlas and the (H, W) index of the tile to use for every pixel,
+# or None if there are no blocks that can be used
+def blocks_atlas_and_indices(image: Image.Image, details: DetailsDict) -> tuple[np.ndarray, np.ndarray] | None:
+    prepared = prepare_palette(details)
+    if prepared is None:
+        return None
+    palette, atlas = prepared
+
+    # Matching every pixel to its closest block, in one go
+    # noinspection PyTypeChecker
+    np_image = np.asarray(image.convert("RGBA"))
+    block_indices = match_details(np_image, palette, details)
+    # The (nearly) transparent pixels use the empty tile at the end of the atlas
+    block_indices = np.where(np_image[:, :, 3] > 10, block_indices, len(palette.names))
+    return atlas, block_indices
+
+
+# The palette for these settings, and the atlas of its textures (with the empty tile at the end)
+# None if there are no blocks to use
+def prepare_palette(details: DetailsDict) -> tuple[block_matcher.BlockPalette, np.ndarray] | None:
+    side: str = details['side']
+
+    # Filtering out the blocks, depending on how the user configured the options
+    new_blocks_list = block_matcher.filter_blocks(blocks_data, details['mode'], details['blocked_list'])
+    if not new_blocks_list:
+        return None
+
+    palette = block_matcher.compile_palette(new_blocks_list, side, details['color_set'])
+    if not palette.names:
+        return None
+    return palette, palette_atlas(palette, side)
+
+
+# match_image, with the settings taken from the details
+# With dithering, pixels must be a whole (H, W, 4) image
+def match_details(pixels: np.ndarray, palette: block_matcher.BlockPalette, details: DetailsDict) -> np.ndarray:
+    def match(rgba: np.ndarray) -> np.ndarray:
+        return match_image(
+            rgba, palette, details['side'], details['color_set'], details['color_compare'], details['mode'],
+            details['blocked_list'], details.get('lut_bits'), details.get('match_backend') or "brute"
+        )
+
+    if details.get('block_dither'):
+        return palette_dithering.dither_match(
+            pixels, palette, details['block_dither'], details.get('block_dither_space') or "rgb", match
+        )
+    return match(pixels)
+
+
 def img_to_blocks_schem(image: Image.Image, details: DetailsDict):
     side: str = details['side']
     blocked_list: list = details['blocked_list']
     mode: str = details['mode']
     color_set: str = details['color_set']
-    color_compare: str = details['color_compare']
-    schem = mcschematic.MCSchematic()
 
     # Filtering out the blocks, depending on how the user configured the options
-    new_blocks_list = []
-    if mode == "Whitelist":
-        new_blocks_list = [selected_block for selected_block in blocks_data if selected_block[0] in blocked_list]
-    elif mode == "Blacklist":
-        new_blocks_list = [selected_block for selected_block in blocks_data if selected_block[0] not in blocked_list]
-    else:
-        new_blocks_list = blocks_data
+    new_blocks_list = block_matcher.filter_blocks(blocks_data, mode, blocked_list)
 
     if not new_blocks_list:
         yield "ERROR"
         return
 
-    # Caching, for speed
-    def pix_to_block(pix, distance_function: callable, avg_color_set: str):
-        # The below statement becomes a list, with all the differences between the current pixel, and all the blocks
-        all_differences = [
-            (
-                (
-                    distance_function(pix, block_val[1][side]['color'][avg_color_set])
-                ) if (side in block_val[1]) else math.inf
-            ) for block_val in new_blocks_list
-        ]
-        # Getting the lowest different block
-        block_index = all_differences.index(min(all_differences))
-        block_data = block_parser(new_blocks_list[block_index][0])
-        return block_data
-
-    for x in range(0, image.width):
-        for y in range(0, image.height):
-            pixel = image.getpixel((x, y))
-            block_name = pix_to_block(pixel, color_compare_to_function(color_compare), color_set)
-            if side == "top" or side == "bottom":
-                schem.setBlock((-x, 0, -y), block_name)
-            else:
-                schem.setBlock((-x, -y, 0), block_name)
-        yield x
+    palette = block_matcher.compile_palette(new_blocks_list, side, color_set)
+    if not palette.names:
+        yield "ERROR"
+        return
 
+    # noinspection PyTypeChecker
+    np_image = np.asarray(image.convert("RGBA"))
+    if details.get('block_dither'):
+        # The dithering needs the whole image at once, so the progress only comes when it is done
+        block_indices = match_details(np_image, palette, details)
+        yield from range(0, image.width)
+    else:
+        # Matched a band of columns at a time, and the progress is yielded as every band is done
+        block_indices = np.empty(np_image.shape[:2], dtype=np.intp)
+        band = max(1, tile_atlas.BAND_TILES // max(1, image.height))
+        for x_start in range(0, image.width, band):
+            x_stop = min(image.width, x_start + band)
+            block_indices[:, x_start:x_stop] = match_details(np_image[:, x_start:x_stop], palette, details)
+            yield from range(x_start, x_stop)
+    block_names = [bundle.block_state(name) for name in palette.names]
+
+    # Top and bottom lie flat at (-x, 0, -y), the other sides stand up at (-x, -y, 0)
+    schem = schem_writer.IndexedSchematic.from_image(
+        block_indices, block_names, vertical=not (side == "top" or side == "bottom")
+    )
     yield schem
     return
 
 
+# The lookup tables already loaded by this process
+loaded_luts = {}
+
+
+# Finds the closest block (index into the palette) for every pixel of the image
+# With lut_bits, the precomputed lookup table for these settings is used (and built the first time)
+def match_image(
+        np_image: np.ndarray,
+        palette: block_matcher.BlockPalette,
+        side,
+        color_set: str,
+        color_compare: str,
+        mode: str,
+        blocked_list: list,
+        lut_bits: int | None = None,
+        backend: str = "brute"
+) -> np.ndarray:
+    if not lut_bits:
+        return block_matcher.match_pixels(np_image, palette, color_compare, backend)
+
+    key = every_pixel_generator.lut_key(side, color_set, color_compare, mode, blocked_list, lut_bits)
+    if key not in loaded_luts:
+        if len(loaded_luts) >= 16:
+            loaded_luts.clear()
+        loaded_luts[key] = every_pixel_generator.load_or_build_lut(palette, key, color_compare, lut_bits, backend)
+    return every_pixel_generator.match_pixels_lut(
+        np_image, palette, color_compare, loaded_luts[key], lut_bits, backend
+    )
+
+
 # This is just to find which color function and color average to use
 def color_compare_to_function(color_compare: str) -> callable:
     func = abs_value_difference
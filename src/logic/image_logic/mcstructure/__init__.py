@@ -17,9 +17,11 @@ from __future__ import annotations
 
 from dataclasses import dataclass
 from functools import partial
-from itertools import repeat
+import io
 import json
-from typing import Any, BinaryIO, Tuple
+import mmap
+import struct
+from typing import Any, BinaryIO, Callable, Tuple
 
 import numpy as np
 from numpy.typing import NDArray
@@ -39,6 +41,9 @@ integer determine the game version number. For example, ``17879555`` is
 STRUCTURE_MAX_SIZE: tuple[int, int, int] = (9999, 9999, 9999)
 """The maximum size a structure can have."""
 
+_INT_ARRAY_CHUNK: int = 2**16
+"""How many ints of a constant filled :class:`_IntArrayList` are written at once."""
+
 
 # TODO: cover all tags
 def _into_pyobj(tag: BaseTag) -> Any:
@@ -81,6 +86,270 @@ def _into_tag(obj: Any) -> BaseTag:
     return obj
 
 
+def _palette_key(block: Block) -> Any:
+    """
+    A hashable key that is equal for equal blocks,
+    or ``None`` if the block states are not hashable.
+    """
+    try:
+        key = (block.identifier, frozenset(block.states.items()))
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+class _IntArrayList(TAG_List):
+    """
+    A ``TAG_List`` of ``TAG_Int`` that is written straight from a numpy
+    array, instead of one ``TAG_Int`` object per value.
+
+    The bytes written are the same as for
+    ``TAG_List(TAG_Int, map(TAG_Int, values))``.
+    """
+
+    def __init__(
+        self,
+        values: NDArray[Any] | None = None,
+        *,
+        fill: int = 0,
+        size: int = 0,
+        little_endian: bool = True,
+    ):
+        """
+        Parameters
+        ----------
+        values
+            The ints of the list, in order. When this is ``None``
+            the list is ``size`` times ``fill``.
+
+        fill
+            The value repeated when ``values`` is ``None``.
+
+        size
+            The length of the list when ``values`` is ``None``.
+
+        little_endian
+            Whether the list is going to be written little-endian.
+            It has to match the byte order the file is saved with.
+        """
+        super().__init__(TAG_Int)
+        dtype = np.dtype("<i4" if little_endian else ">i4")
+        self._values = (
+            None if values is None else np.ascontiguousarray(values, dtype=dtype).reshape(-1)
+        )
+        self._fill = np.full(min(size, _INT_ARRAY_CHUNK), fill, dtype=dtype)
+        self._size = size if values is None else self._values.size
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self._size!r} entries, {self.name!r})"
+
+    def write(self, write) -> None:
+        if self.name is not None:
+            write("b", 0x09)
+            self._write_utf8(write, self.name)
+        write("bi", 0x03, self._size)
+        if self._values is not None:
+            write.dst.write(memoryview(self._values).cast("B"))
+            return
+        full_chunks, rest = divmod(self._size, _INT_ARRAY_CHUNK)
+        chunk = memoryview(self._fill).cast("B")
+        for _ in range(full_chunks):
+            write.dst.write(chunk)
+        if rest:
+            write.dst.write(chunk[: rest * 4])
+
+
+_NBT_SCALARS: dict[int, struct.Struct] = {
+    0x01: struct.Struct("<b"),
+    0x02: struct.Struct("<h"),
+    0x03: struct.Struct("<i"),
+    0x04: struct.Struct("<q"),
+    0x05: struct.Struct("<f"),
+    0x06: struct.Struct("<d"),
+}
+"""Little-endian layouts of the single value tags, by tag id."""
+
+_NBT_ARRAYS: dict[int, np.dtype] = {
+    0x07: np.dtype("i1"),
+    0x0B: np.dtype("<i4"),
+    0x0C: np.dtype("<i8"),
+}
+"""Element types of the array tags, by tag id."""
+
+_NBT_LIST_DTYPES: dict[int, np.dtype] = {
+    0x01: np.dtype("i1"),
+    0x02: np.dtype("<i2"),
+    0x03: np.dtype("<i4"),
+    0x04: np.dtype("<i8"),
+    0x05: np.dtype("<f4"),
+    0x06: np.dtype("<f8"),
+}
+"""Element types of the lists of numbers read with ``np.frombuffer``."""
+
+_UINT16 = struct.Struct("<H")
+_LIST_HEADER = struct.Struct("<bi")
+
+
+class _LazyTag:
+    """
+    A tag that is only decoded when :meth:`decode` is called.
+    """
+
+    def __init__(self, buffer: Any, tag_type: int, offset: int):
+        self._buffer = buffer
+        self._tag_type = tag_type
+        self._offset = offset
+
+    def decode(self, **options: Any) -> Any:
+        """Decodes the tag, ``options`` are passed to :class:`_LittleNBTReader`."""
+        return _LittleNBTReader(self._buffer, **options).read_payload(self._tag_type, self._offset)[0]
+
+    def detach(self) -> "_LazyTag":
+        """
+        Returns the same tag over a copy of its own bytes, so it does not
+        keep the whole buffer (like a memory map) alive.
+        """
+        end = _LittleNBTReader(self._buffer).skip_payload(self._tag_type, self._offset)
+        return _LazyTag(bytes(self._buffer[self._offset : end]), self._tag_type, 0)
+
+
+class _LittleNBTReader:
+    """
+    A reader for little-endian (Bedrock) NBT, decoding tags into plain
+    python values.
+
+    Lists of numbers are returned as numpy arrays that are views of the
+    buffer (made with ``np.frombuffer``), and the values of compound keys
+    listed in ``lazy`` are returned as :class:`_LazyTag`.
+    """
+
+    def __init__(self, buffer: Any, *, lazy: frozenset[str] = frozenset(), number_lists: bool = True):
+        """
+        Parameters
+        ----------
+        buffer
+            The data, anything supporting the buffer protocol
+            (``bytes``, ``mmap.mmap``, ...).
+
+        lazy
+            Names of the compound keys whose values are not decoded.
+
+        number_lists
+            Whether lists of numbers are returned as numpy arrays,
+            instead of python lists.
+        """
+        self.buffer = buffer
+        self.lazy = lazy
+        self.number_lists = number_lists
+
+    def _string(self, offset: int) -> tuple[str, int]:
+        (length,) = _UINT16.unpack_from(self.buffer, offset)
+        offset += 2
+        return bytes(self.buffer[offset : offset + length]).decode("utf-8"), offset + length
+
+    def read_root(self, offset: int = 0) -> tuple[dict[str, Any], int]:
+        """Reads the named root compound starting at ``offset``."""
+        if self.buffer[offset] != 0x0A:
+            raise IOError("NBTFile does not begin with 0x0A.")
+        _, offset = self._string(offset + 1)
+        return self.read_payload(0x0A, offset)
+
+    def skip_payload(self, tag_type: int, offset: int) -> int:
+        """Returns the offset right after the payload starting at ``offset``."""
+        if tag_type in _NBT_SCALARS:
+            return offset + _NBT_SCALARS[tag_type].size
+        if tag_type == 0x08:
+            return offset + 2 + _UINT16.unpack_from(self.buffer, offset)[0]
+        if tag_type in _NBT_ARRAYS:
+            (length,) = _NBT_SCALARS[0x03].unpack_from(self.buffer, offset)
+            return offset + 4 + length * _NBT_ARRAYS[tag_type].itemsize
+        if tag_type == 0x09:
+            item_type, length = _LIST_HEADER.unpack_from(self.buffer, offset)
+            offset += _LIST_HEADER.size
+            if item_type in _NBT_LIST_DTYPES:
+                return offset + length * _NBT_LIST_DTYPES[item_type].itemsize
+            for _ in range(length):
+                offset = self.skip_payload(item_type, offset)
+            return offset
+        if tag_type == 0x0A:
+            while (item_type := self.buffer[offset]) != 0:
+                _, offset = self._string(offset + 1)
+                offset = self.skip_payload(item_type, offset)
+            return offset + 1
+        raise ValueError(f"unknown tag type {tag_type} at offset {offset}")
+
+    def read_payload(self, tag_type: int, offset: int) -> tuple[Any, int]:
+        """
+        Decodes the payload of a ``tag_type`` tag starting at ``offset``.
+        Returns the value, and the offset right after it.
+        """
+        if tag_type in _NBT_SCALARS:
+            layout = _NBT_SCALARS[tag_type]
+            return layout.unpack_from(self.buffer, offset)[0], offset + layout.size
+
+        if tag_type == 0x08:
+            return self._string(offset)
+
+        if tag_type in _NBT_ARRAYS:
+            (length,) = _NBT_SCALARS[0x03].unpack_from(self.buffer, offset)
+            dtype = _NBT_ARRAYS[tag_type]
+            array = np.frombuffer(self.buffer, dtype=dtype, count=length, offset=offset + 4)
+            return array, offset + 4 + length * dtype.itemsize
+
+        if tag_type == 0x09:
+            item_type, length = _LIST_HEADER.unpack_from(self.buffer, offset)
+            offset += _LIST_HEADER.size
+            if item_type in _NBT_LIST_DTYPES and self.number_lists:
+                dtype = _NBT_LIST_DTYPES[item_type]
+                array = np.frombuffer(self.buffer, dtype=dtype, count=length, offset=offset)
+                return array, offset + length * dtype.itemsize
+            items = []
+            for _ in range(length):
+                item, offset = self.read_payload(item_type, offset)
+                items.append(item)
+            return items, offset
+
+        if tag_type == 0x0A:
+            compound = {}
+            while (item_type := self.buffer[offset]) != 0:
+                name, offset = self._string(offset + 1)
+                if name in self.lazy:
+                    compound[name] = _LazyTag(self.buffer, item_type, offset)
+                    offset = self.skip_payload(item_type, offset)
+                else:
+                    compound[name], offset = self.read_payload(item_type, offset)
+            return compound, offset + 1
+
+        raise ValueError(f"unknown tag type {tag_type} at offset {offset}")
+
+
+def _decode_palette(palette: _LazyTag | None) -> list[Block]:
+    """Decodes the blocks of a lazily loaded ``palette`` compound."""
+    if palette is None:
+        return []
+    default = palette.decode(number_lists=False)["default"]
+    return [
+        Block(block["name"], **block["states"]) for block in default["block_palette"]
+    ]
+
+
+def _read_buffer(file: BinaryIO, use_mmap: bool) -> tuple[Any, int]:
+    """
+    Returns the data of ``file`` and the offset of its current position in it.
+    Real files are memory-mapped when ``use_mmap`` is set, anything else is read.
+    """
+    if use_mmap:
+        try:
+            fileno = file.fileno()
+            position = file.tell()
+            return mmap.mmap(fileno, 0, access=mmap.ACCESS_READ), position
+        except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+            # not a real file (BytesIO, ...) or an empty one
+            pass
+    return file.read(), 0
+
+
 def is_valid_structure_name(name: str, *, with_prefix: bool = False) -> bool:
     """
     Validates the structure name.
@@ -280,20 +549,28 @@ class Structure:
         self.structure: NDArray[np.intc]
 
         self._size = size
-        self._palette: list[Block] = []
+        self._palette_blocks: list[Block] = []
+        self._palette_index: dict[Any, int] = {}
+        self._palette_loader: Callable[[], list[Block]] | None = None
+        self._secondary_layer: NDArray[Any] | None = None
 
         if fill is None:
             self.structure = np.full(size, -1, dtype=np.intc)
 
         else:
             self.structure = np.zeros(size, dtype=np.intc)
-            self._palette.append(fill)
+            self._append_to_palette(fill)
 
     @classmethod
-    def load(cls, file: BinaryIO):
+    def load(cls, file: BinaryIO, *, use_mmap: bool = True):
         """
         Loads a structure from a file.
 
+        The block indices are read straight into numpy arrays, and the
+        palette is decoded the first time it is used. The second layer
+        (see :attr:`secondary_structure`) is copied while loading, like
+        the first one, so the file map can be closed right away.
+
         Examples
         --------
         .. code-block:: python
@@ -307,25 +584,69 @@ class Structure:
         ----------
         file
             File object to read.
+
+        use_mmap
+            Whether to memory-map the file instead of reading
+            it, when it is a real file. The map is only open while
+            loading, so the file can be written again right after.
         """
-        nbt = NBTFile(file, little_endian=True)
-        size: tuple[int, int, int] = tuple(x.value for x in nbt["size"])  # type: ignore
+        buffer, offset = _read_buffer(file, use_mmap)
+        struct, end = cls._from_buffer(buffer, offset)
+        if isinstance(buffer, mmap.mmap):
+            # nothing the structure keeps is a view of the map
+            buffer.close()
+            file.seek(end)
+        return struct
 
-        struct = cls(size)
+    @classmethod
+    def _from_buffer(cls, buffer: Any, offset: int) -> tuple["Structure", int]:
+        """
+        Loads a structure from the data of a file, starting at ``offset``.
+        Returns it, and the offset right after it.
+        """
+        nbt, end = _LittleNBTReader(buffer, lazy=frozenset({"palette"})).read_root(offset)
+
+        size: tuple[int, int, int] = tuple(int(x) for x in nbt["size"])  # type: ignore
+        layers = nbt["structure"]["block_indices"]
+        volume = int(np.prod(size))
+        if not layers or any(len(layer) != volume for layer in layers):
+            raise ValueError(f"block indices do not match the structure size {size}")
+
+        # the palette is set from the file, so the structure starts without one
+        struct = cls(size, None)
+        struct.structure = layers[0].astype(np.intc).reshape(size)
+        if len(layers) > 1:
+            # copied now (not when accessed): the layers are views of the buffer, which is closed after loading
+            struct._secondary_layer = layers[1].astype(np.intc)
+
+        palette = nbt["structure"]["palette"]
+        struct._palette_loader = (
+            partial(_decode_palette, palette.detach())
+            if isinstance(palette, _LazyTag)
+            else partial(_decode_palette, None)
+        )
 
-        struct.structure = np.array(
-            [_into_pyobj(x) for x in nbt["structure"]["block_indices"][0]],
-            dtype=np.intc,
-        ).reshape(size)
+        return struct, end
 
-        struct._palette.extend(
-            [
-                Block(block["name"].value, **_into_pyobj(block["states"].value))
-                for block in nbt["structure"]["palette"]["default"]["block_palette"]
-            ]
-        )
+    @property
+    def secondary_structure(self) -> NDArray[np.intc] | None:
+        """
+        The second layer of block indices of a loaded structure
+        (waterlogged blocks), with ``-1`` where it is empty.
+        ``None`` when the structure was not loaded from a file.
+        """
+        if self._secondary_layer is None:
+            return None
+        return self._secondary_layer.astype(np.intc).reshape(self._size)
 
-        return struct
+    @property
+    def _palette(self) -> list[Block]:
+        """The palette, decoded first if it was loaded lazily."""
+        if self._palette_loader is not None:
+            loader, self._palette_loader = self._palette_loader, None
+            for block in loader():
+                self._append_to_palette(block)
+        return self._palette_blocks
 
     @property
     def size(self) -> tuple[int, int, int]:
@@ -385,11 +706,31 @@ class Structure:
         if block is None:
             return -1
 
-        if block in self._palette:
-            return self._palette.index(block)
+        palette = self._palette
+        key = _palette_key(block)
+        if key is None:
+            # unhashable states, fall back to a linear search
+            if block in palette:
+                return palette.index(block)
+        elif key in self._palette_index:
+            return self._palette_index[key]
 
+        return self._append_to_palette(block)
+
+    def _append_to_palette(self, block: Block) -> int:
+        """
+        Appends a block to the palette without looking for it first,
+        and returns its position.
+
+        If an equal block is already in the palette, lookups keep
+        returning the first one (like ``list.index``).
+        """
         self._palette.append(block)
-        return len(self._palette) - 1
+        position = len(self._palette_blocks) - 1
+        key = _palette_key(block)
+        if key is not None:
+            self._palette_index.setdefault(key, position)
+        return position
 
     def get_structure(self) -> NDArray[Any]:
         """
@@ -431,12 +772,11 @@ class Structure:
                         block_indices=TAG_List(
                             TAG_List,
                             [
-                                TAG_List(
-                                    TAG_Int, map(TAG_Int, self.structure.flatten())
-                                ),
-                                TAG_List(
-                                    TAG_Int,
-                                    map(TAG_Int, repeat(-1, self.structure.size)),
+                                _IntArrayList(self.structure),
+                                (
+                                    _IntArrayList(fill=-1, size=self.structure.size)
+                                    if self._secondary_layer is None
+                                    else _IntArrayList(self._secondary_layer)
                                 ),
                             ],
                         ),
@@ -518,6 +858,66 @@ class Structure:
         self.structure[x, y, z] = ident
         return self
 
+    def set_blocks_from_array(
+        self,
+        from_coordinate: Coordinate,
+        indices: NDArray[Any],
+        blocks: list[Block | None],
+    ) -> Structure:
+        """
+        Places many blocks at once, from an array of indices into ``blocks``.
+
+        Notes
+        -----
+        New blocks are added to the palette in the order they
+        first appear in ``indices`` (C order), so the result is
+        the same as calling :meth:`set_block` for every entry.
+
+        Parameters
+        ----------
+        from_coordinate
+            Relative coordinates of the start edge.
+
+        indices
+            An integer array with the shape ``(x, y, z)`` of the region,
+            or ``(x, z)`` for a plane at the ``y`` of ``from_coordinate``.
+            Negative entries leave the block at their position untouched.
+
+        blocks
+            The block for every index. ``None`` places
+            "Structure Void" blocks.
+        """
+        indices = np.asarray(indices)
+        if indices.ndim == 2:
+            indices = indices[:, None, :]
+        elif indices.ndim != 3:
+            raise ValueError(f"indices must have 2 or 3 dimensions, got {indices.ndim}")
+
+        fx, fy, fz = from_coordinate
+        sx, sy, sz = indices.shape
+        if min(fx, fy, fz) < 0 or any(
+            f + n > size for f, n, size in zip(from_coordinate, indices.shape, self._size)
+        ):
+            raise IndexError(
+                f"region {indices.shape} at {from_coordinate} does not fit in {self._size}"
+            )
+
+        flat = indices.reshape(-1).astype(np.intp, copy=False)
+        placed = flat >= 0
+        if flat.size and flat.max() >= len(blocks):
+            raise IndexError(f"index {flat.max()} out of range for {len(blocks)} blocks")
+
+        # palette ids of the used blocks, added in order of first appearance
+        used, first_seen = np.unique(flat[placed], return_index=True)
+        idents = np.full(len(blocks), -1, dtype=np.intc)
+        for index in used[np.argsort(first_seen)]:
+            idents[index] = self._add_block_to_palette(blocks[index])
+
+        region = self.structure[fx : fx + sx, fy : fy + sy, fz : fz + sz]
+        placed = placed.reshape(indices.shape)
+        region[placed] = idents[indices[placed]]
+        return self
+
     def set_blocks(
         self,
         from_coordinate: Coordinate,
@@ -0,0 +1,201 @@
+import functools
+import hashlib
+import json
+import mmap
+import os
+import struct
+import uuid
+
+import numpy as np
+
+from src.logic.image_logic import resource_pack
+from src.path_manager.pather import resource_path
+
+# The whole block palette in one binary file: the average colours of every block (for every side and colour set),
+# the block textures, and the block state every block is placed as
+# It is memory-mapped when loaded, so starting up doesn't parse out_all_colours.json and open hundreds of pngs,
+# and all the processes that load the same bundle share the same pages.
+#
+# Layout (little endian):
+#   MAGIC (8 bytes), uint32 format version, uint32 header length
+#   header   utf-8 json: names, block states, sides, colour sets and texture files,
+#            and the offset, shape and dtype of every array
+#   arrays   every one starting on a multiple of ALIGNMENT bytes (see resource_pack.CompiledPalette)
+#              colors         (sides, colour sets, blocks, 4) uint8
+#              texture_index  (sides, blocks) int32
+#              atlas          (textures, 16, 16, 4) uint8
+#
+# The bundle used is, in order: the file in the MCIVAS_PALETTE environment variable, assets/blocks/palette.bundle
+# (where `python -m src.cli palette` writes by default), or the one of the built-in textures, compiled the
+# first time it is needed into assets/cache/palette
+
+MAGIC = b"MCIVPAL\x00"
+VERSION = 1
+ALIGNMENT = 64
+_PREFIX = struct.Struct("<8sII")
+ARRAYS = ('colors', 'texture_index', 'atlas')
+
+PALETTE_ENV = "MCIVAS_PALETTE"
+bundle_path = os.path.normpath(resource_path("./assets/blocks/palette.bundle"))
+builtin_cache_folder = os.path.normpath(resource_path("./assets/cache/palette/"))
+
+
+class PaletteBundle:
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, header_length = _PREFIX.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError(f"Not a palette bundle: {path}")
+        if version != VERSION:
+            raise ValueError(f"Palette bundle {path} is version {version}, only version {VERSION} can be read")
+        header = json.loads(self._map[_PREFIX.size:_PREFIX.size + header_length].decode("utf-8"))
+
+        self.names: list[str] = header['names']
+        self.block_states: list[str] = header['block_states']
+        self.sides: list[str] = header['sides']
+        self.color_sets: list[str] = header['color_sets']
+        self.texture_files: list[str] = header['texture_files']
+        # Hash of everything in the bundle, for the caches that depend on the palette (like the LUTs)
+        self.content_hash: str = header['hash']
+        # Read-only views of the mapped file
+        arrays = {}
+        for name in ARRAYS:
+            spec = header['arrays'][name]
+            count = int(np.prod(spec['shape']))
+            arrays[name] = np.frombuffer(
+                self._map, dtype=spec['dtype'], count=count, offset=spec['offset']
+            ).reshape(spec['shape'])
+        self.colors: np.ndarray = arrays['colors']
+        self.texture_index: np.ndarray = arrays['texture_index']
+        self.atlas: np.ndarray = arrays['atlas']
+        self._states = dict(zip(self.names, self.block_states))
+
+    def block_state(self, name: str) -> str:
+        return self._states[name]
+
+    # The blocks in the same form as out_all_colours.json used to be loaded:
+    # [(name, {side: {'file': texture file, 'color': {colour set: [r, g, b, a]}}})], in palette order
+    def blocks_data(self) -> list:
+        colors = self.colors.tolist()
+        texture_index = self.texture_index.tolist()
+        blocks = []
+        for block_index, name in enumerate(self.names):
+            block = {}
+            for side_index, side in enumerate(self.sides):
+                tile_index = texture_index[side_index][block_index]
+                if tile_index < 0:
+                    continue
+                block[side] = {
+                    'file': self.texture_files[tile_index],
+                    'color': {
+                        color_set: colors[side_index][set_index][block_index]
+                        for set_index, color_set in enumerate(self.color_sets)
+                    }
+                }
+            blocks.append((name, block))
+        return blocks
+
+    # Every texture of every block side (name + side), and the (N, 16, 16, 4) array with them
+    def block_textures(self) -> tuple[list[str], np.ndarray]:
+        sides, blocks = np.nonzero(self.texture_index >= 0)
+        keys = [self.names[block] + self.sides[side] for side, block in zip(sides.tolist(), blocks.tolist())]
+        return keys, self.atlas[self.texture_index[sides, blocks]]
+
+
+# Writes the compiled palette as a bundle (through a temporary file, so a half written bundle is never loaded)
+def write_bundle(path: str, compiled: resource_pack.CompiledPalette):
+    arrays = {
+        'colors': np.ascontiguousarray(compiled.colors, dtype=np.uint8),
+        'texture_index': np.ascontiguousarray(compiled.texture_index, dtype='<i4'),
+        'atlas': np.ascontiguousarray(compiled.atlas, dtype=np.uint8)
+    }
+    header = {
+        'names': list(compiled.names),
+        'block_states': list(compiled.block_states),
+        'sides': list(compiled.sides),
+        'color_sets': list(compiled.color_sets),
+        'texture_files': list(compiled.texture_files)
+    }
+    content = hashlib.sha256(json.dumps(header, sort_keys=True).encode("utf-8"))
+    for name in ARRAYS:
+        content.update(arrays[name].tobytes())
+    header['hash'] = content.hexdigest()[:32]
+
+    # The offsets depend on the header length, and the header holds the offsets: the
+    # offsets are computed with room for a header of this length, and grown until it fits
+    header_room = 0
+    while True:
+        offset = _aligned(_PREFIX.size + header_room)
+        header['arrays'] = {}
+        for name in ARRAYS:
+            header['arrays'][name] = {
+                'offset': offset, 'shape': list(arrays[name].shape), 'dtype': arrays[name].dtype.str
+            }
+            offset = _aligned(offset + arrays[name].nbytes)
+        header_bytes = json.dumps(header).encode("utf-8")
+        if len(header_bytes) <= header_room:
+            break
+        header_room = len(header_bytes)
+
+    folder = os.path.dirname(os.path.abspath(path))
+    os.makedirs(folder, exist_ok=True)
+    temp_path = os.path.join(folder, f".{os.path.basename(path)}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(_PREFIX.pack(MAGIC, VERSION, len(header_bytes)))
+            f.write(header_bytes)
+            for name in ARRAYS:
+                f.write(b"\0" * (header['arrays'][name]['offset'] - f.tell()))
+                f.write(arrays[name].tobytes())
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+# The bundle every conversion uses (see the top of this file), loaded once per process
+@functools.lru_cache(maxsize=None)
+def load_bundle(path: str | None = None) -> PaletteBundle:
+    return PaletteBundle(path or active_bundle_path())
+
+
+def active_bundle_path() -> str:
+    if os.environ.get(PALETTE_ENV):
+        return os.environ[PALETTE_ENV]
+    if os.path.exists(bundle_path):
+        return bundle_path
+    return builtin_bundle_path()
+
+
+# The bundle of the built-in textures, compiled if names_list.json or the textures changed since the last time
+def builtin_bundle_path() -> str:
+    key = _builtin_key()
+    path = os.path.join(builtin_cache_folder, f"builtin_{key}.bundle")
+    if not os.path.exists(path):
+        write_bundle(path, resource_pack.compile_pack())
+        # The bundles of older textures are never going to be used again
+        for name in os.listdir(builtin_cache_folder):
+            if name.startswith("builtin_") and name.endswith(".bundle") and name != os.path.basename(path):
+                try:
+                    os.remove(os.path.join(builtin_cache_folder, name))
+                except OSError:
+                    # Still mapped by another process (Windows)
+                    pass
+    return path
+
+
+def _builtin_key() -> str:
+    data = hashlib.sha256()
+    with open(resource_pack.names_list_path, "rb") as f:
+        data.update(f.read())
+    for entry in sorted(os.scandir(resource_pack.builtin_textures_folder), key=lambda e: e.name):
+        stat = entry.stat()
+        data.update(f"{entry.name}:{stat.st_size}:{stat.st_mtime_ns}\n".encode("utf-8"))
+    data.update(f"{VERSION}".encode("utf-8"))
+    return data.hexdigest()[:16]
@@ -0,0 +1,156 @@
+from typing import Callable
+
+import numpy as np
+
+from src.logic.image_logic import block_matcher
+from src.logic.image_logic.dithering import ERROR_DIFFUSION_KERNELS, ORDERED_SIZES, bayer_matrix
+
+# Dithering for the any block mode: instead of every pixel just getting its closest block, the difference between
+# the pixel and its block (the quantization error) is made up for by the blocks around it
+# Same methods as the lamp dithering (see dithering.DITHER_METHODS), with the palette of blocks instead of black and white:
+#   ordered (bayer)  every pixel is moved by the threshold of its place in the bayer matrix, scaled to the gaps between
+#                    the palette colours, and then matched like without dithering (all at once, and the same blocks
+#                    for the same pixels in every frame of a video)
+#   error diffusion  the kernels of dithering.ERROR_DIFFUSION_KERNELS, done a row at a time: the error sent along
+#                    the row is carried from pixel to pixel (every pixel is matched on its own, the matches of the same
+#                    colours are cached in rgb), the error sent to the rows below is added with numpy once the row is
+#                    done, so only a few rows of error are ever kept
+#
+# The error is spread in rgb, or in Lab (matched with the CIE76 difference there, whatever the colour comparison is)
+
+BLOCK_DITHER_SPACES = ("rgb", "lab")
+
+
+# The (H, W) index of the block of every pixel of the (H, W, 4) RGBA image
+# match matches an (..., 4) uint8 RGBA array to the palette, the same way as without dithering (used in rgb)
+def dither_match(
+        np_image: np.ndarray,
+        palette: block_matcher.BlockPalette,
+        method: str,
+        space: str,
+        match: Callable[[np.ndarray], np.ndarray]
+) -> np.ndarray:
+    if space not in BLOCK_DITHER_SPACES:
+        raise ValueError(f"Unknown dithering colour space: {space}")
+    if method not in ORDERED_SIZES and method not in ERROR_DIFFUSION_KERNELS:
+        raise ValueError(f"Unknown dithering method: {method}")
+
+    np_image = np.asarray(np_image, dtype=np.uint8)
+    alpha = np_image[:, :, 3]
+    if space == "rgb":
+        values = np_image[:, :, :3].astype(np.float64)
+        palette_values = palette.colors[:, :3].astype(np.float64)
+
+        def nearest(rows: np.ndarray, rows_alpha: np.ndarray) -> np.ndarray:
+            rgba = np.empty(rows.shape[:-1] + (4,), dtype=np.uint8)
+            rgba[..., :3] = np.clip(np.rint(rows), 0, 255)
+            rgba[..., 3] = rows_alpha
+            return match(rgba)
+
+        # The pixels are rounded before matching, so the same rounded colour always gets the same block
+        matched = {}
+
+        def nearest_pixel(value: list[float], pixel_alpha: int) -> int:
+            key = (round(value[0]), round(value[1]), round(value[2]), pixel_alpha)
+            if key not in matched:
+                matched[key] = int(match(np.array([key], dtype=np.uint8))[0])
+            return matched[key]
+    else:
+        colors, inverse = block_matcher.unique_colors(np_image)
+        values = block_matcher.rgba_to_lab(colors)[inverse, :3].reshape(np_image.shape[:2] + (3,))
+        lab_palette = block_matcher.rgba_to_lab(palette.colors)
+        palette_values = lab_palette[:, :3]
+
+        def nearest(rows: np.ndarray, rows_alpha: np.ndarray) -> np.ndarray:
+            lab = np.concatenate([rows, rows_alpha[..., None].astype(np.float64)], axis=-1)
+            return block_matcher.match_lab_colors(lab, lab_palette).reshape(rows.shape[:-1])
+
+        def nearest_pixel(value: list[float], pixel_alpha: int) -> int:
+            return int(block_matcher.match_lab_colors(np.array([value + [pixel_alpha]]), lab_palette)[0])
+
+    if method in ORDERED_SIZES:
+        return _ordered(values, alpha, palette_values, ORDERED_SIZES[method], space, nearest)
+    return _error_diffusion(values, alpha, palette_values, method, space, nearest_pixel)
+
+
+def _ordered(
+        values: np.ndarray, alpha: np.ndarray, palette_values: np.ndarray, size: int, space: str, nearest: Callable
+) -> np.ndarray:
+    matrix = bayer_matrix(size)
+    # From -0.5 to 0.5
+    thresholds = (matrix + 0.5) / matrix.size - 0.5
+    height, width = alpha.shape
+    offsets = thresholds[np.arange(height)[:, None] % size, np.arange(width)[None, :] % size]
+    spread = palette_spread(palette_values)
+    if space == "rgb":
+        # The same offset on all three channels (moves the pixel by the spread along the grey diagonal)
+        return nearest(values + (offsets * (spread / np.sqrt(3)))[:, :, None], alpha)
+    # Only the lightness moves in Lab
+    values = values.copy()
+    values[:, :, 0] += offsets * spread
+    return nearest(values, alpha)
+
+
+def _error_diffusion(
+        values: np.ndarray, alpha: np.ndarray, palette_values: np.ndarray, method: str, space: str,
+        nearest_pixel: Callable[[list[float], int], int]
+) -> np.ndarray:
+    divisor, taps = ERROR_DIFFUSION_KERNELS[method]
+    along_row = [(dx, weight / divisor) for dy, dx, weight in taps if dy == 0]
+    below = [(dy, dx, weight / divisor) for dy, dx, weight in taps if dy > 0]
+    # The rows get padded with this many columns on both sides, the error that goes past the edges is lost there
+    reach = max(abs(dx) for _, dx, _ in taps)
+    # Highest value of every channel (only the lightness is clipped in Lab)
+    limits = [255.0, 255.0, 255.0] if space == "rgb" else [100.0, np.inf, np.inf]
+    lows = [0.0, 0.0, 0.0] if space == "rgb" else [0.0, -np.inf, -np.inf]
+    palette_list = palette_values.tolist()
+
+    height, width = alpha.shape
+    # Error already spread into the current row and the ones below it
+    pending = np.zeros((max(dy for dy, _, _ in below) + 1, width + 2 * reach, 3))
+    indices = np.empty((height, width), dtype=np.intp)
+    # The (nearly) transparent pixels get no block, so they don't spread any error
+    opaque = (alpha > 10).tolist()
+    alpha_rows = alpha.tolist()
+    for y in range(height):
+        # Every other row goes the other way, so the error doesn't always lean to the same side
+        direction = -1 if y % 2 == 1 else 1
+        line = [[0.0] * 3] * reach + (values[y] + pending[0, reach:reach + width]).tolist() + [[0.0] * 3] * reach
+        row_indices = [0] * width
+        errors = [[0.0] * 3] * width
+        for x in (range(width) if direction == 1 else range(width - 1, -1, -1)):
+            i = x + reach
+            value = [min(high, max(low, channel)) for channel, low, high in zip(line[i], lows, limits)]
+            index = nearest_pixel(value, alpha_rows[y][x])
+            row_indices[x] = index
+            if not opaque[y][x]:
+                continue
+            error = [channel - block for channel, block in zip(value, palette_list[index])]
+            errors[x] = error
+            for dx, weight in along_row:
+                target = i + dx * direction
+                line[target] = [channel + e * weight for channel, e in zip(line[target], error)]
+        indices[y] = row_indices
+
+        row_errors = np.array(errors)
+        for dy, dx, weight in below:
+            start = reach + dx * direction
+            pending[dy, start:start + width] += row_errors * weight
+        pending = np.roll(pending, -1, axis=0)
+        pending[-1] = 0
+    return indices
+
+
+# The usual distance between a palette colour and its closest other colour (median, so a few
+# colours that are all alone don't count), which is how far the ordered dithering moves the pixels
+def palette_spread(palette_values: np.ndarray) -> float:
+    if palette_values.shape[0] < 2:
+        return 0.0
+    closest = np.empty(palette_values.shape[0])
+    batch = max(1, block_matcher.MAX_BATCH_ELEMENTS // palette_values.shape[0])
+    for start in range(0, palette_values.shape[0], batch):
+        chunk = palette_values[start:start + batch]
+        distances = np.sqrt(((chunk[:, None, :] - palette_values[None, :, :]) ** 2).sum(axis=-1))
+        distances[np.arange(chunk.shape[0]), np.arange(start, start + chunk.shape[0])] = np.inf
+        closest[start:start + batch] = distances.min(axis=1)
+    return float(np.median(closest))
@@ -0,0 +1,228 @@
+import json
+import logging
+import math
+import os
+import zipfile
+from multiprocessing import Pool
+from typing import NamedTuple
+
+import numpy as np
+from PIL import Image
+
+from src.logic import color_averager
+from src.logic.image_logic.block_parser import block_parser
+from src.path_manager.pather import resource_path
+
+logger = logging.getLogger(__name__)
+
+# Reads the block textures of a Minecraft resource pack (a folder or a zip, the version jars work too),
+# and computes everything a palette bundle holds (see palette_bundle)
+# Which texture goes on which side of which block comes from names_list.json, and the textures the pack
+# doesn't have are the built-in ones (all_blocks_textures). So a pack that only changes a few blocks still
+# gives the full palette, and no pack at all gives the built-in palette.
+# With add_new, the textures of the pack that names_list.json doesn't know are added as new blocks,
+# grouped by their names like _blocks_to_avg_colors.py does (acacia_log_top.png is the top of acacia_log...)
+
+names_list_path = resource_path("./assets/blocks/img_generator_code/names_list.json")
+builtin_textures_folder = resource_path("./assets/blocks/all_blocks_textures/")
+
+SIDES = ('top', 'bottom', 'side', 'front', 'back')
+# Size of the textures in the atlas (the output images use 16 pixels per block)
+TILE_SIZE = 16
+# Where the block textures are in a pack ("blocks" before 1.13)
+TEXTURE_FOLDERS = ("assets/minecraft/textures/block/", "assets/minecraft/textures/blocks/")
+
+
+class CompiledPalette(NamedTuple):
+    # Block names (the keys the whitelist / blacklist use), in palette order
+    names: list
+    # Block state every block is placed as in schematics, like "minecraft:furnace[lit=true]"
+    block_states: list
+    sides: list
+    color_sets: list
+    # File name of every texture of the atlas
+    texture_files: list
+    # (sides, colour sets, blocks, 4) uint8 average colours
+    colors: np.ndarray
+    # (sides, blocks) int32 index of the texture of every side of every block in the atlas, -1 if there is none
+    texture_index: np.ndarray
+    # (textures, TILE_SIZE, TILE_SIZE, 4) uint8
+    atlas: np.ndarray
+
+
+# The block textures of a pack: texture file name -> (path, or name in the zip, and whether it is in the zip)
+def pack_textures(pack: str) -> dict[str, tuple[str, bool]]:
+    files = {}
+    if os.path.isdir(pack):
+        for folder in TEXTURE_FOLDERS:
+            full_folder = os.path.join(pack, *folder.split("/"))
+            if os.path.isdir(full_folder):
+                for name in sorted(os.listdir(full_folder)):
+                    if name.endswith(".png"):
+                        files.setdefault(name, (os.path.join(full_folder, name), False))
+    elif zipfile.is_zipfile(pack):
+        with zipfile.ZipFile(pack) as archive:
+            entries = archive.namelist()
+        for folder in TEXTURE_FOLDERS:
+            for entry in entries:
+                # The pack can also be inside a folder of the zip
+                _, found, name = entry.partition(folder)
+                if found and name.endswith(".png") and "/" not in name:
+                    files.setdefault(name, (entry, True))
+    else:
+        raise ValueError(f"Not a resource pack folder or zip: {pack}")
+    return files
+
+
+# The (H, W, 4) RGBA pixels of a texture (a path or an open file), only the first frame of animated ones
+# None if the texture is not square (so not a block texture)
+def load_texture(source) -> np.ndarray | None:
+    with Image.open(source) as img:
+        img = img.convert("RGBA")
+    width, height = img.size
+    if height != width and height % width == 0:
+        # Animated textures are all the frames one below the other
+        img = img.crop((0, 0, width, width))
+    elif height != width:
+        return None
+    return np.asarray(img)
+
+
+# Loads and averages a chunk of textures (in a worker process)
+# Gives (file, atlas tile, {colour set: colour}) for every texture, tile None for the ones that can't be used
+def _average_chunk(
+        task: tuple[str | None, list[tuple[str, tuple[str, bool]]]]
+) -> list[tuple[str, np.ndarray | None, dict]]:
+    pack, entries = task
+    pixels = {}
+    archive = zipfile.ZipFile(pack) if any(in_zip for _, (_, in_zip) in entries) else None
+    try:
+        for file, (location, in_zip) in entries:
+            try:
+                if in_zip:
+                    with archive.open(location) as f:
+                        pixels[file] = load_texture(f)
+                else:
+                    pixels[file] = load_texture(location)
+            except (OSError, ValueError):
+                # Broken png, skipped like the textures that are not square
+                pixels[file] = None
+    finally:
+        if archive is not None:
+            archive.close()
+    by_shape = {}
+    for file, texture in pixels.items():
+        if texture is not None:
+            by_shape.setdefault(texture.shape, []).append(file)
+
+    results = {file: (file, None, {}) for file in pixels}
+    for shape, files in by_shape.items():
+        colour_sets = color_averager.all_colour_sets(np.stack([pixels[file] for file in files]))
+        for index, file in enumerate(files):
+            tile = pixels[file]
+            if shape[0] != TILE_SIZE:
+                tile = np.asarray(Image.fromarray(tile).resize((TILE_SIZE, TILE_SIZE), Image.BOX))
+            results[file] = (file, tile, {name: colour_sets[name][index] for name in colour_sets})
+    return [results[file] for file, _ in entries]
+
+
+# The blocks of the pack textures names_list.json doesn't use, {block name: {side: texture file}}
+def new_blocks(files: list[str], known_files: set[str], known_blocks: set[str]) -> dict[str, dict[str, str]]:
+    groups = {}
+    for file in sorted(files):
+        if file in known_files:
+            continue
+        stem = file[:-len(".png")]
+        block_name, side = stem, None
+        for suffix in SIDES:
+            if stem.endswith("_" + suffix):
+                block_name, side = stem[:-len(suffix) - 1], suffix
+                break
+        if block_name in known_blocks:
+            continue
+        groups.setdefault(block_name, {})[side] = file
+
+    blocks = {}
+    for block_name, textures in groups.items():
+        # The plain texture goes on every side, unless there is one for that side (the bottom is like the top)
+        base = textures.get(None) or textures.get('side') or next(iter(textures.values()))
+        sides = {side: textures.get(side, base) for side in SIDES}
+        if 'bottom' not in textures and 'top' in textures:
+            sides['bottom'] = textures['top']
+        blocks[block_name] = sides
+    return blocks
+
+
+# Everything for a palette bundle, from a resource pack (None for only the built-in textures)
+# pack_only leaves out the blocks that don't have any texture from the pack
+def compile_pack(
+        pack: str | None = None, processes: int = 1, add_new: bool = False, pack_only: bool = False
+) -> CompiledPalette:
+    with open(names_list_path, "r") as f:
+        blocks: dict = {
+            name: {side: file for side, file in sides.items() if side in SIDES}
+            for name, sides in json.load(f).items()
+        }
+
+    pack_files = pack_textures(pack) if pack is not None else {}
+    if add_new:
+        known_files = {file for sides in blocks.values() for file in sides.values()}
+        blocks.update(new_blocks(list(pack_files), known_files, set(blocks)))
+
+    # Where every texture is read from: the pack first, then the built-in ones
+    locations = {}
+    for name, sides in list(blocks.items()):
+        if pack_only and not any(file in pack_files for file in sides.values()):
+            del blocks[name]
+            continue
+        for file in sides.values():
+            if file in pack_files:
+                locations[file] = pack_files[file]
+            elif os.path.exists(os.path.join(builtin_textures_folder, file)):
+                locations[file] = (os.path.join(builtin_textures_folder, file), False)
+
+    # Every texture is only averaged once, even if many blocks or sides use it
+    entries = sorted(locations.items())
+    chunk_size = max(1, math.ceil(len(entries) / max(1, processes * 4)))
+    tasks = [(pack, entries[start:start + chunk_size]) for start in range(0, len(entries), chunk_size)]
+    if processes > 1 and len(tasks) > 1:
+        with Pool(processes=min(processes, len(tasks))) as pool:
+            chunks = pool.map(_average_chunk, tasks)
+    else:
+        chunks = [_average_chunk(task) for task in tasks]
+
+    texture_files = []
+    tiles = []
+    texture_colours = {}
+    for file, tile, colours in (result for chunk in chunks for result in chunk):
+        if tile is None:
+            logger.warning(f"Skipped texture {file}: it could not be read, or it is not square")
+            continue
+        texture_colours[file] = (len(tiles), colours)
+        texture_files.append(file)
+        tiles.append(tile)
+
+    names = [name for name, sides in blocks.items() if any(file in texture_colours for file in sides.values())]
+    color_sets = list(color_averager.COLOR_SETS)
+    colors = np.zeros((len(SIDES), len(color_sets), len(names), 4), dtype=np.uint8)
+    texture_index = np.full((len(SIDES), len(names)), -1, dtype=np.int32)
+    for block_index, name in enumerate(names):
+        for side_index, side in enumerate(SIDES):
+            file = blocks[name].get(side)
+            if file not in texture_colours:
+                continue
+            tile_index, colours = texture_colours[file]
+            texture_index[side_index, block_index] = tile_index
+            for set_index, color_set in enumerate(color_sets):
+                colors[side_index, set_index, block_index] = colours[color_set]
+
+    return CompiledPalette(
+        names,
+        [block_parser(name) for name in names],
+        list(SIDES),
+        color_sets,
+        texture_files,
+        colors,
+        texture_index,
+        np.stack(tiles) if tiles else np.zeros((0, TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8)
+    )
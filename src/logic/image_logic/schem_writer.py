@@ -0,0 +1,172 @@
+import gzip
+import os
+import struct
+from typing import BinaryIO
+
+import numpy as np
+
+# Writes Sponge (.schem, version 2) schematics straight from numpy arrays of palette indices
+# mcschematic needs one setBlock call (and a few dict operations) per block, which is most of the time
+# spent on big map arts. Here the whole BlockData is varint-encoded with numpy, and the gzipped nbt is
+# streamed into the file, a chunk at a time.
+
+# DataVersion of Java Edition 1.20.1 (same as mcschematic.Version.JE_1_20_1)
+JE_1_20_1_DATA_VERSION = 3465
+
+# How many blocks are encoded and written at a time
+WRITE_CHUNK = 2 ** 20
+
+# Nbt tag ids
+TAG_END = 0
+TAG_SHORT = 2
+TAG_INT = 3
+TAG_BYTE_ARRAY = 7
+TAG_LIST = 9
+TAG_COMPOUND = 10
+
+
+class IndexedSchematic:
+    """
+    A schematic stored as a (Y, Z, X) array of indices into a list of block states
+    (like "minecraft:stone" or "minecraft:redstone_lamp[lit=true]"), with the position
+    of its (0, 0, 0) corner.
+    It is what the image to schematic converters give back, and saves like an mcschematic.MCSchematic.
+    """
+
+    def __init__(self, block_ids: np.ndarray, palette: list[str], offset: tuple[int, int, int] = (0, 0, 0)):
+        if block_ids.ndim != 3:
+            raise ValueError(f"block_ids must be a (Y, Z, X) array, got shape {block_ids.shape}")
+        self.block_ids = block_ids
+        self.palette = palette
+        self.offset = offset
+
+    # The blocks of an image, with pixel (x, y) placed at (-x, 0, -y) when the image lies flat,
+    # or at (-x, -y, 0) when it stands up (same positions as the mcschematic based code used)
+    @classmethod
+    def from_image(cls, indices: np.ndarray, palette: list[str], vertical: bool) -> 'IndexedSchematic':
+        height, width = indices.shape
+        # Both axes go towards negative coordinates, so the image is flipped in both directions
+        flipped = indices[::-1, ::-1]
+        if vertical:
+            return cls(flipped[:, None, :], palette, (-(width - 1), -(height - 1), 0))
+        return cls(flipped[None, :, :], palette, (-(width - 1), 0, -(height - 1)))
+
+    # Same arguments as mcschematic.MCSchematic.save, the version can also be a plain DataVersion int
+    def save(self, outputFolderPath: str, schemName: str, version=JE_1_20_1_DATA_VERSION) -> str:
+        data_version = getattr(version, 'value', version)
+        path = os.path.join(outputFolderPath, schemName + ".schem") if outputFolderPath else schemName + ".schem"
+        save_schem(path, self.block_ids, self.palette, self.offset, data_version)
+        return path
+
+
+# path can also be a file opened in binary mode (like an entry of a zip archive)
+# With compact_palette, only the block states that are used end up in the palette. Without it, the palette is
+# written as it is (for schematics that have to share their palette with other ones)
+def save_schem(
+        path: str | BinaryIO,
+        block_ids: np.ndarray,
+        palette: list[str],
+        offset: tuple[int, int, int] = (0, 0, 0),
+        data_version: int = JE_1_20_1_DATA_VERSION,
+        compact_palette: bool = True
+):
+    height, length, width = block_ids.shape
+    if max(height, length, width) > 0xFFFF:
+        raise ValueError(f"Schematic too large for the .schem format: {(width, height, length)}")
+
+    block_ids = np.asarray(block_ids, dtype=np.intp).reshape(-1)
+    block_ids, palette = merge_duplicate_states(block_ids, palette)
+    if compact_palette:
+        used = np.flatnonzero(np.bincount(block_ids, minlength=len(palette)))
+        remap = np.zeros(len(palette), dtype=np.uint32)
+        remap[used] = np.arange(used.size, dtype=np.uint32)
+        ids = remap[block_ids]
+        used_palette = [palette[i] for i in used]
+    else:
+        ids = block_ids.astype(np.uint32)
+        used_palette = palette
+
+    with gzip.open(path, "wb", compresslevel=6) as f:
+        f.write(_tag_header(TAG_COMPOUND, "Schematic"))
+        f.write(_int_tag("Version", 2))
+        f.write(_int_tag("DataVersion", data_version))
+
+        f.write(_tag_header(TAG_COMPOUND, "Metadata"))
+        f.write(_int_tag("WEOffsetX", offset[0]))
+        f.write(_int_tag("WEOffsetY", offset[1]))
+        f.write(_int_tag("WEOffsetZ", offset[2]))
+        f.write(bytes([TAG_END]))
+
+        # Sizes are unsigned shorts in the sponge format
+        f.write(_tag_header(TAG_SHORT, "Height") + struct.pack(">H", height))
+        f.write(_tag_header(TAG_SHORT, "Length") + struct.pack(">H", length))
+        f.write(_tag_header(TAG_SHORT, "Width") + struct.pack(">H", width))
+
+        f.write(_int_tag("PaletteMax", len(used_palette)))
+        f.write(_tag_header(TAG_COMPOUND, "Palette"))
+        for palette_id, block_state in enumerate(used_palette):
+            f.write(_int_tag(block_state, palette_id))
+        f.write(bytes([TAG_END]))
+
+        # The byte array length has to be written before the data, so the varint lengths are counted first
+        total_bytes = sum(
+            int(varint_lengths(ids[start:start + WRITE_CHUNK]).sum()) for start in range(0, ids.size, WRITE_CHUNK)
+        )
+        f.write(_tag_header(TAG_BYTE_ARRAY, "BlockData") + struct.pack(">i", total_bytes))
+        for start in range(0, ids.size, WRITE_CHUNK):
+            f.write(encode_varints(ids[start:start + WRITE_CHUNK]).tobytes())
+
+        # No block entities
+        f.write(_tag_header(TAG_LIST, "BlockEntities") + struct.pack(">bi", TAG_COMPOUND, 0))
+        f.write(bytes([TAG_END]))
+
+
+# Different palette entries can be placed as the same block state (like structure_block and structure_block_load),
+# but every key of the Palette compound has to be unique: the equal ones are merged into the first of them,
+# and the indices are remapped (a palette without equal states is given back as it is)
+def merge_duplicate_states(block_ids: np.ndarray, palette: list[str]) -> tuple[np.ndarray, list[str]]:
+    if len(set(palette)) == len(palette):
+        return block_ids, palette
+    _, first, inverse = np.unique(np.asarray(palette, dtype=object), return_index=True, return_inverse=True)
+    # np.unique sorts the states, they are put back in the order they first appear in
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(order.size)
+    remap = rank[inverse.reshape(-1)]
+    return remap[block_ids], [palette[i] for i in first[order]]
+
+
+# Number of bytes every (positive) value takes as a varint
+def varint_lengths(values: np.ndarray) -> np.ndarray:
+    values = np.asarray(values, dtype=np.uint32)
+    lengths = np.ones(values.shape, dtype=np.int64)
+    for group in range(1, 5):
+        lengths += values >= (1 << (7 * group))
+    return lengths
+
+
+# Varint encodes every value, and concatenates them into one uint8 array
+def encode_varints(values: np.ndarray) -> np.ndarray:
+    values = np.asarray(values, dtype=np.uint32).reshape(-1)
+    if values.size == 0 or values.max() < 0x80:
+        # Every value fits in a single byte
+        return values.astype(np.uint8)
+
+    lengths = varint_lengths(values)
+    max_length = int(lengths.max())
+    groups = np.empty((values.size, max_length), dtype=np.uint8)
+    for group in range(max_length):
+        groups[:, group] = (values >> (7 * group)) & 0x7F
+        # The continue bit is set on every byte but the last one of a value
+        groups[:, group] |= np.where(group < lengths - 1, 0x80, 0).astype(np.uint8)
+    # Row major order keeps the bytes of every value together, and the values in order
+    return groups[np.arange(max_length)[None, :] < lengths[:, None]]
+
+
+def _tag_header(tag_id: int, name: str) -> bytes:
+    encoded = name.encode("utf-8")
+    return struct.pack(">bH", tag_id, len(encoded)) + encoded
+
+
+def _int_tag(name: str, value: int) -> bytes:
+    return _tag_header(TAG_INT, name) + struct.pack(">i", value)
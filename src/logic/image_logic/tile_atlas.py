@@ -0,0 +1,53 @@
+import numpy as np
+
+# Helpers to paste block textures into the output image
+# Instead of writing every 16x16 tile with its own slice assignment, all the textures are stacked into
+# one (N, 16, 16, channels) atlas, and whole groups of tiles are gathered from it at once with their index map
+
+# Roughly how many tiles are gathered at a time, so the temporary gathered array stays small
+BAND_TILES = 2 ** 14
+
+
+# Stacks the textures (all of the same size) into one contiguous array
+# With add_blank, an empty (all zero) tile is added at the end, at index len(textures)
+def build_atlas(textures: list, add_blank: bool = False) -> np.ndarray:
+    atlas = np.stack(textures)
+    if add_blank:
+        atlas = np.concatenate([atlas, np.zeros((1,) + atlas.shape[1:], dtype=atlas.dtype)])
+    return np.ascontiguousarray(atlas)
+
+
+# Fills out with the tiles of the (H, W) index map, a few columns at a time
+# out must be a contiguous (H * tile height, W * tile width, channels) array
+# Yields the x of every column of tiles when it is done, for the progress bars
+def composite_columns(atlas: np.ndarray, indices: np.ndarray, out: np.ndarray):
+    height, width = indices.shape
+    tile_height, tile_width = atlas.shape[1:3]
+    # (H, tile height, W, tile width, channels) view of the output
+    tiles_view = out.reshape(height, tile_height, width, tile_width, out.shape[-1])
+    band = max(1, BAND_TILES // max(1, height))
+    for x_start in range(0, width, band):
+        x_stop = min(width, x_start + band)
+        tiles_view[:, :, x_start:x_stop] = atlas[indices[:, x_start:x_stop]].transpose(0, 2, 1, 3, 4)
+        yield from range(x_start, x_stop)
+
+
+# Only redraws the tiles at (ys[i], xs[i]) of out, with their index in the (H, W) index map
+# Used to update the output of the previous video frame, where only a few tiles changed
+def composite_tiles(atlas: np.ndarray, indices: np.ndarray, out: np.ndarray, ys: np.ndarray, xs: np.ndarray):
+    height, width = indices.shape
+    tile_height, tile_width = atlas.shape[1:3]
+    tiles_view = out.reshape(height, tile_height, width, tile_width, out.shape[-1])
+    for start in range(0, ys.size, BAND_TILES):
+        y, x = ys[start:start + BAND_TILES], xs[start:start + BAND_TILES]
+        # (The slices in between make the indexed axes come first, matching the (n, 16, 16, channels) tiles)
+        tiles_view[y, :, x, :] = atlas[indices[y, x]]
+
+
+# Builds the rows [y_start, y_stop) of tiles of the output in one gather
+# Returns a ((y_stop - y_start) * tile height, W * tile width, channels) array
+def composite_rows(atlas: np.ndarray, indices: np.ndarray, y_start: int, y_stop: int) -> np.ndarray:
+    width = indices.shape[1]
+    tile_height, tile_width = atlas.shape[1:3]
+    gathered = atlas[indices[y_start:y_stop]].transpose(0, 2, 1, 3, 4)
+    return gathered.reshape((y_stop - y_start) * tile_height, width * tile_width, atlas.shape[-1])
@@ -38,9 +38,12 @@ def manage_img_tab(window, event, values):
                 'mode': values['-Img_Any_Options-'],
                 'side': values['-Img_Any_Side-'].lower(),
                 'dither': values['-Img_Dithering-'],
+                'dither_method': values['-Img_Dither_Method-'],
                 'alternate': values['-Img_Lamps_Alternate-'],
                 'color_set': values['-Color_Set-'],
-                'color_compare': values['-Comparison_Method-']
+                'color_compare': values['-Comparison_Method-'],
+                'block_dither': any_block_dither(values),
+                'block_dither_space': values['-Img_Any_Dither_Space-'].lower()
             }
         )
         window['-Preview_Image-'](data=preview_bytes.getvalue())
@@ -192,9 +195,12 @@ def manage_img_tab(window, event, values):
             'blocklist': values['-Img_Any_Listing_List-'],
             'mode': values['-Img_Any_Options-'],
             'dither': values['-Img_Dithering-'],
+            'dither_method': values['-Img_Dither_Method-'],
             'alternate': values['-Img_Lamps_Alternate-'],
             'color_set': values['-Color_Set-'],
-            'color_compare': values['-Comparison_Method-']
+            'color_compare': values['-Comparison_Method-'],
+            'block_dither': any_block_dither(values),
+            'block_dither_space': values['-Img_Any_Dither_Space-'].lower()
         }
 
         scale = values['-Img_Scale-']
@@ -269,6 +275,9 @@ def manage_img_tab(window, event, values):
         "-Img_Any_Listing_List-",
         "-Img_Lamps_Alternate-",
         "-Img_Dithering-",
+        "-Img_Dither_Method-",
+        "-Img_Any_Dither-",
+        "-Img_Any_Dither_Space-",
         "-Color_Set-",
         "-Comparison_Method-"
     ] and values['-Update_Preview-']:
@@ -281,9 +290,12 @@ def manage_img_tab(window, event, values):
                 'mode': values['-Img_Any_Options-'],
                 'side': values['-Img_Any_Side-'].lower(),
                 'dither': values['-Img_Dithering-'],
+                'dither_method': values['-Img_Dither_Method-'],
                 'alternate': values['-Img_Lamps_Alternate-'],
                 'color_set': values['-Color_Set-'],
-                'color_compare': values['-Comparison_Method-']
+                'color_compare': values['-Comparison_Method-'],
+                'block_dither': any_block_dither(values),
+                'block_dither_space': values['-Img_Any_Dither_Space-'].lower()
             }
         )
         window['-Preview_Image-'](data=preview_bytes.getvalue())
@@ -298,3 +310,9 @@ def update_size(window: sg.Window, scale: int, values):
         total_size = (img_info['size'][0] * scale, img_info['size'][1] * scale)
         window['-Img_Scale_Warning-'](f"Size: ({total_size[0]},{total_size[1]}) pixels\n"
                                       f"Each block is 16x16 pixels")
+
+
+# The any block dithering method of the combo, None for no dithering
+def any_block_dither(values) -> str | None:
+    method = values['-Img_Any_Dither-']
+    return None if method == "None" else method
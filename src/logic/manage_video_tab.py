@@ -151,6 +151,7 @@ def manage_vid_tab(window, event, values):
                 'quality': values['-Vid_Quality-'],
                 'frame_rate': frame_rate,
                 'dither': values['-Vid_Dithering-'],
+                'dither_method': values['-Vid_Dither_Method-'],
                 'alternate': values['-Vid_Lamps_Alternate-'],
                 'color_set': values['-Vid_Color_Set-'],
                 'color_compare': values['-Vid_Comparison_Method-']
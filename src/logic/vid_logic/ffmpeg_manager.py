@@ -1,62 +1,175 @@
-import math
 import os
 import subprocess
-from src.path_manager.pather import resource_path
+from src.logic.vid_logic import video_metadata
 import ffmpeg
 
-assets_path = resource_path(f"./assets/cache/")
 
-# The cache folders
-vid_cache_folder_jpg = os.path.normpath(os.path.join(assets_path, "./img_cache_jpg/"))
-vid_cache_folder_png = os.path.normpath(os.path.join(assets_path, "./img_cache_png/"))
-vid_cache_folder_m4a = os.path.normpath(os.path.join(assets_path, "./audio_cache/"))
+# The exact number of frames extracted at this frame rate (the frames go through the fps filter)
+def get_frame_count(vid_path: str, frame_rate: float) -> int:
+    return video_metadata.output_frame_count(video_metadata.probe_video(vid_path), frame_rate)
 
-vid_processed_folder = os.path.normpath(os.path.join(assets_path, "./img_process_cache./"))
 
+def get_resolution(vid_path: str) -> tuple[int, int]:
+    metadata = video_metadata.probe_video(vid_path)
+    return metadata.width, metadata.height
 
-# Runs ffmpeg in a subprocess
-def ffmpeg_runner(options: str):
-    full_command = 'ffmpeg -y ' + options
-    output = subprocess.call(full_command, shell=True)
-    return output
 
+# The video stream of the file, resampled to the frame rate
+# With a seek time, the decode starts at that keyframe (it must run with -copyts, like every decode here,
+# so the frames keep the timestamps of the file and land on the same ticks as in a full decode)
+def _video_frames(vid_path: str, frame_rate: float, seek_time=None):
+    stream_index = video_metadata.probe_video(vid_path).stream_index
+    if seek_time is None:
+        video = ffmpeg.input(vid_path)
+    else:
+        # A millisecond later, so the rounding of the keyframe time never makes it seek to the keyframe before
+        video = ffmpeg.input(vid_path, ss=f"{float(seek_time) + 0.001:.6f}", noaccurate_seek=None)
+    return video[str(stream_index)].filter('fps', fps=frame_rate)
 
-# Does not give the exact frame count
-def get_frame_count(vid_path: str, frame_rate: float) -> int:
-    data = ffmpeg.probe(vid_path)
-    total_time = data['format']['duration']
-    time_in_seconds = float(total_time)
-    number_of_frames = time_in_seconds * frame_rate
-    return math.ceil(number_of_frames)
 
+# Only the frames of the segment (all of them without one), and the output options that stop after its last frame
+def _segment_frames(vid_path: str, frame_rate: float, segment: video_metadata.DecodeSegment | None):
+    if segment is None:
+        return _video_frames(vid_path, frame_rate), {}
+    # After the fps filter, the timestamps are in ticks of 1/frame_rate
+    frames = _video_frames(vid_path, frame_rate, segment.seek_time).trim(start_pts=segment.first_tick)
+    output_args = {}
+    if segment.frame_count is not None:
+        output_args['vframes'] = segment.frame_count
+    return frames, output_args
 
-def get_resolution(vid_path: str) -> tuple[int, int]:
-    data = ffmpeg.probe(vid_path)
-    dimensions = data['streams'][0]['width'], data['streams'][0]['height']
-    return dimensions
 
+# Converts a video to sequence of images (file1.png, file2.png...) in the background, and writes its progress
+# into stdout, so the frames can be picked up while ffmpeg is still extracting them (see extracted_frames)
+# With a segment, only extracts the frames of that segment, numbered like in the whole video
+def start_vid_to_img(
+        vid_path: str,
+        frame_rate: int,
+        frames_folder: str,
+        extension: str,
+        segment: video_metadata.DecodeSegment | None = None
+) -> subprocess.Popen:
+    frames, output_args = _segment_frames(vid_path, frame_rate, segment)
+    if segment is not None:
+        output_args['start_number'] = segment.start_number
+    return (
+        frames
+        .output(os.path.join(frames_folder, "file%01d." + extension), **output_args)
+        .global_args('-hide_banner', '-loglevel', 'error', '-nostats', '-progress', 'pipe:1', '-copyts')
+        .overwrite_output()
+        .run_async(pipe_stdout=True)
+    )
 
-# Converts a video to sequence of images
-def vid_to_img(vid_path: str, frame_rate: int, cache_folder: str):
-    if cache_folder == vid_cache_folder_jpg:
-        extension = "jpg"
-    else:
-        extension = "png"
-    return ffmpeg_runner(f'-i "{vid_path}" -r {frame_rate} "{os.path.join(cache_folder,"file%01d."+extension)}"')
 
+# Yields the number and path of every frame written by start_vid_to_img, as soon as the file is complete
+# ffmpeg reports how many frames it encoded, and writes the files in order,
+# so a frame is complete once it has been reported and the next file exists (or ffmpeg is done)
+# For a segment, the frames go from start_number to start_number + frame_count - 1
+# (the file after its last frame belongs to the next segment, so that one waits for ffmpeg to be done)
+def extracted_frames(
+        extractor: subprocess.Popen,
+        frames_folder: str,
+        extension: str,
+        start_number: int = 1,
+        frame_count: int | None = None
+):
+    stop = None if frame_count is None else start_number + frame_count
 
-# Vid to images: Unused
-def vid_to_img_single(vid_path: str, frame_rate: int, cache_folder: str):
-    if cache_folder == vid_cache_folder_jpg:
-        extension = "jpg"
-    else:
-        extension = "png"
-    number_of_frames = get_frame_count(vid_path, frame_rate)
-    for frame_number in range(number_of_frames):
-        frame_time = frame_number * 1 / frame_rate
-        ffmpeg_runner(f'-ss {frame_time} -i "{vid_path}" '
-                      f'-vframes 1 {os.path.join(cache_folder,"file"+str(frame_number)+"."+extension)}')
+    def frame_path(number: int) -> str:
+        return os.path.join(frames_folder, f"file{number}.{extension}")
+
+    def in_segment(number: int) -> bool:
+        return stop is None or number < stop
+
+    next_frame = start_number
+    for line in extractor.stdout:
+        key, _, value = line.decode().strip().partition("=")
+        if key != "frame":
+            continue
+        reported = start_number - 1 + int(value)
+        while next_frame <= reported and in_segment(next_frame + 1) and os.path.exists(frame_path(next_frame + 1)):
+            yield next_frame, frame_path(next_frame)
+            next_frame += 1
+
+    extractor.stdout.close()
+    extractor.wait()
+    while in_segment(next_frame) and os.path.exists(frame_path(next_frame)):
+        yield next_frame, frame_path(next_frame)
+        next_frame += 1
+
+
+def has_audio(vid_path: str) -> bool:
+    return video_metadata.probe_video(vid_path).has_audio
+
+
+# Pipe mode: instead of writing every frame into the cache folders, ffmpeg decodes the frames
+# straight into its stdout as raw rgba bytes, width * height * 4 bytes per frame
+# With a segment, only reads the frames of that segment
+def open_frame_reader(
+        vid_path: str, frame_rate: int, segment: video_metadata.DecodeSegment | None = None
+) -> subprocess.Popen:
+    frames, output_args = _segment_frames(vid_path, frame_rate, segment)
+    return (
+        frames
+        .output('pipe:', format='rawvideo', pix_fmt='rgba', **output_args)
+        .global_args('-hide_banner', '-loglevel', 'error', '-copyts')
+        .run_async(pipe_stdout=True)
+    )
+
+
+# Yields the raw bytes of every frame the reader outputs
+# Raises once the frames run out if ffmpeg failed, so a decode that died half way isn't taken for the end of the video
+def read_frames(reader: subprocess.Popen, width: int, height: int):
+    frame_size = width * height * 4
+    while True:
+        frame = reader.stdout.read(frame_size)
+        if len(frame) < frame_size:
+            break
+        yield frame
+    reader.stdout.close()
+    reader.wait()
+    if reader.returncode != 0:
+        raise RuntimeError(f"Decoding the frames failed (ffmpeg exited with {reader.returncode})")
+
+
+# The frame count is exact (see video_metadata.output_frame_count), so fewer frames means the decode stopped early
+def check_frames_read(frames_read: int, frame_count: int):
+    if frames_read < frame_count:
+        raise RuntimeError(f"ffmpeg only decoded {frames_read} of the {frame_count} frames")
+
+
+# The other end: an ffmpeg that encodes raw rgba frames written into its stdin
+# The audio is taken straight from the source video (if it has any)
+def open_frame_writer(
+        output: str, frame_rate: int, width: int, height: int, audio_source: str | None = None
+) -> subprocess.Popen:
+    video = ffmpeg.input('pipe:', format='rawvideo', pix_fmt='rgba', s=f'{width}x{height}', r=frame_rate)
+    streams = [video]
+    if audio_source is not None:
+        streams.append(ffmpeg.input(audio_source).audio)
+    return (
+        ffmpeg
+        .output(*streams, output, crf=20, pix_fmt='yuv420p')
+        .global_args('-hide_banner', '-loglevel', 'error')
+        .overwrite_output()
+        .run_async(pipe_stdin=True)
+    )
 
 
-def vid_to_audio(vid_path: str):
-    ffmpeg_runner(f'-i "{vid_path}" -q:a 0 -map a "{os.path.join(vid_cache_folder_m4a,"audio.m4a")}"')
+# Joins the videos (encoded with the same settings by open_frame_writer) into the output, without re-encoding them
+# The audio is taken from the source video (if it has any), same as in open_frame_writer
+def concat_chunks(chunk_paths: list[str], list_path: str, output: str, audio_source: str | None = None):
+    with open(list_path, "w", encoding="utf-8") as f:
+        for path in chunk_paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    streams = [ffmpeg.input(list_path, format='concat', safe=0).video]
+    if audio_source is not None:
+        streams.append(ffmpeg.input(audio_source).audio)
+    (
+        ffmpeg
+        .output(*streams, output, vcodec='copy')
+        .global_args('-hide_banner', '-loglevel', 'error')
+        .overwrite_output()
+        .run()
+    )
@@ -0,0 +1,42 @@
+import hashlib
+
+import numpy as np
+
+# Finds the video frames that don't need to be rendered again, because (once shrunk down to one
+# pixel per block) they are the same as the last rendered frame
+# Static scenes and title cards give long runs of these
+
+
+def frame_digest(pixels: np.ndarray) -> bytes:
+    return hashlib.blake2b(np.ascontiguousarray(pixels).tobytes(), digest_size=16).digest()
+
+
+class DuplicateFrameDetector:
+    # threshold: with 0 only exact duplicates are found, otherwise frames whose mean absolute difference
+    # with the last rendered frame (0 to 255, over every channel of every pixel) is at most threshold
+    def __init__(self, threshold: float = 0):
+        self.threshold = threshold
+        self.last_digest: bytes | None = None
+        self.last_pixels: np.ndarray | None = None
+
+    # Only the hash of the frame is kept, for a frame that was rendered somewhere else
+    # (Near duplicates are always compared with a frame rendered here, so the small differences don't add up)
+    def remember_exact(self, pixels: np.ndarray):
+        self.last_digest = frame_digest(pixels)
+        self.last_pixels = None
+
+    # True if the frame can reuse the last rendered output, otherwise the frame becomes the last rendered one
+    def is_duplicate(self, pixels: np.ndarray) -> bool:
+        digest = frame_digest(pixels)
+        if digest == self.last_digest:
+            return True
+        if (
+            self.threshold
+            and self.last_pixels is not None
+            and self.last_pixels.shape == pixels.shape
+            and np.abs(pixels.astype(np.int16) - self.last_pixels).mean() <= self.threshold
+        ):
+            return True
+        self.last_digest = digest
+        self.last_pixels = pixels
+        return False
@@ -0,0 +1,104 @@
+import json
+import zipfile
+
+import numpy as np
+
+from src.logic.image_logic import schem_writer
+
+# Packs the schematic of every frame of a video into one zip archive
+# All the frames share one palette, and only a few of them (the keyframes) hold every block:
+# the other frames only hold the blocks that changed since the frame before, every other block being a structure void.
+# Every frame is still a normal Sponge schematic, so playing the animation is pasting the keyframe,
+# and then every frame after it without the structure voids (WorldEdit: //paste -m !minecraft:structure_void)
+#
+# The archive holds:
+#   animation.json           frame rate, size, palette, and which frames are keyframes
+#   frames/000001.schem ...  the frames, numbered from 1
+
+ARCHIVE_FORMAT = "mcivasmaker-schematic-animation"
+ARCHIVE_VERSION = 1
+
+# The blocks that did not change since the previous frame (always index 0 of the palette)
+VOID_BLOCK = "minecraft:structure_void"
+
+# A full frame every this many seconds, so the animation can be started from (or jump to) a few points
+KEYFRAME_SECONDS = 10
+
+
+class SchematicAnimationWriter:
+    def __init__(self, path: str, frame_rate: float, keyframe_seconds: float = KEYFRAME_SECONDS):
+        self.archive = zipfile.ZipFile(path, "w", zipfile.ZIP_STORED)
+        self.frame_rate = frame_rate
+        self.keyframe_interval = max(1, round(keyframe_seconds * frame_rate))
+        # Only ever grows, so the palette of every frame is the start of the palette of the frames after it
+        self.palette = [VOID_BLOCK]
+        self.palette_index = {VOID_BLOCK: 0}
+        self.previous: np.ndarray | None = None
+        self.offset = (0, 0, 0)
+        self.frame_count = 0
+        self.keyframes = []
+        # Number of blocks written in every frame
+        self.changed_blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _palette_id(self, block: str) -> int:
+        if block not in self.palette_index:
+            self.palette_index[block] = len(self.palette)
+            self.palette.append(block)
+        return self.palette_index[block]
+
+    # The frames must be added in order, and all have the same size and offset
+    def add_frame(self, schem: schem_writer.IndexedSchematic):
+        # Only the blocks the frame uses go into the shared palette (in the order they first appear in the video)
+        used = np.unique(schem.block_ids)
+        remap = np.zeros(len(schem.palette), dtype=np.uint32)
+        remap[used] = [self._palette_id(schem.palette[index]) for index in used]
+        ids = remap[schem.block_ids]
+        if self.previous is None:
+            self.offset = schem.offset
+        elif ids.shape != self.previous.shape:
+            raise ValueError(f"Frame of shape {ids.shape}, the animation is {self.previous.shape}")
+
+        if self.frame_count % self.keyframe_interval == 0:
+            self.keyframes.append(self.frame_count + 1)
+            data = ids
+            changed = ids.size
+        else:
+            changed_mask = ids != self.previous
+            data = np.where(changed_mask, ids, 0)
+            changed = int(np.count_nonzero(changed_mask))
+        self.frame_count += 1
+        self.changed_blocks.append(changed)
+
+        with self.archive.open(frame_name(self.frame_count), "w") as f:
+            schem_writer.save_schem(f, data, self.palette, self.offset, compact_palette=False)
+        self.previous = ids
+
+    def close(self):
+        if self.archive.fp is None:
+            return
+        height, length, width = self.previous.shape if self.previous is not None else (0, 0, 0)
+        info = {
+            'format': ARCHIVE_FORMAT,
+            'version': ARCHIVE_VERSION,
+            'frame_rate': self.frame_rate,
+            'frame_count': self.frame_count,
+            # Width (x), height (y) and length (z), like in the schematics
+            'size': [width, height, length],
+            'offset': list(self.offset),
+            'palette': self.palette,
+            'void_block': VOID_BLOCK,
+            'keyframes': self.keyframes,
+            'changed_blocks': self.changed_blocks
+        }
+        self.archive.writestr("animation.json", json.dumps(info, indent=2))
+        self.archive.close()
+
+
+def frame_name(number: int) -> str:
+    return f"frames/{number:06d}.schem"
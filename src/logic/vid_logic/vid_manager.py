@@ -1,45 +1,76 @@
 import os
-import time
-from multiprocessing.pool import ThreadPool, Pool
-from multiprocessing import Queue, Manager
+from collections import deque
 from typing import Union, Callable, Optional, Any, Tuple
 import queue
+import threading
+
+import numpy as np
+from PIL import Image
 
 import src.ui_manager.PySimpleGUI as sg
 
-from src.logic.image_logic.image_manager import manipulate_image
-from src.logic.vid_logic import ffmpeg_manager
-from src.path_manager.pather import resource_path
+from src.logic.image_logic.delta_renderer import DeltaRenderer
+from src.logic.image_logic import schem_writer
+from src.logic.image_logic.image_manager import manipulate_image, render_schematic, render_tiles, scale_to_tiles
+from src.logic.vid_logic import ffmpeg_manager, frame_dedupe, schem_animation, video_job, video_metadata, worker_pool
 import logging
 
 logger = logging.getLogger(__name__)
 
-assets_path = resource_path(f"./assets/cache/")
+THREAD_KEY = '-Vid_Thread-'
 
-# The cache folders
-vid_cache_folder_jpg = os.path.normpath(os.path.join(assets_path, "./img_cache_jpg/"))
-vid_cache_folder_png = os.path.normpath(os.path.join(assets_path, "./img_cache_png/"))
-vid_cache_folder_m4a = os.path.normpath(os.path.join(assets_path, "./audio_cache/"))
+ProgressEvent = Tuple[str, Any]
+ProgressCallback = Optional[Callable[[ProgressEvent], None]]
 
-vid_processed_folder = os.path.normpath(os.path.join(assets_path, "./img_process_cache/"))
+# The manipulations that output a video, these can run in pipe mode
+PIPE_MANIPULATIONS = ("Image To Any Block Image", "Image To Redstone Lamps Image")
 
-# Create the paths if they don't exist (Git does not recognize empty folders)
-if not os.path.exists(vid_cache_folder_jpg):
-    os.makedirs(vid_cache_folder_jpg)
+# The manipulations that output a schematic for every frame, these are packed into one animation archive
+SCHEMATIC_MANIPULATIONS = ("Image To Any Block Schematic", "Image To Redstone Lamps Schematic")
 
-if not os.path.exists(vid_cache_folder_png):
-    os.makedirs(vid_cache_folder_png)
+# In delta mode (or when skipping duplicate frames), every worker renders this many consecutive frames
+# at a time, so each frame can reuse the work done for the previous one
+DELTA_CHUNK_FRAMES = 8
 
-if not os.path.exists(vid_cache_folder_m4a):
-    os.makedirs(vid_cache_folder_m4a)
+# When the number of decode segments is automatic: one segment per this many seconds of video, up to MAX_AUTO_SEGMENTS
+# (Every segment is another ffmpeg decoding next to the workers, so more than a few just slows them down)
+SECONDS_PER_SEGMENT = 120
+MAX_AUTO_SEGMENTS = 4
 
-if not os.path.exists(vid_processed_folder):
-    os.makedirs(vid_processed_folder)
+# Default in-flight limit of the cache folder mode: at most this many frames are on disk at a time
+# (extracted, being converted, or converted and waiting for the frames before them to be encoded)
+DISK_IN_FLIGHT_FRAMES = 240
 
-THREAD_KEY = '-Vid_Thread-'
 
-ProgressEvent = Tuple[str, Any]
-ProgressCallback = Optional[Callable[[ProgressEvent], None]]
+# Counts the frames between the first stage of a video conversion and the last one
+# A stage takes frames into the limit before it produces them, and the last stage gives them back once they are out,
+# so there are never more than the limit in flight, however long the video is
+class FrameBudget:
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self.used = 0
+        self.condition = threading.Condition()
+
+    # Waits until the frames fit (any amount fits when nothing is in flight, so a window can be larger than the limit)
+    # Gives False instead when stop is set
+    def acquire(self, count: int, stop: threading.Event) -> bool:
+        with self.condition:
+            while self.used and self.used + count > self.limit:
+                if stop.is_set():
+                    return False
+                self.condition.wait(0.2)
+            self.used += count
+            return True
+
+    def release(self, count: int = 1):
+        with self.condition:
+            self.used -= count
+            self.condition.notify_all()
+
+
+# details['max_in_flight'] (0 or missing means the default of the mode)
+def in_flight_limit(details: dict, default: int) -> int:
+    return details.get('max_in_flight') or default
 
 
 def vid_manager(
@@ -60,9 +91,40 @@ def vid_manager(
         elif window is not None:
             window.write_event_value((THREAD_KEY, ev), payload)
 
-    # Cleaning cache folders, incase a previous run failed to do so
-    cleanup_folders()
-    logger.info("Cleaned Previous Cache")
+    if manipulation.replace("Video", "Image") in SCHEMATIC_MANIPULATIONS:
+        logger.info("Exporting the video as a schematic animation")
+        vid_manager_schematic(emit, filepath, output, manipulation, scale, details)
+        return
+
+    # Frames go through pipes from ffmpeg, to the workers, and into the encoder. No cache folders needed
+    if details.get('frame_pipe', True) and manipulation.replace("Video", "Image") in PIPE_MANIPULATIONS:
+        logger.info("Running the video in pipe mode")
+        vid_manager_pipe(emit, filepath, output, manipulation, scale, details)
+        return
+
+    vid_manager_frames(emit, window, filepath, output, manipulation, scale, details)
+
+
+# Cache folder mode: the frames go through image files, written by ffmpeg and converted by manage_single_image
+# It runs as three stages at the same time, joined by bounded queues:
+#   extraction  ffmpeg writes the frames of the video, a window of frames at a time (keyframe aligned, see plan_segments)
+#   conversion  every extracted frame goes to the workers as soon as it is written
+#   encoding    the converted frames are encoded in order as soon as they are ready (see video_job.CheckpointedEncoder)
+# A window is only extracted once its frames fit in the in-flight limit, and a frame only leaves the limit
+# once it is encoded and its files are removed, so the job folder stays the same size for any video length
+def vid_manager_frames(
+    emit: Callable[[str, Any], None],
+    window: Union[sg.Window, None],
+    filepath: str,
+    output: str,
+    manipulation: str,
+    scale: Union[str, float, int],
+    details: dict
+):
+    # Everything before the final video goes into the folder of this job
+    # (When resuming, the parts of the output a previous run already encoded are kept)
+    job = video_job.VideoJob.open(filepath, manipulation, scale, details, details.get('resume', False))
+    logger.info(f"Job folder: {job.folder}")
     logger.debug("Video Details:")
     logger.debug(f"FilePath: {filepath}")
     logger.debug(f"Output Path: {output}")
@@ -70,190 +132,427 @@ def vid_manager(
     logger.debug(f"Scale: {scale}")
     logger.debug(f"Details: {details}")
 
-    # Instantiating the process/thread related objects
     process_count = details['process_count']
-    process_pool = Pool(processes=process_count)
-    ff_pool = ThreadPool(processes=2)
-    manager = Manager()
-    event_queue = manager.Queue()
-
-    frame_count = ffmpeg_manager.get_frame_count(filepath, details['frame_rate'])
-    # Close enough frame count
+    frame_rate = details['frame_rate']
+    frame_count = ffmpeg_manager.get_frame_count(filepath, frame_rate)
+    # Exact frame count, the frames are resampled by the fps filter
     emit('-Image_Count-', frame_count)
+    audio_source = filepath if ffmpeg_manager.has_audio(filepath) else None
 
-    # Selecting the correct cache folder
-    cache_folder = vid_cache_folder_png if details['quality'] else vid_cache_folder_jpg
-
-    # Running the encoder?(In another thread)
-    ff_pool.apply_async(
-        ffmpeg_manager.vid_to_img,
-        (filepath, details['frame_rate'], cache_folder),
-        callback=(lambda x: print(f"[ffmpeg extract] exit={x}")) if (progress_cb and window is None) else None
-    )
-    ff_pool.apply_async(ffmpeg_manager.vid_to_audio, (filepath,))
-    ff_pool.close()
-
-    # Starting the image conversion, till at least 95% the images are there
-    current_image = 0
-    image_processes = []
-    img_count = 0
-    while True:
-        # Checking the number of files that have been outputted by ffmpeg
-        files = os.listdir(cache_folder)
-        file_count = len(files)
-        if file_count >= (frame_count * 0.95):
-            break
-        # Updating the progress meter (0..1 for extract phase)
-        emit('-Img_Conversion-', file_count / frame_count)
-
-        # Start processing images while ffmpeg is generating them
-        if file_count > current_image:
-            img_file_path = os.path.join(cache_folder, files[current_image])
-            # Remove the first 4 and last 4 characters, to get just the number
-            file_number = os.path.split(img_file_path)[1][4:-4]
-            processed_path = os.path.join(vid_processed_folder, file_number + ".png")
-            image_processes.append(process_pool.apply_async(
-                manage_single_image,
-                (event_queue, img_file_path, processed_path, manipulation, scale, details)
-            ))
-            current_image += 1
-
-        # Item count checking frequency
-        time.sleep(0.1)
-    ff_pool.join()
-    logger.info("Converted Video to images")
+    def processed_path(number: int) -> str:
+        return os.path.join(job.processed_folder, f"{number}.png")
 
-    # Flush completed early processes
-    for process in image_processes:
-        process.wait()
+    start_number = job.resume_point(frame_count)
+    if start_number > 1:
+        logger.info(f"Resuming, {start_number - 1} frames already converted")
+    for _ in range(1, min(start_number, frame_count + 1)):
         emit('-Image_Done-', None)
-        img_count += 1
-
-    # Update images done
-    emit('-Set_Images_Done-', img_count)
-
-    # Extract done
-    emit('-Img_Conversion-', 1)
-    logger.debug("Completed partial processing")
-
-    # Getting the correct item count and finding which files we have to process now
-    files = os.listdir(cache_folder)
-    file_count = len(files)
-    completed_files = os.listdir(vid_processed_folder)
-    for completed_file in completed_files:
-        file_no = completed_file.replace(".png", "")
-        name_of_file = "file" + file_no + (".jpg" if cache_folder == vid_cache_folder_jpg else ".png")
-        if name_of_file in files:
-            files.remove(name_of_file)
-
-    emit('-Image_Count-', file_count)
-
-    # Processing the rest of the images
-    for unprocessed_file in files:
-        img_file_path = os.path.join(cache_folder, unprocessed_file)
-        file_number = os.path.split(img_file_path)[1][4:-4]
-        processed_path = os.path.join(vid_processed_folder, file_number + ".png")
-        image_processes.append(process_pool.apply_async(
-            manage_single_image,
-            (event_queue, img_file_path, processed_path, manipulation, scale, details)
+
+    # Png or jpg frames
+    extension = "png" if details['quality'] else "jpg"
+
+    budget = FrameBudget(in_flight_limit(details, DISK_IN_FLIGHT_FRAMES))
+    stop = threading.Event()
+    # Extraction -> conversion: (number, path) of every extracted frame, an exception, or None once a decoder is done
+    extracted = queue.Queue(maxsize=budget.limit)
+    # Conversion -> encoding: number of every converted frame, an exception,
+    # or None once every frame is sent to the workers (there are dispatched[0] of them)
+    rendered = queue.Queue(maxsize=budget.limit + 1)
+    dispatched = [0]
+    extractors = []
+    windows = iter(())
+    decoder_count = 0
+    if start_number <= frame_count:
+        # A few decoders work at the same time on long videos, each one on the next window that is not taken
+        # The windows are small enough for all the decoders to be busy without going over the limit
+        decoder_count = decode_segment_count(filepath, details)
+        window_frames = max(1, budget.limit // (decoder_count + 1))
+        windows = iter(video_metadata.plan_segments(
+            filepath, frame_rate, -(-(frame_count - start_number + 1) // window_frames), start_number
         ))
-        current_image += 1
+        logger.info(f"Decoding the video with {decoder_count} decoder(s), {window_frames} frames at a time")
+    windows_lock = threading.Lock()
 
-    process_pool.close()
-    iter_count = 0
-    while True:
+    def extract_windows():
         try:
-            data = event_queue.get(timeout=0.2)  # 不阻塞太久，0.2s 轮询
-            if data[0] == "-Single_Frame-":
-                if window is not None:
-                    window['-Single_Frame-'](data[1])
-                emit('-Single_Frame-', data[1])
-            elif data[0] == "-Image_Done-":
-                # 可选：这里其实我们上面已经在 wait 后 emit 过一次，
-                # 如果你希望更顺滑，也可以在这里对 CLI 做一次进度+1
-                emit('-Image_Done-', None)
-        except queue.Empty:
-            pass
-
-        if all(proc.ready() for proc in image_processes):
-            break
-
-        iter_count += 1
-        if window is not None and iter_count % 10 == 0:
-            processed_file_count = len(os.listdir(vid_processed_folder))
-            progress = processed_file_count / file_count * 100
-            window['-Number_Of_Frames-'](progress)
-            window['-Number_Of_Frames_Text-'](f"{processed_file_count}/{file_count}")
-
-        if any([not proc.successful() for proc in image_processes if proc.ready()]):
-            logger.error("ERROR!")
-            proc_list = [not proc.successful() for proc in image_processes if proc.ready()]
-            indices = [i for i, x in enumerate(proc_list) if x]
-            for index in indices:
-                logger.error(image_processes[index].get())
-
-    process_pool.join()
-
-    # If the processing was very fast, make sure we emit remaining done events
-    # GUI: just set the single-frame meter to 100
-    if window is not None:
-        window
-    # Emit missing '-Image_Done-' to match frame_count
-    for _ in range(img_count, frame_count):
-        emit('-Image_Done-', None)
+            while not stop.is_set():
+                # The windows are taken and put in the limit in order, so the frame the encoder waits for
+                # is always in a window that is being extracted
+                with windows_lock:
+                    segment = next(windows, None)
+                    if segment is None:
+                        return
+                    size = segment.frame_count or frame_count - segment.start_number + 1
+                    if not budget.acquire(size, stop):
+                        return
+                    extractor = ffmpeg_manager.start_vid_to_img(
+                        filepath, frame_rate, job.frames_folder, extension, segment
+                    )
+                    extractors.append(extractor)
+                frames = ffmpeg_manager.extracted_frames(
+                    extractor, job.frames_folder, extension, segment.start_number, segment.frame_count
+                )
+                for frame in frames:
+                    extracted.put(frame)
+                if extractor.returncode != 0 and not stop.is_set():
+                    raise RuntimeError(f"Extracting the frames failed (ffmpeg exited with {extractor.returncode})")
+        except BaseException as error:
+            extracted.put(error)
+        finally:
+            extracted.put(None)
+
+    # The frame is converted, the extracted one is not needed anymore
+    def frame_converted(number: int, img_file_path: str):
+        os.remove(img_file_path)
+        rendered.put(number)
+
+    def convert_frames():
+        process_pool, _ = worker_pool.get_pool(process_count)
+        running = decoder_count
+        file_count = start_number - 1
+        while running:
+            item = extracted.get()
+            if item is None:
+                running -= 1
+                continue
+            if isinstance(item, BaseException):
+                rendered.put(item)
+                continue
+            file_number, img_file_path = item
+            process_pool.apply_async(
+                manage_single_image,
+                (img_file_path, processed_path(file_number), manipulation, scale, details),
+                callback=lambda _, number=file_number, path=img_file_path: frame_converted(number, path),
+                error_callback=rendered.put
+            )
+            file_count += 1
+            dispatched[0] += 1
+            # Updating the progress meter (0..1 for extract phase)
+            emit('-Img_Conversion-', min(1, file_count / max(1, frame_count)))
+        logger.info("Converted Video to images")
+        emit('-Img_Conversion-', 1)
+        rendered.put(None)
+
+    # Started here, so the workers import everything before the first frame is there
+    _, event_queue = worker_pool.get_pool(process_count)
+    threads = [threading.Thread(target=extract_windows, daemon=True) for _ in range(decoder_count)]
+    threads.append(threading.Thread(target=convert_frames, daemon=True))
+    for thread in threads:
+        thread.start()
+
+    encoder = video_job.CheckpointedEncoder(job, frame_rate, start_number)
+    # Converted frames waiting for the ones before them
+    ready = set()
+    converted = 0
+    all_sent = start_number > frame_count
+    iter_count = 0
+    try:
+        while not all_sent or converted < dispatched[0]:
+            # Progress of the frames the workers are on (the frames are done once encoded, not here)
+            while not event_queue.empty():
+                data = event_queue.get_nowait()
+                if data[0] == "-Single_Frame-":
+                    if window is not None:
+                        window['-Single_Frame-'](data[1])
+                    emit('-Single_Frame-', data[1])
+
+            try:
+                item = rendered.get(timeout=0.2)  # 不阻塞太久，0.2s 轮询
+                if isinstance(item, BaseException):
+                    raise item
+                if item is None:
+                    all_sent = True
+                else:
+                    ready.add(item)
+                    converted += 1
+            except queue.Empty:
+                pass
 
-    emit('-Img_Conversion-', 1.4)
-    logger.info("Completed Image Processing")
-
-    # Creating the ffmpeg run command
-    if len(os.listdir(vid_cache_folder_m4a)) > 0:
-        re_options = (
-            f"-i {os.path.join(vid_cache_folder_m4a, 'audio.m4a')} "
-            f"-r {details['frame_rate']} "
-            f"-i {os.path.join(vid_processed_folder, '%01d.png')} "
-            f"-crf 20 -pix_fmt yuv420p {output}"
-        )
-    else:
-        re_options = (
-            f"-r {details['frame_rate']} -i {os.path.join(vid_processed_folder, '%01d.png')} "
-            f"-crf 20 -pix_fmt yuv420p {output}"
-        )
-    logger.debug("The ffmpeg converted join command: " + re_options)
-    ffmpeg_manager.ffmpeg_runner(re_options)
-
-    emit('-Img_Conversion-', 1.8)
-    logger.info("Video Created")
-
-    # Cleaning up the cache folders
-    cleanup_folders()
+            while encoder.next_frame in ready:
+                number = encoder.next_frame
+                ready.remove(number)
+                with Image.open(processed_path(number)) as img:
+                    img = img.convert("RGBA")
+                    encoder.write(img.tobytes(), img.size)
+                os.remove(processed_path(number))
+                budget.release()
+                emit('-Image_Done-', None)
+            if all_sent and converted == dispatched[0] and ready:
+                raise RuntimeError(f"Frame {encoder.next_frame} of the video is missing")
+
+            iter_count += 1
+            if window is not None and iter_count % 10 == 0:
+                done_count = encoder.next_frame - 1
+                window['-Number_Of_Frames-'](done_count / max(1, frame_count) * 100)
+                window['-Number_Of_Frames_Text-'](f"{done_count}/{frame_count}")
+
+        if encoder.next_frame - 1 != frame_count:
+            # The video is cut short or broken
+            emit('-Image_Count-', encoder.next_frame - 1)
+        emit('-Img_Conversion-', 1.4)
+        logger.info("Completed Image Processing")
+
+        encoder.finish(output, audio_source)
+        emit('-Img_Conversion-', 1.8)
+        logger.info("Video Created")
+    except BaseException:
+        stop.set()
+        # The pool may still be busy with the frames of this video
+        worker_pool.shutdown_pool()
+        raise
+    finally:
+        stop.set()
+        for extractor in extractors:
+            if extractor.poll() is None:
+                extractor.kill()
+        encoder.kill()
+
+    job.remove()
     logger.info("Cleaning Cache")
+    emit('-Img_Conversion-', 2)
+    logger.info("Video Conversion Completed!")
 
+
+# Same as vid_manager, but the decoded frames are read straight from ffmpeg's stdout,
+# rendered in memory by the workers, and written straight into the stdin of the encoding ffmpeg
+def vid_manager_pipe(
+    emit: Callable[[str, Any], None],
+    filepath: str,
+    output: str,
+    manipulation: str,
+    scale: Union[str, float, int],
+    details: dict
+):
+    process_count = details['process_count']
+    frame_rate = details['frame_rate']
+    width, height = ffmpeg_manager.get_resolution(filepath)
+    frame_count = ffmpeg_manager.get_frame_count(filepath, frame_rate)
+    # Exact frame count, the frames are resampled by the fps filter
+    emit('-Image_Count-', frame_count)
+
+    audio_source = filepath if ffmpeg_manager.has_audio(filepath) else None
+    job = video_job.VideoJob.open(filepath, manipulation, scale, details, details.get('resume', False))
+    logger.info(f"Job folder: {job.folder}")
+
+    # Only whole parts of the output are in the manifest, so the conversion goes on from the first part that is missing
+    start_number = job.resume_point(frame_count)
+    if start_number > 1:
+        logger.info(f"Resuming, {start_number - 1} frames already converted")
+    for _ in range(1, min(start_number, frame_count + 1)):
+        emit('-Image_Done-', None)
+
+    reader = None
+    if start_number <= frame_count:
+        segment = None
+        if start_number > 1:
+            segment = video_metadata.plan_segments(filepath, frame_rate, 1, start_number)[0]
+        reader = ffmpeg_manager.open_frame_reader(filepath, frame_rate, segment)
+    encoder = video_job.CheckpointedEncoder(job, frame_rate, start_number)
+    # The chunks of frames being rendered, in order. Only a few are kept in flight, so the decoded frames
+    # don't pile up in memory when the workers are slower than ffmpeg
+    in_flight = deque()
+    chunk_frames = DELTA_CHUNK_FRAMES if details.get('delta') or details.get('skip_duplicates') else 1
+    default_limit = max(process_count + 1, process_count * 2 // chunk_frames) * chunk_frames
+    max_in_flight = max(1, in_flight_limit(details, default_limit) // chunk_frames)
+    last_rendered = None
+    skipped = 0
+
+    def write_next_chunk():
+        nonlocal last_rendered, skipped
+        for result in in_flight.popleft().get():
+            if result is None:
+                # A duplicate frame, the encoder just gets the previous frame again
+                skipped += 1
+                emit('-Frames_Skipped-', skipped)
+            else:
+                last_rendered = result
+            encoder.write(*last_rendered)
+            emit('-Image_Done-', None)
+
+    try:
+        process_pool, _ = worker_pool.get_pool(process_count)
+        frames_read = start_number - 1
+        chunk = []
+        previous_frame = None
+        frames = ffmpeg_manager.read_frames(reader, width, height) if reader is not None else ()
+        for frame in frames:
+            chunk.append(frame)
+            frames_read += 1
+            emit('-Img_Conversion-', min(1, frames_read / max(1, frame_count)))
+            if len(chunk) < chunk_frames:
+                continue
+            in_flight.append(process_pool.apply_async(
+                render_frames, (chunk, (width, height), manipulation, scale, details, previous_frame)
+            ))
+            if details.get('skip_duplicates'):
+                previous_frame = chunk[-1]
+            chunk = []
+            while len(in_flight) > max_in_flight:
+                write_next_chunk()
+        if chunk:
+            in_flight.append(process_pool.apply_async(
+                render_frames, (chunk, (width, height), manipulation, scale, details, previous_frame)
+            ))
+        ffmpeg_manager.check_frames_read(frames_read, frame_count)
+        logger.info("Converted Video to images")
+        emit('-Img_Conversion-', 1)
+
+        while in_flight:
+            write_next_chunk()
+        emit('-Img_Conversion-', 1.4)
+        logger.info(f"Completed Image Processing, {skipped} duplicate frames skipped")
+
+        encoder.finish(output, audio_source)
+        emit('-Img_Conversion-', 1.8)
+        logger.info("Video Created")
+    except BaseException:
+        # The pool may still be busy with the frames of this video
+        worker_pool.shutdown_pool()
+        raise
+    finally:
+        if reader is not None and reader.poll() is None:
+            reader.kill()
+        encoder.kill()
+
+    job.remove()
     emit('-Img_Conversion-', 2)
     logger.info("Video Conversion Completed!")
 
 
-# Cleans up cache
-def cleanup_folders():
-    cache_png_files = os.listdir(vid_cache_folder_png)
-    for file in cache_png_files:
-        os.remove(os.path.join(vid_cache_folder_png, file))
+# Exports the video as one archive of schematics (see schem_animation)
+# The frames are piped from ffmpeg like in vid_manager_pipe, the workers match them to blocks,
+# and the archive only gets the blocks that changed since the previous frame
+def vid_manager_schematic(
+    emit: Callable[[str, Any], None],
+    filepath: str,
+    output: str,
+    manipulation: str,
+    scale: Union[str, float, int],
+    details: dict
+):
+    # The archive is one stream of frames that only hold what changed since the previous one,
+    # so it can't be resumed or decoded in segments: it is always made from the start, with one decoder
+    if details.get('resume'):
+        logger.warning("Resuming is not supported for schematic animations, the export starts from the beginning")
+    if (details.get('decode_segments') or 0) > 1:
+        logger.warning("Segmented decoding is not supported for schematic animations, one decoder is used")
+
+    process_count = details['process_count']
+    frame_rate = details['frame_rate']
+    width, height = ffmpeg_manager.get_resolution(filepath)
+    frame_count = ffmpeg_manager.get_frame_count(filepath, frame_rate)
+    emit('-Image_Count-', frame_count)
+
+    reader = ffmpeg_manager.open_frame_reader(filepath, frame_rate)
+    animation = schem_animation.SchematicAnimationWriter(output, frame_rate)
+    # Same as in vid_manager_pipe, only a few frames are in flight at a time
+    in_flight = deque()
+    max_in_flight = max(1, in_flight_limit(details, process_count * 2))
+
+    def write_next_frame():
+        for schem in in_flight.popleft().get():
+            animation.add_frame(schem)
+            emit('-Image_Done-', None)
+
+    try:
+        process_pool, _ = worker_pool.get_pool(process_count)
+        frames_read = 0
+        for frame in ffmpeg_manager.read_frames(reader, width, height):
+            frames_read += 1
+            emit('-Img_Conversion-', min(1, frames_read / max(1, frame_count)))
+            in_flight.append(process_pool.apply_async(
+                frame_schematics, ([frame], (width, height), manipulation, scale, details)
+            ))
+            while len(in_flight) > max_in_flight:
+                write_next_frame()
+        ffmpeg_manager.check_frames_read(frames_read, frame_count)
+        logger.info("Converted Video to images")
+        emit('-Img_Conversion-', 1)
+
+        while in_flight:
+            write_next_frame()
+        emit('-Img_Conversion-', 1.4)
+        logger.info(f"Completed Image Processing, {len(animation.keyframes)} keyframes")
+
+        animation.close()
+        emit('-Img_Conversion-', 1.8)
+        logger.info("Schematic Animation Created")
+    except BaseException:
+        worker_pool.shutdown_pool()
+        raise
+    finally:
+        if reader.poll() is None:
+            reader.kill()
+        # (When the conversion failed, the frames done so far still make a valid archive)
+        animation.close()
 
-    cache_jpg_files = os.listdir(vid_cache_folder_jpg)
-    for file in cache_jpg_files:
-        os.remove(os.path.join(vid_cache_folder_jpg, file))
+    emit('-Img_Conversion-', 2)
+    logger.info("Video Conversion Completed!")
 
-    cache_processed_files = os.listdir(vid_processed_folder)
-    for file in cache_processed_files:
-        os.remove(os.path.join(vid_processed_folder, file))
 
-    audio_processed_files = os.listdir(vid_cache_folder_m4a)
-    for file in audio_processed_files:
-        os.remove(os.path.join(vid_cache_folder_m4a, file))
+# Matches raw rgba frames to blocks in a worker, one schematic per frame
+def frame_schematics(
+    frames: list[bytes],
+    size: tuple[int, int],
+    manipulation: str,
+    scale: Union[str, float, int],
+    details: dict
+) -> list[schem_writer.IndexedSchematic]:
+    return [render_schematic(_scaled_frame(frame, size, scale), manipulation, details) for frame in frames]
 
 
-# Running this for every single frame
+# Renders consecutive raw rgba frames in a worker, and gives back the raw rgba bytes of every output with its size
+# In delta mode, every frame after the first one only redraws what changed
+# When skipping duplicates, the duplicate frames give None instead (the previous output is repeated),
+# previous_frame being the frame right before the chunk, so the first frame can be a duplicate too
+def render_frames(
+    frames: list[bytes],
+    size: tuple[int, int],
+    manipulation: str,
+    scale: Union[str, float, int],
+    details: dict,
+    previous_frame: bytes | None = None
+) -> list[tuple[bytes, tuple[int, int]] | None]:
+    renderer = DeltaRenderer(manipulation, details) if details.get('delta') else None
+    duplicates = None
+    if details.get('skip_duplicates'):
+        duplicates = frame_dedupe.DuplicateFrameDetector(details.get('skip_threshold') or 0)
+        if previous_frame is not None:
+            duplicates.remember_exact(np.asarray(_scaled_frame(previous_frame, size, scale)))
+
+    rendered = []
+    for frame in frames:
+        img = _scaled_frame(frame, size, scale)
+        if duplicates is not None and duplicates.is_duplicate(np.asarray(img)):
+            rendered.append(None)
+        elif renderer is not None:
+            out = renderer.render(img)
+            rendered.append((out.tobytes(), (out.shape[1], out.shape[0])))
+        else:
+            for value in render_tiles(img, manipulation, details):
+                if isinstance(value, Image.Image):
+                    rendered.append((value.tobytes(), value.size))
+    return rendered
+
+
+# A raw rgba frame, scaled down to one pixel per block
+def _scaled_frame(frame: bytes, size: tuple[int, int], scale: Union[str, float, int]) -> Image.Image:
+    # Same as reading a png frame from the cache folder
+    img = Image.frombuffer("RGBA", size, frame, "raw", "RGBA", 0, 1).convert("RGB")
+    return scale_to_tiles(img, scale)
+
+
+# details['decode_segments'] (0 or missing means automatic, based on the length of the video)
+def decode_segment_count(filepath: str, details: dict) -> int:
+    requested = details.get('decode_segments') or 0
+    if requested > 0:
+        return requested
+    duration = video_metadata.probe_video(filepath).duration
+    return max(1, min(MAX_AUTO_SEGMENTS, int(duration // SECONDS_PER_SEGMENT)))
+
+
+# Running this for every single frame (in a worker of worker_pool)
 def manage_single_image(
-    event_queue: Queue,
     filename: str,
     output: str,
     manipulation: str,
@@ -274,5 +573,5 @@ def manage_single_image(
             if isinstance(values, str):
                 pass
             else:
-                event_queue.put(['-Single_Frame-', values / image_size * 100])
-    event_queue.put(['-Image_Done-', output])
+                worker_pool.worker_event_queue.put(['-Single_Frame-', values / image_size * 100])
+    worker_pool.worker_event_queue.put(['-Image_Done-', output])
@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import time
+from typing import Union
+
+from src.logic.vid_logic import ffmpeg_manager, video_metadata
+from src.path_manager.pather import resource_path
+
+# Every video conversion works in its own job folder, named after a hash of the input video and the settings
+# The folder holds everything the conversion writes before the final video (frames, encoded parts of the output),
+# and a manifest of the frames that are done, so an interrupted conversion can be resumed where it stopped.
+# Two conversions of different videos (or with different settings) never touch each other's files.
+
+jobs_folder = os.path.normpath(resource_path("./assets/cache/jobs/"))
+
+# Settings that change how fast a video is converted, but not the frames it gives
+SPEED_DETAILS = ('process_count', 'decode_segments', 'resume', 'max_in_flight')
+
+# The output is encoded in parts of this many frames, and every finished part is a checkpoint
+# an interrupted conversion can be resumed from (the parts are joined without re-encoding at the end)
+CHECKPOINT_FRAMES = 300
+
+# Jobs that were not touched for this long are removed when a new job starts (they are never going to be resumed)
+JOB_EXPIRY_SECONDS = 7 * 24 * 60 * 60
+
+
+def job_key(filepath: str, manipulation: str, scale: Union[str, float, int], details: dict) -> str:
+    stat = os.stat(filepath)
+    settings = {key: value for key, value in details.items() if key not in SPEED_DETAILS}
+    data = json.dumps(
+        [os.path.abspath(filepath), stat.st_mtime_ns, stat.st_size, manipulation, scale, settings],
+        sort_keys=True, default=str
+    )
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()[:32]
+
+
+class VideoJob:
+    def __init__(self, folder: str):
+        self.folder = folder
+        # Frames extracted by ffmpeg, and the same frames converted to blocks (cache folder mode)
+        # Only the frames between extraction and encoding are in there, they are removed once encoded
+        self.frames_folder = os.path.join(folder, "frames")
+        self.processed_folder = os.path.join(folder, "processed")
+        # Encoded parts of the output video
+        self.chunks_folder = os.path.join(folder, "chunks")
+        self.info_path = os.path.join(folder, "job.json")
+        # One frame number per line, appended as soon as the part of the output with the frame is encoded
+        self.manifest_path = os.path.join(folder, "done.txt")
+
+    # The job of this video and settings. Unless resuming, whatever a previous run left in it is thrown away
+    @classmethod
+    def open(
+            cls, filepath: str, manipulation: str, scale: Union[str, float, int], details: dict, resume: bool = False
+    ) -> 'VideoJob':
+        remove_expired_jobs()
+        job = cls(os.path.join(jobs_folder, job_key(filepath, manipulation, scale, details)))
+        if not resume:
+            job.remove()
+        # The frames that were in flight when a previous run stopped are done again (only encoded parts are resumed)
+        for folder in (job.frames_folder, job.processed_folder):
+            shutil.rmtree(folder, ignore_errors=True)
+        for folder in (job.frames_folder, job.processed_folder, job.chunks_folder):
+            os.makedirs(folder, exist_ok=True)
+        if not os.path.exists(job.info_path):
+            # Only there to tell what the folder is for
+            with open(job.info_path, "w", encoding="utf-8") as f:
+                json.dump({
+                    'input': os.path.abspath(filepath),
+                    'manipulation': manipulation,
+                    'scale': scale,
+                    'frame_count': video_metadata.output_frame_count(
+                        video_metadata.probe_video(filepath), details['frame_rate']
+                    )
+                }, f, indent=2, default=str)
+        return job
+
+    # The frame numbers in the manifest
+    def completed(self) -> set[int]:
+        if not os.path.exists(self.manifest_path):
+            return set()
+        with open(self.manifest_path, "r", encoding="utf-8") as f:
+            # The last line can be cut short if the previous run was killed while writing it
+            return {int(line) for line in f.read().split("\n")[:-1] if line.isdigit()}
+
+    def mark_done(self, *frame_numbers: int):
+        # A single write, so a chunk of frames is either fully in the manifest or not at all
+        with open(self.manifest_path, "a", encoding="utf-8") as f:
+            f.write("".join(f"{number}\n" for number in frame_numbers))
+
+    # The first frame that is not done, out of frame_count frames (frame_count + 1 when they are all done)
+    def first_missing(self, frame_count: int, completed: set[int] | None = None) -> int:
+        completed = self.completed() if completed is None else completed
+        return next((number for number in range(1, frame_count + 1) if number not in completed), frame_count + 1)
+
+    # The first frame of the first part of the output that is not done
+    def resume_point(self, frame_count: int) -> int:
+        return (self.first_missing(frame_count) - 1) // CHECKPOINT_FRAMES * CHECKPOINT_FRAMES + 1
+
+    def remove(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+
+# Encodes the frames of a job (given in order, as raw rgba) into parts of CHECKPOINT_FRAMES frames,
+# marks the frames of every finished part as done, and joins the parts into the output at the end
+class CheckpointedEncoder:
+    def __init__(self, job: VideoJob, frame_rate: float, start_number: int = 1):
+        self.job = job
+        self.frame_rate = frame_rate
+        # Number of the next frame written
+        self.next_frame = start_number
+        self.writer: subprocess.Popen | None = None
+
+    def part_path(self, number: int) -> str:
+        return os.path.join(self.job.chunks_folder, f"{number}.mp4")
+
+    def write(self, rendered: bytes, size: tuple[int, int]):
+        # The encoder of every part is started with its first frame, once the output size is known
+        if self.writer is None:
+            self.writer = ffmpeg_manager.open_frame_writer(
+                self.part_path((self.next_frame - 1) // CHECKPOINT_FRAMES), self.frame_rate, size[0], size[1]
+            )
+        self.writer.stdin.write(rendered)
+        self.next_frame += 1
+        if (self.next_frame - 1) % CHECKPOINT_FRAMES == 0:
+            self._finish_part()
+
+    # The part the writer is encoding is done, it goes into the manifest
+    def _finish_part(self):
+        writer, self.writer = self.writer, None
+        writer.stdin.close()
+        writer.wait()
+        if writer.returncode != 0:
+            raise RuntimeError(f"Encoding the video failed (ffmpeg exited with {writer.returncode})")
+        part_start = (self.next_frame - 2) // CHECKPOINT_FRAMES * CHECKPOINT_FRAMES + 1
+        self.job.mark_done(*range(part_start, self.next_frame))
+
+    # Joins the parts (and adds the audio)
+    def finish(self, output: str, audio_source: str | None = None):
+        if self.writer is not None:
+            self._finish_part()
+        part_count = (self.next_frame - 2) // CHECKPOINT_FRAMES + 1
+        ffmpeg_manager.concat_chunks(
+            [self.part_path(number) for number in range(part_count)],
+            os.path.join(self.job.folder, "chunks.txt"),
+            output,
+            audio_source
+        )
+
+    def kill(self):
+        if self.writer is not None and self.writer.poll() is None:
+            self.writer.kill()
+
+
+def remove_expired_jobs():
+    if not os.path.isdir(jobs_folder):
+        return
+    now = time.time()
+    for name in os.listdir(jobs_folder):
+        folder = os.path.join(jobs_folder, name)
+        manifest = os.path.join(folder, "done.txt")
+        last_used = os.path.getmtime(manifest if os.path.exists(manifest) else folder)
+        if now - last_used > JOB_EXPIRY_SECONDS:
+            shutil.rmtree(folder, ignore_errors=True)
@@ -0,0 +1,179 @@
+import bisect
+import math
+import os
+from fractions import Fraction
+from typing import NamedTuple
+
+import ffmpeg
+
+# Everything the video pipeline needs to know about an input video, from a single ffprobe
+# Probing runs a whole ffprobe process, so the results are cached per file (path, modification time and size),
+# and the GUI can ask for the frame count every time the frame rate slider moves
+
+
+class VideoMetadata(NamedTuple):
+    # Index of the video stream that gets converted (in the ffprobe/ffmpeg stream numbering)
+    stream_index: int
+    # Size of the decoded frames (with the rotation already applied, like ffmpeg does)
+    width: int
+    height: int
+    # Of the video stream, in seconds
+    start_time: Fraction
+    duration: Fraction
+    has_audio: bool
+
+
+# A part of the video, decoded by its own ffmpeg (see plan_segments)
+class DecodeSegment(NamedTuple):
+    # The keyframe the decode seeks to, in seconds (None: from the start of the file)
+    seek_time: Fraction | None
+    # The first output frame of the segment, in ticks of 1/frame_rate (since time 0 of the file)
+    first_tick: int
+    # None for the last segment, which goes to the end of the video
+    frame_count: int | None
+    # Number of its first frame in the whole video (frames are numbered from 1)
+    start_number: int
+
+
+_probe_cache: dict[tuple[str, int, int], VideoMetadata] = {}
+_keyframe_cache: dict[tuple[str, int, int], list[Fraction]] = {}
+
+
+def _cache_key(vid_path: str) -> tuple[str, int, int]:
+    stat = os.stat(vid_path)
+    return os.path.abspath(vid_path), stat.st_mtime_ns, stat.st_size
+
+
+def probe_video(vid_path: str) -> VideoMetadata:
+    key = _cache_key(vid_path)
+    if key not in _probe_cache:
+        _probe_cache[key] = _probe(vid_path)
+    return _probe_cache[key]
+
+
+# Timestamps of the keyframes of the video stream, the points where a decode can start from
+# Only reads the packets (no decoding), but that is still the whole file, so it is cached like the probe
+def keyframe_times(vid_path: str) -> list[Fraction]:
+    key = _cache_key(vid_path)
+    if key not in _keyframe_cache:
+        stream_index = probe_video(vid_path).stream_index
+        data = ffmpeg.probe(vid_path, select_streams=str(stream_index), show_entries='packet=pts_time,flags')
+        _keyframe_cache[key] = sorted(
+            Fraction(packet['pts_time']) for packet in data.get('packets', [])
+            if 'K' in packet.get('flags', '') and packet.get('pts_time', 'N/A') != 'N/A'
+        )
+    return _keyframe_cache[key]
+
+
+def _probe(vid_path: str) -> VideoMetadata:
+    data = ffmpeg.probe(vid_path)
+    streams = data['streams']
+    # Cover art is stored as a (single frame) video stream too
+    videos = [
+        stream for stream in streams
+        if stream.get('codec_type') == 'video' and not stream.get('disposition', {}).get('attached_pic')
+    ]
+    if not videos:
+        raise ValueError(f"No video stream found in {vid_path}")
+    # Same choice as ffmpeg makes by default: the video stream with the most pixels
+    video = max(videos, key=lambda stream: stream['width'] * stream['height'])
+
+    width, height = video['width'], video['height']
+    if _rotation(video) % 180 == 90:
+        width, height = height, width
+
+    start_time = Fraction(video.get('start_time') or data['format'].get('start_time') or 0)
+    if 'duration' in video:
+        duration = Fraction(video['duration'])
+    else:
+        # Some containers (mkv, webm) only have the duration of the whole file
+        duration = Fraction(data['format']['duration']) - max(0, start_time - Fraction(data['format'].get('start_time') or 0))
+
+    return VideoMetadata(
+        stream_index=video['index'],
+        width=width,
+        height=height,
+        start_time=start_time,
+        duration=duration,
+        has_audio=any(stream.get('codec_type') == 'audio' for stream in streams)
+    )
+
+
+def _rotation(video: dict) -> int:
+    for side_data in video.get('side_data_list', []):
+        if 'rotation' in side_data:
+            return int(side_data['rotation'])
+    return int(video.get('tags', {}).get('rotate', 0))
+
+
+# The exact number of frames the fps filter outputs for this frame rate
+def output_frame_count(metadata: VideoMetadata, frame_rate: float) -> int:
+    first_tick, end_tick = _tick_range(metadata, Fraction(str(frame_rate)))
+    return end_tick - first_tick
+
+
+# The fps filter outputs a frame for every 1/frame_rate tick, from the (rounded) start of the video to its (rounded) end
+# (The timestamps of the file are kept as they are with -copyts, so the ticks are counted from time 0 of the file)
+def _tick_range(metadata: VideoMetadata, rate: Fraction) -> tuple[int, int]:
+    first_tick = _round_half_up(metadata.start_time * rate)
+    end_tick = _round_half_up((metadata.start_time + metadata.duration) * rate)
+    return first_tick, max(first_tick, end_tick)
+
+
+# Splits the frames of the video into (at most) segment_count segments, which can be decoded at the same time
+# Every segment but the first seeks to a keyframe, and starts at the tick right after it:
+# the frame the fps filter picks for that tick only depends on frames from the keyframe on,
+# so the segments give exactly the same frames as one decode of the whole video
+# With a start_number, the segments only cover the frames from that one on (to resume a conversion)
+def plan_segments(
+        vid_path: str, frame_rate: float, segment_count: int, start_number: int = 1
+) -> list[DecodeSegment]:
+    rate = Fraction(str(frame_rate))
+    first_tick, end_tick = _tick_range(probe_video(vid_path), rate)
+    start_tick = first_tick + start_number - 1
+
+    seek_times = {}
+    if segment_count > 1 or start_number > 1:
+        # Tick every keyframe would start a segment at (the last keyframe wins if a few share a tick)
+        seek_times = {_round_half_up(keyframe * rate) + 1: keyframe for keyframe in keyframe_times(vid_path)}
+    all_ticks = sorted(seek_times)
+
+    # The first segment seeks to the last keyframe before its first frame (if it does not start with the video)
+    first_seek = None
+    if start_number > 1:
+        before = bisect.bisect_right(all_ticks, start_tick)
+        if before:
+            first_seek = seek_times[all_ticks[before - 1]]
+
+    boundaries = [start_tick]
+    if segment_count > 1:
+        # No segment gets less than half of its share of the frames
+        min_length = max(1, (end_tick - start_tick) // (2 * segment_count))
+        ticks = [tick for tick in all_ticks if start_tick + min_length <= tick <= end_tick - min_length]
+        for segment in range(1, segment_count):
+            ideal = start_tick + (end_tick - start_tick) * segment // segment_count
+            # The keyframe ticks closest to the ideal split (before and after it), far enough from the previous split
+            after_previous = bisect.bisect_left(ticks, boundaries[-1] + min_length)
+            closest = bisect.bisect_left(ticks, ideal, lo=after_previous)
+            candidates = ticks[max(after_previous, closest - 1):closest + 1]
+            if not candidates:
+                break
+            boundaries.append(min(candidates, key=lambda tick: abs(tick - ideal)))
+
+    segments = []
+    for number, tick in enumerate(boundaries):
+        last = number == len(boundaries) - 1
+        segments.append(DecodeSegment(
+            seek_time=seek_times[tick] if number else first_seek,
+            first_tick=tick,
+            frame_count=None if last else boundaries[number + 1] - tick,
+            start_number=tick - first_tick + 1
+        ))
+    return segments
+
+
+def _round_half_up(value: Fraction) -> int:
+    # Halves go away from zero, like ffmpeg's rounding
+    if value < 0:
+        return -_round_half_up(-value)
+    return math.floor(value + Fraction(1, 2))
@@ -0,0 +1,80 @@
+import atexit
+import logging
+from multiprocessing import Pool, Queue, shared_memory
+from multiprocessing.pool import Pool as PoolType
+from multiprocessing.queues import Queue as QueueType
+
+import numpy as np
+
+from src.logic.image_logic import img_to_blocks
+
+logger = logging.getLogger(__name__)
+
+# One pool of worker processes kept alive between videos (GUI sessions, CLI batches)
+# Starting a pool means every worker imports the whole image logic again, so it is only done
+# when the process count changes. The block textures are put in shared memory once, and every
+# worker maps them in its initializer, instead of loading its own copy from disk.
+
+_pool: PoolType | None = None
+_pool_processes = 0
+_textures_memory: shared_memory.SharedMemory | None = None
+_event_queue: QueueType | None = None
+
+# Set in every worker by _init_worker
+worker_event_queue: QueueType | None = None
+_worker_textures_memory: shared_memory.SharedMemory | None = None
+
+
+def _init_worker(memory_name: str, shape: tuple, keys: list[str], event_queue: QueueType):
+    global worker_event_queue, _worker_textures_memory
+    worker_event_queue = event_queue
+    # Kept in a global, the texture arrays are views of it
+    _worker_textures_memory = shared_memory.SharedMemory(name=memory_name)
+    textures = np.ndarray(shape, dtype=np.uint8, buffer=_worker_textures_memory.buf)
+    textures.flags.writeable = False
+    img_to_blocks.set_block_textures(keys, textures)
+
+
+# Gives the pool (starting it if needed) and the queue the workers send their progress events into
+def get_pool(process_count: int) -> tuple[PoolType, QueueType]:
+    global _pool, _pool_processes, _textures_memory, _event_queue
+    if _pool is not None and _pool_processes == process_count:
+        # Leftover events of a previous (failed) job
+        while not _event_queue.empty():
+            _event_queue.get_nowait()
+        return _pool, _event_queue
+
+    shutdown_pool()
+    keys, textures = img_to_blocks.load_block_textures()
+    _textures_memory = shared_memory.SharedMemory(create=True, size=textures.nbytes)
+    np.ndarray(textures.shape, dtype=np.uint8, buffer=_textures_memory.buf)[...] = textures
+    _event_queue = Queue()
+    _pool = Pool(
+        processes=process_count,
+        initializer=_init_worker,
+        initargs=(_textures_memory.name, textures.shape, keys, _event_queue)
+    )
+    _pool_processes = process_count
+    logger.info(f"Started a pool of {process_count} workers")
+    return _pool, _event_queue
+
+
+# Stops the workers and frees the shared textures
+# Also used when a job fails, so the next one does not get the leftover tasks
+def shutdown_pool():
+    global _pool, _pool_processes, _textures_memory, _event_queue
+    if _pool is not None:
+        _pool.terminate()
+        _pool.join()
+        _pool = None
+        _pool_processes = 0
+    if _textures_memory is not None:
+        _textures_memory.close()
+        _textures_memory.unlink()
+        _textures_memory = None
+    if _event_queue is not None:
+        _event_queue.close()
+        _event_queue = None
+
+
+atexit.register(shutdown_pool)
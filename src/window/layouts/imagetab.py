@@ -1,14 +1,14 @@
 from src.ui_manager import PySimpleGUI as sg
 import textwrap
 from src.path_manager.pather import resource_path
-import json
+from src.logic.image_logic.dithering import DITHER_METHODS, DEFAULT_DITHER_METHOD
+from src.logic.image_logic import palette_bundle
 
 # TODO: Black/white list will be all blocks name in a list, and clicking them changes colour to indicate its been
 #  selected
 path = resource_path("./assets/blocks/all_blocks_textures/")
-with open(resource_path("./assets/blocks/img_generator_code/names_list.json"), "r") as f:
-    blocks_data: list = list(json.load(f).keys())
-    blocks_data.sort()
+# The blocks of the palette bundle (see palette_bundle), so the blocks of an added resource pack show up too
+blocks_data: list = sorted(palette_bundle.load_bundle().names)
 
 
 def get_image_tab(window_size: list[int]):
@@ -68,9 +68,18 @@ def get_image_tab(window_size: list[int]):
                         sg.Checkbox(
                             "Dithering",
                             tooltip="Dithering is useful in preserving details, but makes things look faded"
-                                    "\nIt disables the brightness slider and alternate renderer checkbox",
+                                    "\nIt disables the alternate renderer checkbox",
                             key="-Img_Dithering-",
                             enable_events=True
+                        ),
+                        sg.Combo(
+                            list(DITHER_METHODS),
+                            tooltip="The bayer ones are a fixed pattern, they flicker less in videos",
+                            key="-Img_Dither_Method-",
+                            default_value=DEFAULT_DITHER_METHOD,
+                            readonly=True,
+                            background_color="#00000000",
+                            enable_events=True
                         )
                     ],
                     [
@@ -163,6 +172,30 @@ def get_image_tab(window_size: list[int]):
                                 "CIE76 DelE"
                             ], default_values=["Absolute Difference"], size=(20, 4), enable_events=True,
                                 key="-Comparison_Method-")
+                        ],
+                        [
+                            sg.Text(
+                                "Dithering",
+                                tooltip="Spreads the difference between every pixel and its block to the blocks "
+                                        "around it\nThe bayer ones are a fixed pattern, the others diffuse the error"
+                            ),
+                            sg.Combo(
+                                ["None"] + list(DITHER_METHODS),
+                                key="-Img_Any_Dither-",
+                                default_value="None",
+                                readonly=True,
+                                background_color="#00000000",
+                                enable_events=True
+                            ),
+                            sg.Combo(
+                                ["RGB", "Lab"],
+                                tooltip="The colour space the error is spread in",
+                                key="-Img_Any_Dither_Space-",
+                                default_value="RGB",
+                                readonly=True,
+                                background_color="#00000000",
+                                enable_events=True
+                            )
                         ]
                     ])]
                 ]
@@ -1,12 +1,12 @@
 from src.ui_manager import PySimpleGUI as sg
 import textwrap
 from src.path_manager.pather import resource_path
-import json
+from src.logic.image_logic.dithering import DITHER_METHODS, DEFAULT_DITHER_METHOD
+from src.logic.image_logic import palette_bundle
 
 path = resource_path("./assets/blocks/all_blocks_textures/")
-with open(resource_path("./assets/blocks/img_generator_code/names_list.json"), "r") as f:
-    blocks_data: list = list(json.load(f).keys())
-    blocks_data.sort()
+# The blocks of the palette bundle (see palette_bundle), so the blocks of an added resource pack show up too
+blocks_data: list = sorted(palette_bundle.load_bundle().names)
 
 
 def get_video_tab():
@@ -69,8 +69,16 @@ def get_video_tab():
                     sg.Checkbox(
                         "Dithering",
                         tooltip="Dithering is useful in preserving details, but makes things look faded"
-                                "\nIt disables the brightness slider and alternate renderer checkbox",
+                                "\nIt disables the alternate renderer checkbox",
                         key="-Vid_Dithering-"
+                    ),
+                    sg.Combo(
+                        list(DITHER_METHODS),
+                        tooltip="The bayer ones are a fixed pattern, they flicker less (and convert faster)",
+                        key="-Vid_Dither_Method-",
+                        default_value=DEFAULT_DITHER_METHOD,
+                        readonly=True,
+                        background_color="#00000000"
                     )
                 ],
                 [
@@ -0,0 +1,25 @@
+import numpy as np
+from PIL import Image
+
+from src.logic.image_logic import dithering, image_to_redstone_lamps
+
+
+def _images():
+    rng = np.random.default_rng(0)
+    noise = rng.integers(0, 256, (45, 61, 3), dtype=np.uint8)
+    x = np.linspace(0, 255, 80)
+    gradient = np.stack(np.broadcast_arrays(x[None, :], x[:, None], x[::-1, None]), axis=-1).astype(np.uint8)
+    return [Image.fromarray(noise), Image.fromarray(gradient), Image.fromarray(noise).convert("RGBA")]
+
+
+def test_default_lamps_match_pillow():
+    for img in _images():
+        lit = image_to_redstone_lamps.lamps_lit_mask(
+            img, dithering.DEFAULT_BRIGHTNESS, dither=True, dither_method=dithering.DEFAULT_DITHER_METHOD
+        )
+        assert np.array_equal(lit, np.asarray(img.convert('1'), dtype=bool))
+
+
+def test_tone_curve_is_identity_at_default_brightness():
+    gray = np.arange(256)
+    assert np.array_equal(dithering.tone_curve(gray, dithering.DEFAULT_BRIGHTNESS), gray)
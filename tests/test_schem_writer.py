@@ -0,0 +1,46 @@
+import nbtlib
+import numpy as np
+
+from src.logic.image_logic import schem_writer
+
+
+def _load(path):
+    schem = nbtlib.load(str(path))
+    palette = {str(state): int(index) for state, index in schem['Palette'].items()}
+    # Every id is below 128 here, so every varint is a single byte
+    data = np.asarray(schem['BlockData'], dtype=np.uint8)
+    return schem, palette, data
+
+
+def test_equal_states_are_merged(tmp_path):
+    palette = ["minecraft:stone", "minecraft:structure_block", "minecraft:dirt", "minecraft:structure_block"]
+    block_ids = np.array([[[0, 1, 2, 3]]])
+    path = tmp_path / "out.schem"
+    schem_writer.save_schem(str(path), block_ids, palette)
+
+    schem, loaded, data = _load(path)
+    assert int(schem['PaletteMax']) == len(loaded) == 3
+    assert sorted(loaded.values()) == [0, 1, 2]
+    by_id = {index: state for state, index in loaded.items()}
+    assert [by_id[i] for i in data] == [palette[i] for i in block_ids.reshape(-1)]
+
+
+def test_full_palette_merges_equal_states(tmp_path):
+    palette = ["minecraft:structure_void", "minecraft:structure_block", "minecraft:structure_block", "minecraft:stone"]
+    block_ids = np.array([[[2, 3, 0]]])
+    path = tmp_path / "out.schem"
+    schem_writer.save_schem(str(path), block_ids, palette, compact_palette=False)
+
+    schem, loaded, data = _load(path)
+    assert int(schem['PaletteMax']) == len(loaded) == 3
+    # The order of the first appearance is kept, so index 0 stays the structure void
+    assert loaded == {"minecraft:structure_void": 0, "minecraft:structure_block": 1, "minecraft:stone": 2}
+    assert data.tolist() == [1, 2, 0]
+
+
+def test_palette_without_equal_states_is_unchanged():
+    block_ids = np.array([0, 1, 1])
+    palette = ["minecraft:stone", "minecraft:dirt"]
+    merged_ids, merged_palette = schem_writer.merge_duplicate_states(block_ids, palette)
+    assert merged_ids is block_ids
+    assert merged_palette is palette